@@ -1,8 +1,15 @@
 import csv
 from collections import defaultdict
+from django.contrib.admin.filters import FieldListFilter
+from django.db.models import Count, Max
 from django.http import HttpResponse
 
+from magriculture.fncs.models.actors import Farmer, Identity
+from magriculture.fncs.models.geo import Market
+from magriculture.fncs.models.props import CropReceipt
+from magriculture.fncs.projection import Projection
 from magriculture.fncs.tasks import export_transactions
+from magriculture.fncs.utils import pk_ranges
 
 
 class EchoWriter(object):
@@ -74,12 +81,23 @@ class ExportAsCSV(object):
 
 
 class ExportAsCSVWithFK(object):
+    """
+    Export the `fields`, ``(field path, label)`` tuples where the path
+    may follow foreign keys like ``crop_receipt__farmer__actor__name``,
+    of the selected records as CSV.
+    """
     short_description = "Export selected records as CSV file"
 
     def __init__(self, fields, header=True):
         self.fields = fields
         self.header = header
 
+    def _csv_rows(self, projection, labels, queryset):
+        if self.header:
+            yield labels
+        for row in projection.rows(queryset):
+            yield row
+
     def __call__(self, modeladmin, request, queryset):
         """
         Generic csv export admin action.
@@ -89,29 +107,15 @@ class ExportAsCSVWithFK(object):
 
         field_names = [k for k, v in self.fields]
         labels = [v for k, v in self.fields]
+        projection = Projection(modeladmin.model, field_names)
 
-        response = HttpResponse(mimetype='text/csv')
+        writer = csv.writer(EchoWriter())
+        response = HttpResponse(
+            (writer.writerow(row) for row
+             in self._csv_rows(projection, labels, queryset)),
+            content_type='text/csv')
         response['Content-Disposition'] = ('attachment; filename=%s.csv'
                                            % unicode(opts).replace('.', '_'))
-
-        writer = csv.writer(response)
-        if self.header:
-            writer.writerow(labels)
-
-        for obj in queryset:
-            data = []
-            for field_name in field_names:
-                field_obj = obj
-                for name in field_name.split("__"):
-                    if hasattr(field_obj, name):
-                        field_obj = getattr(field_obj, name)
-                    else:
-                        field_obj = "ERROR!"
-                        break
-
-                data.append(field_obj)
-            data = [unicode(entry).encode('utf-8') for entry in data]
-            writer.writerow(data)
         return response
 
 
@@ -122,6 +126,44 @@ class ExportAsCSVWithFKTask(object):
         self.fields = fields
         self.header = header
 
+    def changelist_filters(self, modeladmin, request):
+        """
+        :returns: the lookups the admin changelist filters the records by,
+                  the same ones and with the same values the changelist
+                  uses, or `None` if some of its filtering can't be
+                  expressed as lookups.
+        """
+        ChangeList = modeladmin.get_changelist(request)
+        cl = ChangeList(
+            request, modeladmin.model, modeladmin.list_display,
+            modeladmin.list_display_links, modeladmin.list_filter,
+            modeladmin.date_hierarchy, modeladmin.search_fields,
+            modeladmin.list_select_related, modeladmin.list_per_page,
+            modeladmin.list_max_show_all, modeladmin.list_editable,
+            modeladmin)
+        # the page and error flag are left out of cl.params already
+        filter_specs, _, lookup_params, _ = cl.get_filters(request)
+        if cl.query:
+            return None
+        filters = dict(lookup_params)
+        for filter_spec in filter_specs:
+            if not isinstance(filter_spec, FieldListFilter):
+                return None
+            filters.update(filter_spec.used_parameters)
+        return filters
+
+    def filter_spec(self, modeladmin, request, queryset):
+        """
+        Describe the selected records for the task without pickling the
+        queryset: either the changelist's filters when all records are
+        selected or the ranges of the selected primary keys.
+        """
+        if request.POST.get('select_across') == '1':
+            filters = self.changelist_filters(modeladmin, request)
+            if filters is not None:
+                return {'filters': filters}
+        return {'pk_ranges': pk_ranges(queryset.values_list('pk', flat=True))}
+
     def __call__(self, modeladmin, request, queryset):
         """
         Fires off to celery for long running exports
@@ -129,11 +171,15 @@ class ExportAsCSVWithFKTask(object):
 
         field_names = [k for k, v in self.fields]
         labels = [v for k, v in self.fields]
+        # fail before queueing the task if the fields don't exist
+        Projection(modeladmin.model, field_names)
         modeladmin.message_user(
             request, "Exporting records, will be sent via email to shortly")
 
         return export_transactions.delay(
-            field_names, labels, queryset, request.user)
+            field_names, labels,
+            self.filter_spec(modeladmin, request, queryset),
+            request.user)
 
 
 class ExportFarmersAsCSV(object):
@@ -148,25 +194,83 @@ class ExportFarmersAsCSV(object):
     * The first markets associated with the farmer
     * The number of markets associated with the farmer
     * The ID and name of the crop which the farmer has sold the most often.
+
+    Farmers are read `chunk_size` at a time with the same number of
+    queries for every chunk.
     """
     short_description = "Custom export of selected farmers as CSV file"
+    # the farmer ids of a chunk are the variables of its queries, which
+    # SQLite limits to 999 per statement, see fncs.utils.bulk_create
+    chunk_size = 900
+    # like Actor.get_msisdns, only the latest few are counted
+    msisdn_limit = 3
 
-    def _get_most_sold_crop(self, farmer):
+    def _get_msisdns(self, actor_ids):
         """
-        Find the crop the farmer has sold the most often.
+        Map actor ids to their latest MSISDNs, newest first.
         """
-        crops_sold = defaultdict(int)
-        most_sold_crop = None
-        most_amount_sold = 0
-
-        for receipt in farmer.cropreceipt_set.all():
-            crop = receipt.crop
-            crops_sold[crop.id] += 1
-            if crops_sold[crop.id] > most_amount_sold:
-                most_sold_crop = crop
-                most_amount_sold = crops_sold[crop.id]
-
-        return most_amount_sold, most_sold_crop
+        msisdns = defaultdict(list)
+        identities = Identity.objects.filter(actor__in=actor_ids).order_by(
+            'actor', '-created_at').values_list('actor_id', 'msisdn')
+        for actor_id, msisdn in identities:
+            if len(msisdns[actor_id]) < self.msisdn_limit:
+                msisdns[actor_id].append(msisdn)
+        return msisdns
+
+    def _get_market_names(self, farmer_ids):
+        """
+        Map farmer ids to the names of their markets, in market order.
+        """
+        names = defaultdict(list)
+        through = Farmer.markets.through
+        markets = through.objects.filter(farmer__in=farmer_ids).order_by(
+            *['market__%s' % field for field in Market._meta.ordering]
+        ).values_list('farmer_id', 'market__name')
+        for farmer_id, name in markets:
+            names[farmer_id].append(name)
+        return names
+
+    def _get_most_sold_crops(self, farmer_ids):
+        """
+        Map farmer ids to the ``(amount, crop_id, crop_name)`` of the crop
+        each farmer has sold the most often. Ties go to the crop sold
+        most recently.
+        """
+        crops = CropReceipt.objects.filter(farmer__in=farmer_ids).values(
+            'farmer', 'crop', 'crop__name').annotate(
+            amount=Count('pk'), latest=Max('created_at')).order_by()
+        best = {}
+        for crop in crops:
+            key = (crop['amount'], crop['latest'])
+            farmer_id = crop['farmer']
+            if farmer_id not in best or key > best[farmer_id][0]:
+                best[farmer_id] = (key, (crop['amount'], crop['crop'],
+                                         crop['crop__name']))
+        return dict((farmer_id, crop) for farmer_id, (_, crop)
+                    in best.items())
+
+    def _chunk_rows(self, farmer_ids):
+        farmers = Farmer.objects.select_related('actor').in_bulk(farmer_ids)
+        msisdns = self._get_msisdns(
+            [farmer.actor_id for farmer in farmers.values()])
+        market_names = self._get_market_names(farmer_ids)
+        crops = self._get_most_sold_crops(farmer_ids)
+
+        for farmer_id in farmer_ids:
+            farmer = farmers[farmer_id]
+            row = [farmer.id, farmer.actor.id, farmer.actor.name]
+            farmer_msisdns = msisdns[farmer.actor_id]
+            msisdn = farmer_msisdns[0] if farmer_msisdns else ''
+            row += [msisdn, len(farmer_msisdns)]
+            farmer_markets = market_names[farmer_id]
+            market = farmer_markets[0] if farmer_markets else ''
+            row += [market, len(farmer_markets)]
+            if farmer_id in crops:
+                amount, crop_id, crop_name = crops[farmer_id]
+                row += [crop_id, crop_name, amount]
+            else:
+                row += ['', '', 0]
+            yield row
 
     def _csv_rows(self, queryset):
         """
@@ -179,22 +283,11 @@ class ExportFarmersAsCSV(object):
             'Best CropID', 'Best Crop Name', 'Best Crop Amount',
         ]
 
-        for farmer in queryset:
-            row = [farmer.id, farmer.actor.id, farmer.actor.name]
-            msisdns = farmer.actor.get_msisdns()
-            msisdn = msisdns[0] if msisdns else ''
-            row += [msisdn, len(msisdns)]
-            markets = list(farmer.markets.all())
-            market = markets[0].name if markets else ''
-            row += [market, len(markets)]
-            amount, crop = self._get_most_sold_crop(farmer)
-            if crop:
-                row += [crop.id, crop.name, amount]
-            else:
-                row += ['', '', 0]
-
-            yield [
-                unicode(value).encode('utf-8') for value in row]
+        farmer_ids = list(queryset.values_list('pk', flat=True))
+        for i in range(0, len(farmer_ids), self.chunk_size):
+            for row in self._chunk_rows(farmer_ids[i:i + self.chunk_size]):
+                yield [
+                    unicode(value).encode('utf-8') for value in row]
 
     def __call__(self, modeladmin, request, queryset):
         """
@@ -63,6 +63,11 @@ class AgentAdmin(admin.ModelAdmin):
     search_fields = ('actor__name',)
 
 
+class CropReceiptAdmin(admin.ModelAdmin):
+    # kept in step with the transactions, see CropReceipt.sold_amount
+    readonly_fields = ('sold_amount',)
+
+
 class TransactionAdmin(admin.ModelAdmin):
     readonly_fields = ('crop_receipt',)
 
@@ -94,7 +99,7 @@ admin.site.register(actors.Identity)
 # ==========================================================================
 admin.site.register(props.Crop)
 admin.site.register(props.CropUnit)
-admin.site.register(props.CropReceipt)
+admin.site.register(props.CropReceipt, CropReceiptAdmin)
 admin.site.register(props.Transaction, TransactionAdmin)
 admin.site.register(props.Offer)
 admin.site.register(props.Message)
@@ -1,23 +1,34 @@
 """FNCS HTTP API functions."""
 # Python
 import json
+import hashlib
 
 # Django
-from django.http import HttpResponse
+from django.conf.urls.defaults import url
+from django.http import HttpResponse, HttpResponseBadRequest
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User
 from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError
+from django.db.models import Q
+from django.views.decorators.http import condition
 
 # Project
 from magriculture.fncs.models.actors import Actor, Farmer, Agent
 from magriculture.fncs.models.props import (
-    Transaction, Crop, CropReceipt, CropUnit)
+    Transaction, Crop, CropReceipt, CropUnit, PriceSummary)
 from magriculture.fncs.models.geo import Market, Ward, District
+from magriculture.fncs.pagination import (
+    KeysetPaginator, CreatedAtKeysetPaginator, keyset_chunks, ordering_keys)
+from magriculture.fncs.responses import response_cache
 
 # Thirdparty
 from tastypie.resources import ModelResource, ALL_WITH_RELATIONS, ALL
 from tastypie.authorization import Authorization
 from tastypie import fields
+from tastypie.utils import trailing_slash
+from tastypie.http import HttpBadRequest, HttpCreated
+from tastypie.exceptions import BadRequest
 
 
 def get_highest_markets(request):
@@ -29,7 +40,349 @@ def get_highest_markets(request):
     return HttpResponse(json.dumps(highest_markets))
 
 
-class CropUnitResource(ModelResource):
+def _price_summary(request):
+    """
+    Read the price summary document for the ``market`` and ``crop`` of
+    the request and when it last changed with a single query. The result
+    is remembered on the request so that the ETag, Last-Modified and
+    response can share it.
+
+    :returns: a ``(content, last_modified)`` tuple, or ``(None, None)``
+              if the market or crop aren't valid ids
+    """
+    if not hasattr(request, '_price_summary'):
+        market_id = request.GET.get('market', '')
+        crop_id = request.GET.get('crop', '')
+        if not (market_id.isdigit() and crop_id.isdigit()):
+            request._price_summary = (None, None)
+            return request._price_summary
+        summaries = PriceSummary.objects.filter(
+            source=PriceSummary.TRANSACTION, market=market_id,
+            crop=crop_id).order_by('-latest_at', 'unit__name').values_list(
+            'unit', 'unit__name', 'prices', 'mean', 'updated_at')
+        objects = []
+        last_modified = None
+        for unit_id, unit_name, prices, mean, updated_at in summaries:
+            objects.append({
+                "unit_id": unit_id,
+                "unit_name": unit_name,
+                "prices": PriceSummary(prices=prices).price_list(),
+                "mean": mean,
+            })
+            if last_modified is None or updated_at > last_modified:
+                last_modified = updated_at
+        request._price_summary = (json.dumps(objects), last_modified)
+    return request._price_summary
+
+
+def _price_summary_etag(request):
+    content, _ = _price_summary(request)
+    if content is not None:
+        return hashlib.md5(content).hexdigest()
+
+
+def _price_summary_last_modified(request):
+    _, last_modified = _price_summary(request)
+    return last_modified
+
+
+@condition(etag_func=_price_summary_etag,
+           last_modified_func=_price_summary_last_modified)
+def get_price_summary(request):
+    """
+    The recent transaction prices and their average for every unit a crop
+    is sold in at a market, most recently sold unit first
+    ::
+
+        url: <base_url>/api/v1/price_summary/?market=<id>&crop=<id>
+        method: GET
+
+    :return: ``[{"unit_id": 1, "unit_name": "boxes", "prices": [100.0],
+             "mean": 100.0}, ...]``
+
+    The response has an ETag and a Last-Modified header, so clients can
+    send ``If-None-Match`` or ``If-Modified-Since`` to get a
+    ``304 Not Modified`` while the prices are unchanged.
+    """
+    return _price_summary_response(request)
+
+
+def _price_summary_response(request, template='%s'):
+    content, _ = _price_summary(request)
+    if content is None:
+        return HttpResponseBadRequest('market and crop need to be ids')
+    return HttpResponse(template % (content,),
+                        content_type='application/json')
+
+
+def _is_id(value):
+    """
+    :returns: whether `value` is a primary key, JSON's ``true`` and
+              ``false`` are ints to Python but not ids
+    """
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+
+def _field_tree(value):
+    """
+    Parse a ``fields`` parameter like ``id,actor__user__username`` into a
+    tree of field names, ``{'id': {}, 'actor': {'user': {'username': {}}}}``
+    where an empty dict stands for all the fields of a related resource.
+    """
+    tree = {}
+    for path in value.split(','):
+        path = path.strip()
+        if not path:
+            continue
+        node = tree
+        for name in path.split('__'):
+            node = node.setdefault(name, {})
+    return tree
+
+
+class SparseModelResource(ModelResource):
+    """
+    A resource that dehydrates only the fields a client asks for
+    ::
+
+        url: <base_url>/api/v1/farmer/?fields=id,crops,actor__name
+        url: <base_url>/api/v1/farmer/?depth=0
+
+    ``fields`` lists the fields to return, with ``__`` separating the
+    fields of related resources. A related field without any of its own
+    fields listed is returned in full.
+
+    ``depth`` is how many levels of related resources are returned in
+    full. Related resources deeper than that, and related resources that
+    aren't returned in full anyway, are returned as their ids.
+
+    The joins and prefetches of the queryset are limited to the relations
+    that are returned in full and, when ``fields`` is given, only the
+    listed columns are read. Without either parameter the resource behaves
+    like any other ``ModelResource``.
+
+    Lists are paged with the resource's
+    :class:`magriculture.fncs.pagination.KeysetPaginator`. Clients that
+    want all of the objects can stream them instead
+    ::
+
+        url: <base_url>/api/v1/farmer/?stream=1&depth=0
+
+    which returns every object as ``{"objects": [...]}`` without a
+    ``meta``, reading and serializing ``stream_chunk_size`` objects at a
+    time.
+    """
+    #: how many objects a streamed list reads from the database at a time
+    stream_chunk_size = 500
+
+    def _sparse_fields(self, request):
+        """
+        :returns: a ``(tree, depth)`` tuple of the requested fields, see
+                  :func:`_field_tree`, and depth, where `None` means no
+                  restriction. `None` if neither is requested.
+        """
+        if request is None or not hasattr(request, 'GET'):
+            return None
+        fields = request.GET.get('fields')
+        depth = request.GET.get('depth')
+        if fields is None and depth is None:
+            return None
+        if depth is not None:
+            if not depth.isdigit():
+                raise BadRequest("depth needs to be a number, not %r" % (
+                    depth,))
+            depth = int(depth)
+        tree = _field_tree(fields) if fields is not None else None
+        self._check_fields(tree)
+        return tree, depth
+
+    def _check_fields(self, tree):
+        for name, subtree in (tree or {}).items():
+            field = self.fields.get(name)
+            if field is None:
+                raise BadRequest("%r has no field %r" % (
+                    self._meta.resource_name, name))
+            if subtree:
+                if not getattr(field, 'is_related', False):
+                    raise BadRequest("%r is not a related field of %r" % (
+                        name, self._meta.resource_name))
+                field.to_class()._check_fields(subtree)
+
+    def _requested_fields(self, tree):
+        for name, field in self.fields.items():
+            if tree is None or name in tree:
+                yield name, field, (tree or {}).get(name) or None
+
+    def _expands(self, field, subtree, depth):
+        """
+        Whether the related field is returned in full.
+        """
+        return bool(subtree) or (field.full and (depth is None or depth > 0))
+
+    def _lookups(self, tree, depth, prefix=''):
+        """
+        :returns: the ``select_related`` and ``prefetch_related`` lookups
+                  for the related fields that are returned in full and
+                  the to many fields that are returned as ids.
+        """
+        select, prefetch = [], []
+        for name, field, subtree in self._requested_fields(tree):
+            if not getattr(field, 'is_related', False):
+                continue
+            many = getattr(field, 'is_m2m', False)
+            lookup = prefix + field.attribute
+            if not self._expands(field, subtree, depth):
+                # to one fields are returned from their foreign key
+                if many:
+                    prefetch.append(lookup)
+                continue
+            nested_select, nested_prefetch = field.to_class()._lookups(
+                subtree, None if depth is None else depth - 1,
+                lookup + '__')
+            if many:
+                # everything below a prefetch is prefetched as well
+                prefetch.append(lookup)
+                prefetch.extend(nested_select)
+            else:
+                select.append(lookup)
+                select.extend(nested_select)
+            prefetch.extend(nested_prefetch)
+        return select, prefetch
+
+    def _columns(self, tree):
+        """
+        :returns: the columns to read for the requested fields
+        """
+        opts = self._meta.object_class._meta
+        columns = set([opts.pk.name])
+        for name, field, subtree in self._requested_fields(tree):
+            if field.attribute and not getattr(field, 'is_m2m', False):
+                columns.add(field.attribute)
+        # the paginator reads the keys of the last object for the cursor
+        columns.update(key.lstrip('-') for key in self._ordering_keys())
+        return list(columns)
+
+    def _ordering_keys(self):
+        """
+        :returns: the keys the lists are ordered and paged by, see
+                  :func:`magriculture.fncs.pagination.ordering_keys`
+        """
+        return ordering_keys(self._meta.object_class,
+                             getattr(self._meta.paginator_class, 'keys', None))
+
+    def get_object_list(self, request):
+        queryset = super(SparseModelResource, self).get_object_list(request)
+        sparse = self._sparse_fields(request)
+        if sparse is None:
+            return queryset
+        tree, depth = sparse
+        select, prefetch = self._lookups(tree, depth)
+        # Django 1.4 has no public way to drop the base queryset's
+        # select_related()
+        queryset = queryset._clone()
+        queryset.query.select_related = False
+        queryset = queryset.prefetch_related(None)
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        if tree is not None:
+            queryset = queryset.only(*self._columns(tree))
+        return queryset
+
+    def _dehydrate_related(self, bundle, field, subtree, depth):
+        many = getattr(field, 'is_m2m', False)
+        if not self._expands(field, subtree, depth):
+            if many:
+                return [obj.pk for obj
+                        in getattr(bundle.obj, field.attribute).all()]
+            opts = bundle.obj._meta
+            return getattr(bundle.obj, opts.get_field(field.attribute).attname)
+        related = getattr(bundle.obj, field.attribute)
+        resource = field.to_class()
+        depth = None if depth is None else depth - 1
+        if many:
+            return [resource.sparse_dehydrate(
+                resource.build_bundle(obj=obj, request=bundle.request),
+                subtree, depth) for obj in related.all()]
+        if related is None:
+            return None
+        return resource.sparse_dehydrate(
+            resource.build_bundle(obj=related, request=bundle.request),
+            subtree, depth)
+
+    def sparse_dehydrate(self, bundle, tree, depth):
+        """
+        Like ``full_dehydrate`` but only for the fields in the `tree` and
+        with related resources returned in full up to `depth` levels deep.
+        """
+        for name, field, subtree in self._requested_fields(tree):
+            if getattr(field, 'is_related', False):
+                bundle.data[name] = self._dehydrate_related(
+                    bundle, field, subtree, depth)
+                continue
+            bundle.data[name] = field.dehydrate(bundle)
+            method = getattr(self, "dehydrate_%s" % name, None)
+            if method:
+                bundle.data[name] = method(bundle)
+        return self.dehydrate(bundle)
+
+    def full_dehydrate(self, bundle, for_list=False):
+        sparse = self._sparse_fields(bundle.request)
+        if sparse is None:
+            return super(SparseModelResource, self).full_dehydrate(
+                bundle, for_list=for_list)
+        tree, depth = sparse
+        return self.sparse_dehydrate(bundle, tree, depth)
+
+    def get_list(self, request, **kwargs):
+        if request.GET.get('stream') not in ('1', 'true'):
+            return super(SparseModelResource, self).get_list(request, **kwargs)
+        if self.determine_format(request) != 'application/json':
+            raise BadRequest("Only JSON lists can be streamed.")
+        base_bundle = self.build_bundle(request=request)
+        objects = self.obj_get_list(
+            bundle=base_bundle, **self.remove_api_resource_names(kwargs))
+        keys = self._ordering_keys()
+        # fail before the response starts rather than halfway through it
+        self._sparse_fields(request)
+        return HttpResponse(self._stream_list(request, objects, keys),
+                            content_type='application/json')
+
+    def _stream_list(self, request, objects, keys):
+        yield '{"%s": [' % (self._meta.collection_name,)
+        separator = ''
+        for chunk in keyset_chunks(objects, keys, self.stream_chunk_size):
+            for obj in chunk:
+                bundle = self.full_dehydrate(
+                    self.build_bundle(obj=obj, request=request), for_list=True)
+                yield separator + self._meta.serializer.to_json(bundle)
+                separator = ', '
+        yield ']}'
+
+
+class CachedModelResource(SparseModelResource):
+    """
+    A resource for reference data that rarely changes, whose ``GET``
+    responses are cached until an object of its model is saved or deleted,
+    see :mod:`magriculture.fncs.responses`. Cached responses are returned
+    without touching the database.
+
+    The tables are small enough to have no ``max_limit``, a ``limit`` of 0
+    returns all of the objects in their default ordering, like the USSD
+    menus ask for.
+    """
+
+    def dispatch(self, request_type, request, **kwargs):
+        parent = super(CachedModelResource, self)
+        if request.method != 'GET' or 'stream' in request.GET:
+            return parent.dispatch(request_type, request, **kwargs)
+        return response_cache.respond(
+            self._meta.object_class, request,
+            lambda: parent.dispatch(request_type, request, **kwargs))
+
+
+class CropUnitResource(CachedModelResource):
     """
     Get the Crop Unit
     ::
@@ -45,12 +398,14 @@ class CropUnitResource(ModelResource):
         authorization = Authorization()
         include_resource_uri = True
         always_return_data = True
+        paginator_class = KeysetPaginator
+        max_limit = None
         filtering = {"name": ALL,
                      "id": ALL}
         excludes = ["created_at"]
 
 
-class CropReceiptResource(ModelResource):
+class CropReceiptResource(SparseModelResource):
     """
     Get the Crop reciept
     ::
@@ -76,19 +431,20 @@ class CropReceiptResource(ModelResource):
                                 full=True)
 
     class Meta:
-        queryset = CropReceipt.objects.all()
+        queryset = CropReceipt.objects.select_related('crop', 'unit', 'market')
         resource_name = "cropreceipt"
         list_allowed_methods = ['get', 'put']
         authorization = Authorization()
         include_resource_uri = True
         always_return_data = True
+        paginator_class = CreatedAtKeysetPaginator
         filtering = {"crop": ALL_WITH_RELATIONS,
                      "unit": ALL_WITH_RELATIONS,
                      "market": ALL_WITH_RELATIONS}
         excludes = ["created_at"]
 
 
-class TransactionResource(ModelResource):
+class TransactionResource(SparseModelResource):
     """
     Get Price History
     ::
@@ -98,25 +454,55 @@ class TransactionResource(ModelResource):
          url: <base_url>/api/v1/transaction/?crop_receipt__crop=<id>
          url: <base_url>/api/v1/transaction/?crop_receipt__crop=<id>&crop_receipt__crop=<id>
          method: GET
+
+    Get the recent prices of a crop at a market grouped by unit, most
+    recent unit and price first
+    ::
+
+         url: <base_url>/api/v1/transaction/price_history/?market=<id>&crop=<id>
+         method: GET
     """
     crop_receipt = fields.ForeignKey(
         'magriculture.fncs.api.CropReceiptResource', 'crop_receipt', full=True)
 
     class Meta:
-        queryset = Transaction.objects.all()
+        queryset = Transaction.objects.select_related(
+            'crop_receipt__crop', 'crop_receipt__unit',
+            'crop_receipt__market')
         resource_name = "transaction"
         list_allowed_methods = ['get', 'put']
         authorization = Authorization()
         include_resource_uri = True
         always_return_data = True
+        paginator_class = CreatedAtKeysetPaginator
         filtering = {"crop_receipt": ALL_WITH_RELATIONS}
         excludes = ["created_at"]
 
+    def prepend_urls(self):
+        return [
+            url(r"^(?P<resource_name>%s)/price_history%s$" % (
+                self._meta.resource_name, trailing_slash()),
+                self.wrap_view('get_price_history'),
+                name="api_transaction_price_history"),
+        ]
+
+    def get_price_history(self, request, **kwargs):
+        """
+        The price summary of :func:`get_price_summary` as
+        ``{"objects": [...]}``, with the same caching headers.
+        """
+        self.method_check(request, allowed=['get'])
+        view = condition(etag_func=_price_summary_etag,
+                         last_modified_func=_price_summary_last_modified)(
+            lambda request: _price_summary_response(
+                request, '{"objects": %s}'))
+        return view(request)
+
 
 # ==========================================================
 # Tastypie APIs
 # ==========================================================
-class UserResource(ModelResource):
+class UserResource(SparseModelResource):
     """
     Creating a user
     ::
@@ -137,6 +523,7 @@ class UserResource(ModelResource):
         authorization = Authorization()
         include_resource_uri = True
         always_return_data = True
+        paginator_class = KeysetPaginator
         excludes = ['is_active', 'is_staff', 'is_superuser',
                     'date_joined', 'last_login']
         filtering = {"id": ALL,
@@ -183,7 +570,7 @@ class UserResource(ModelResource):
         return bundle
 
 
-class FarmerResource(ModelResource):
+class FarmerResource(SparseModelResource):
     """
     Creating a new farmer requires several:
 
@@ -270,7 +657,50 @@ class FarmerResource(ModelResource):
 
         url: <base_url>/api/v1/farmer/?actor__user__username=123456789
         method: GET
+
+    **Register farmers in a single request**
+
+    Creates the user, actor and farmer in one transaction. The crops,
+    wards and districts are given by id (a number) or by name (a
+    string), either as a single value or as a list.
+    ::
+
+        url: <base_url>/api/v1/farmer/register/
+        method: POST
+        content_type: application/json
+        body: {
+                    "msisdn": "27721231234",
+                    "first_name": "test_first_name",
+                    "last_name": "test_last_name",
+                    "id_number": "123456789",
+                    "gender": "F",
+                    "crop": "Rice",
+                    "ward": "test_ward",
+                    "district": 1
+                }
+
+    :return: the farmer, like a POST to ``/api/v1/farmer/``
+
+    The body can also be a list of up to ``MAX_REGISTRATIONS`` farmers,
+    which are inserted in bulk. This returns the ``id`` and ``msisdn`` of
+    every farmer in the list's order
+    ::
+
+        {"objects": [{"id": 1, "msisdn": "27721231234"}, ...]}
+
+    Nothing is registered if any of the farmers can't be, the response is
+    then a ``400 Bad Request`` with the ``errors`` by position in the
+    list.
     """
+    #: how many farmers can be registered in one request
+    MAX_REGISTRATIONS = 500
+    #: the relations that can be given by id or name when registering
+    REGISTRATION_RELATIONS = [
+        ('crops', 'crop', Crop),
+        ('wards', 'ward', Ward),
+        ('districts', 'district', District),
+    ]
+
     agents = fields.ManyToManyField('magriculture.fncs.api.AgentsResource',
                                     'agent_farmer',
                                     full=True)
@@ -294,16 +724,161 @@ class FarmerResource(ModelResource):
                                    full=True)
 
     class Meta:
-        queryset = Farmer.objects.all()
+        queryset = Farmer.objects.select_related('actor__user').prefetch_related(
+            'agent_farmer', 'markets', 'wards', 'districts', 'crops')
         resource_name = "farmer"
         list_allowed_methods = ['post', 'get', 'put']
         authorization = Authorization()
         include_resource_uri = True
         always_return_data = True
+        paginator_class = KeysetPaginator
         filtering = {"actor" : ALL_WITH_RELATIONS}
 
+    def prepend_urls(self):
+        return [
+            url(r"^(?P<resource_name>%s)/register%s$" % (
+                self._meta.resource_name, trailing_slash()),
+                self.wrap_view('register_farmers'),
+                name="api_farmer_register"),
+        ]
+
+    def _relation_values(self, data, plural, singular):
+        values = data.get(plural, data.get(singular))
+        if values is None or values == '':
+            return []
+        if not isinstance(values, list):
+            return [values]
+        return values
+
+    def _resolve_relations(self, items, errors):
+        """
+        Replace the ids and names of the crops, wards and districts with
+        their primary keys, with one query per model.
 
-class AgentsResource(ModelResource):
+        :param list items: ``(position, registration)`` pairs
+        """
+        for plural, singular, model in self.REGISTRATION_RELATIONS:
+            values = [self._relation_values(data, plural, singular)
+                      for _, data in items]
+            ids = set(value for item_values in values
+                      for value in item_values if _is_id(value))
+            names = set(value for item_values in values
+                        for value in item_values
+                        if isinstance(value, basestring))
+            known_ids = set()
+            ids_by_name = {}
+            for pk, name in model.objects.filter(
+                    Q(pk__in=ids) | Q(name__in=names)).values_list(
+                    'pk', 'name'):
+                known_ids.add(pk)
+                ids_by_name.setdefault(name, []).append(pk)
+
+            for (i, data), item_values in zip(items, values):
+                pks = []
+                for value in item_values:
+                    if isinstance(value, basestring):
+                        matches = ids_by_name.get(value, [])
+                        if len(matches) == 1:
+                            pks.append(matches[0])
+                            continue
+                        message = ('Unknown %s %r' if not matches else
+                                   'More than one %s named %r')
+                    elif _is_id(value) and value in known_ids:
+                        pks.append(value)
+                        continue
+                    else:
+                        message = 'Unknown %s %r'
+                    errors.setdefault(i, []).append(
+                        message % (singular, value))
+                data[plural] = pks
+
+    def _registration(self, data, errors, i):
+        """
+        Validate one farmer's data and turn it into a registration for
+        :meth:`magriculture.fncs.models.actors.Farmer.register`.
+        """
+        if not isinstance(data, dict):
+            errors.setdefault(i, []).append('Expected an object')
+            return {}
+        for key in ['msisdn', 'first_name', 'last_name']:
+            if not isinstance(data.get(key), basestring) or not data[key]:
+                errors.setdefault(i, []).append('%s is required' % (key,))
+        gender = data.get('gender') or Farmer.UNKNOWN
+        if gender not in dict(Farmer.GENDER):
+            errors.setdefault(i, []).append('Unknown gender %r' % (gender,))
+        if i in errors:
+            return {}
+        return {
+            # stored as given, like the users of the user resource and
+            # the USSD app's lookups by address
+            'msisdn': data['msisdn'],
+            'name': data['first_name'],
+            'surname': data['last_name'],
+            'id_number': data.get('id_number') or None,
+            'gender': gender,
+            'crops': self._relation_values(data, 'crops', 'crop'),
+            'wards': self._relation_values(data, 'wards', 'ward'),
+            'districts': self._relation_values(data, 'districts', 'district'),
+        }
+
+    def register_farmers(self, request, **kwargs):
+        """
+        Register one farmer or a list of farmers with a single request.
+        """
+        self.method_check(request, allowed=['post'])
+        self.is_authenticated(request)
+        data = self.deserialize(
+            request, request.body,
+            format=request.META.get('CONTENT_TYPE', 'application/json'))
+        many = isinstance(data, list)
+        items = data if many else [data]
+        if not items:
+            return self.create_response(request, {'objects': []})
+        if len(items) > self.MAX_REGISTRATIONS:
+            return self.create_response(request, {
+                'error': 'Register at most %s farmers at a time' % (
+                    self.MAX_REGISTRATIONS,)
+            }, response_class=HttpBadRequest)
+
+        errors = {}
+        registrations = [self._registration(item, errors, i)
+                         for i, item in enumerate(items)]
+        seen = set()
+        for i, registration in enumerate(registrations):
+            msisdn = registration.get('msisdn')
+            if msisdn is None:
+                continue
+            if msisdn in seen:
+                errors.setdefault(i, []).append(
+                    'msisdn %s is registered twice' % (msisdn,))
+            seen.add(msisdn)
+        self._resolve_relations(
+            [(i, registration) for i, registration in enumerate(registrations)
+             if i not in errors], errors)
+        if errors:
+            return self.create_response(request, {'errors': errors},
+                                        response_class=HttpBadRequest)
+
+        try:
+            farmers = Farmer.register(registrations)
+        except IntegrityError, e:
+            return self.create_response(request, {
+                'error': 'Unable to register the farmers: %s' % (e,)
+            }, response_class=HttpBadRequest)
+
+        if not many:
+            bundle = self.full_dehydrate(
+                self.build_bundle(obj=farmers[0], request=request))
+            return self.create_response(request, bundle,
+                                        response_class=HttpCreated)
+        return self.create_response(request, {'objects': [{
+            'id': farmer.pk,
+            'msisdn': registration['msisdn'],
+        } for farmer, registration in zip(farmers, registrations)]},
+            response_class=HttpCreated)
+
+
+class AgentsResource(SparseModelResource):
     """
     Get the agents in the system
     ::
@@ -318,9 +893,10 @@ class AgentsResource(ModelResource):
         list_allowed_methods = ['get']
         include_resource_uri = True
         always_return_data = True
+        paginator_class = KeysetPaginator
 
 
-class ActorResource(ModelResource):
+class ActorResource(SparseModelResource):
     """
     Returns the actors in the system and can filter on id or msisdn as username
     ::
@@ -336,16 +912,17 @@ class ActorResource(ModelResource):
                              full=True)
 
     class Meta:
-        queryset = Actor.objects.all()
+        queryset = Actor.objects.select_related('user')
         resource_name = "actor"
         authorization = Authorization()
         list_allowed_methods = ['get']
         include_resource_uri = True
         always_return_data = True
+        paginator_class = KeysetPaginator
         filtering = {"user": ALL_WITH_RELATIONS}
 
 
-class MarketResource(ModelResource):
+class MarketResource(CachedModelResource):
     """
     Returns the market in the system and can filter by name
     ::
@@ -361,10 +938,12 @@ class MarketResource(ModelResource):
         list_allowed_methods = ['get']
         include_resource_uri = True
         always_return_data = True
+        paginator_class = KeysetPaginator
+        max_limit = None
         filtering = {"name": ALL}
 
 
-class WardResource(ModelResource):
+class WardResource(CachedModelResource):
     """
     Returns the ward in the system and can filter by name
     ::
@@ -381,10 +960,12 @@ class WardResource(ModelResource):
         list_allowed_methods = ['get']
         include_resource_uri = True
         always_return_data = True
+        paginator_class = KeysetPaginator
+        max_limit = None
         filtering = {"name": ALL}
 
 
-class DistrictResource(ModelResource):
+class DistrictResource(CachedModelResource):
     """
     Returns the districts in the system and can filter by name
     ::
@@ -401,10 +982,12 @@ class DistrictResource(ModelResource):
         list_allowed_methods = ['get']
         include_resource_uri = True
         always_return_data = True
+        paginator_class = KeysetPaginator
+        max_limit = None
         filtering = {"name": ALL}
 
 
-class CropResource(ModelResource):
+class CropResource(CachedModelResource):
     """
     Returns the Crops in the system and can filter by name
     ::
@@ -420,5 +1003,7 @@ class CropResource(ModelResource):
         list_allowed_methods = ['get']
         include_resource_uri = True
         always_return_data = True
+        paginator_class = KeysetPaginator
+        max_limit = None
         filtering = {"name": ALL,
                      "id": ALL}
@@ -1,21 +1,22 @@
 from django.contrib.auth.backends import ModelBackend
 
-from magriculture.fncs.models.actors import Identity, User
+from magriculture.fncs.models.actors import User
 
 from magriculture.fncs import utils
+from magriculture.fncs.identities import identity_cache
 
 
 class IdentityBackend(ModelBackend):
 
     def authenticate(self, username, password=None):
-        try:
-            normalised_username = utils.normalise_msisdn(username)
-            identity = Identity.objects.get(msisdn=normalised_username)
-            if identity.pin and identity.check_pin(password):
-                return identity.actor.user
-            return None
-        except Identity.DoesNotExist:
-            return None
+        normalised_username = utils.normalise_msisdn(username)
+        identity = identity_cache.lookup(normalised_username)
+        if identity and identity.pin and identity.check_pin(password):
+            try:
+                return User.objects.get(pk=identity.user_id)
+            except User.DoesNotExist:
+                return None
+        return None
 
 class UserBackend(ModelBackend):
 
@@ -6,6 +6,9 @@ from django.core.urlresolvers import reverse
 from django.shortcuts import redirect
 from django.contrib import messages
 
+# Project
+from magriculture.fncs.roles import get_roles
+
 
 class SpecificRightsRequired(object):
     """
@@ -27,11 +30,12 @@ class SpecificRightsRequired(object):
     def __call__(self, func):
         @wraps(func)
         def decorated_function(request, *args, **kwargs):
-            true_agent = self.agent and request.user.actor.is_agent()
-            true_ext_officer = self.ext_officer and request.user.actor.is_extensionofficer()
+            roles = get_roles(request)
+            true_agent = self.agent and roles.is_agent()
+            true_ext_officer = self.ext_officer and roles.is_extensionofficer()
             true_superuser = self.superuser and request.user.is_superuser
 
-            if request.user.is_authenticated:
+            if request.user.is_authenticated():
                 if true_agent or true_ext_officer or true_superuser:
                     return func(request, *args, **kwargs)
 
@@ -15,3 +15,9 @@ class CropReceiptException(MagricultureException):
 	when trying to sell something of which there isn't
 	enough inventory
 	"""
+
+class ProjectionException(MagricultureException):
+	"""
+	Raised when a field path for an export does not exist
+	on the model being exported
+	"""
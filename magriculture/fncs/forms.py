@@ -1,6 +1,5 @@
 from django import forms
 from django.forms.widgets import HiddenInput, Textarea
-from ngram import NGram
 
 from magriculture.fncs.models.props import (Crop, Transaction, Message,
                                             GroupMessage, Note, Offer,
@@ -9,6 +8,7 @@ from magriculture.fncs.models.props import (Crop, Transaction, Message,
 from magriculture.fncs.models.geo import Market, Ward, District
 from magriculture.fncs.models.actors import (FarmerGroup, Farmer)
 from magriculture.fncs.widgets import SplitSelectDateTimeWidget
+from magriculture.fncs.locations import location_backend
 
 
 class SelectCropForm(forms.Form):
@@ -133,20 +133,14 @@ class FarmerLocationForm(forms.Form):
             raise ValueError("Unsupported location type"
                              " (this shouldn't happen).")
 
-    def _location_to_name(self, location):
-        return location.name.lower()
-
     def _location_to_choice(self, location):
-        location_type = location.__class__.__name__.lower()
-        return ('%s:%d' % (location_type, location.pk),
-                '%s (%s)' % (location.name, location_type))
+        location_type, location_pk, name = location
+        return ('%s:%d' % (location_type, location_pk),
+                '%s (%s)' % (name, location_type))
 
     def _location_choices(self, search):
-        ngram_index = NGram(key=self._location_to_name)
-        ngram_index.update(Ward.objects.all())
-        ngram_index.update(District.objects.all())
-        locations = ngram_index.search(search)[:self.num_choices]
-        return [self._location_to_choice(l) for l, _score in locations]
+        locations = location_backend.search(search, limit=self.num_choices)
+        return [self._location_to_choice(l) for l in locations]
 
 class FarmerLocationDeleteConfirmForm(forms.Form):
     district_pk = forms.CharField(widget=HiddenInput())
@@ -164,7 +158,8 @@ class MessageForm(forms.ModelForm):
     class Meta:
         model = Message
         exclude = [
-            'sender', 'recipient', 'group'
+            'sender', 'recipient', 'group', 'to_addr', 'status', 'attempts',
+            'sent_at'
         ]
 
 
@@ -0,0 +1,137 @@
+"""
+A cache of the identities looked up by MSISDN on every login, see
+:class:`magriculture.fncs.auth.backends.IdentityBackend` and
+:meth:`magriculture.fncs.models.actors.Actor.find`.
+
+The cache is the Django cache backend or alias named by the
+``FNCS_IDENTITY_CACHE`` setting, the ``default`` cache unless set. It
+needs to be shared by all the processes (e.g. memcached) for a changed PIN
+to be seen everywhere as soon as the identity is saved, a cache in every
+process only forgets the identity in the process that saved it.
+
+Saving an identity moves its MSISDN on to a new version, so identities
+loaded before the save and cached after it are never looked up again.
+"""
+# Python
+import hashlib
+import uuid
+from collections import namedtuple
+
+# Django
+from django.conf import settings
+from django.contrib.auth.models import check_password
+from django.core.cache import get_cache
+
+# Project
+from magriculture.fncs.utils import normalise_msisdn
+
+DEFAULT_BACKEND = 'default'
+DEFAULT_TIMEOUT = 5 * 60
+
+
+class CachedIdentity(namedtuple('CachedIdentity', [
+        'identity_id', 'actor_id', 'user_id', 'pin', 'expired'])):
+    """
+    What's cached of a :class:`magriculture.fncs.models.actors.Identity`.
+    """
+
+    def check_pin(self, pin):
+        return check_password(pin, self.pin)
+
+
+class IdentityCache(object):
+    """
+    Maps MSISDNs to :class:`CachedIdentity` tuples.
+
+    :param str backend:
+        the Django cache backend or alias to use.
+    :param int timeout:
+        how many seconds to cache an identity for.
+    """
+
+    def __init__(self, backend=DEFAULT_BACKEND, timeout=DEFAULT_TIMEOUT):
+        self.cache = get_cache(backend)
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, msisdn):
+        # all the ways of writing a number share a key, which is hashed to
+        # keep spaces and other characters memcached doesn't accept out
+        return hashlib.md5(
+            normalise_msisdn(msisdn).encode('utf-8')).hexdigest()
+
+    def _version_key(self, msisdn):
+        return 'fncs:identity-version:%s' % (self._digest(msisdn),)
+
+    def version(self, msisdn):
+        """
+        :returns: the current version of the identities for the MSISDN
+        """
+        key = self._version_key(msisdn)
+        version = self.cache.get(key)
+        if version is None:
+            self.cache.add(key, uuid.uuid4().hex, self.timeout)
+            # another process may have added a version first
+            version = self.cache.get(key) or ''
+        return version
+
+    def _key(self, msisdn, version):
+        return 'fncs:identity:%s:%s' % (version, self._digest(msisdn))
+
+    def _load(self, msisdn):
+        from magriculture.fncs.models.actors import Identity
+        try:
+            identity = Identity.objects.values_list(
+                'pk', 'actor_id', 'actor__user_id', 'pin',
+                'expired_on').get(msisdn=msisdn)
+        except Identity.DoesNotExist:
+            return None
+        pk, actor_id, user_id, pin, expired_on = identity
+        return CachedIdentity(pk, actor_id, user_id, pin,
+                              expired_on is not None)
+
+    def lookup(self, msisdn):
+        """
+        :returns: the :class:`CachedIdentity` for the MSISDN or `None` if
+                  there is no identity with the MSISDN.
+
+        The identities are cached by the
+        :func:`magriculture.fncs.utils.normalise_msisdn` form of the MSISDN,
+        along with the other ways of writing it that were looked up, but
+        an identity is only returned for the exact MSISDN it has.
+        """
+        msisdn = unicode(msisdn)
+        # the version is read before the identity is loaded, an identity
+        # saved in between is cached under a version that's already gone
+        key = self._key(msisdn, self.version(msisdn))
+        identities = self.cache.get(key) or {}
+        if msisdn in identities:
+            self.hits += 1
+            return CachedIdentity(*identities[msisdn])
+        self.misses += 1
+        identity = self._load(msisdn)
+        # MSISDNs without an identity aren't cached, they'd fill the cache
+        # with every number that's tried
+        if identity is not None:
+            identities[msisdn] = tuple(identity)
+            self.cache.set(key, identities, self.timeout)
+        return identity
+
+    def invalidate(self, msisdn):
+        """
+        Forget the identities for every way of writing the MSISDN.
+        """
+        self.cache.set(self._version_key(unicode(msisdn)),
+                       uuid.uuid4().hex, self.timeout)
+
+    def stats(self):
+        """
+        :returns: the number of cache hits and misses in this process
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+identity_cache = IdentityCache(
+    getattr(settings, 'FNCS_IDENTITY_CACHE', DEFAULT_BACKEND),
+    getattr(settings, 'FNCS_IDENTITY_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
@@ -0,0 +1,326 @@
+"""
+Search for a farmer's location by the names of all wards and districts.
+
+The search is done by a backend selected with the
+``FNCS_LOCATION_SEARCH_BACKEND`` setting. Backends rank
+``(location_type, pk, name)`` tuples, where `location_type` is ``'ward'``
+or ``'district'``, by their trigram similarity to the query:
+
+:class:`NGramLocationBackend`
+    the default, a process-wide n-gram index. The index is built lazily on
+    the first search and rebuilt after a
+    :class:`magriculture.fncs.models.geo.Ward` or
+    :class:`magriculture.fncs.models.geo.District` is saved or deleted. The
+    invalidation is broadcast to other processes through a version number
+    in the ``default`` Django cache, so that needs to be a shared cache
+    (e.g. memcached) when running more than one worker. Changes that
+    aren't broadcast, like updates that don't send signals, are picked up
+    when the index is rebuilt after ``FNCS_LOCATION_INDEX_TIMEOUT``
+    seconds.
+
+    If ``FNCS_LOCATION_INDEX_PATH`` is set, the indexed locations are also
+    pickled to that path so that new workers don't need to load the
+    geography tables to start searching.
+
+:class:`TrigramLocationBackend`
+    pushes the matching into the database so workers don't need to hold
+    the index in memory. On PostgreSQL this uses the ``pg_trgm`` extension
+    and the trigram indexes on the ward and district names. On SQLite a
+    ``similarity`` function computing the same score as the n-gram index
+    is registered on the connection instead, which is only suitable for
+    development and tests.
+"""
+# Python
+import os
+import pickle
+import logging
+import threading
+import time
+
+# Django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.utils.importlib import import_module
+
+# Third Party
+from ngram import NGram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = 'magriculture.fncs.locations.NGramLocationBackend'
+
+VERSION_CACHE_KEY = 'fncs:location_index:version'
+# memcached doesn't accept relative timeouts of more than 30 days
+VERSION_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+# how many seconds an index is used for before it's rebuilt
+DEFAULT_INDEX_TIMEOUT = 60 * 60
+
+# the n-gram parameters of ngram.NGram's defaults
+TRIGRAM_N = 3
+TRIGRAM_PADDING = '$' * (TRIGRAM_N - 1)
+
+
+def _location_key(location):
+    location_type, pk, name = location
+    return name.lower()
+
+
+def _ranking_key(ranked_location):
+    (location_type, pk, name), score = ranked_location
+    return (-score, name.lower(), location_type, pk)
+
+
+def _trigrams(string):
+    padded = TRIGRAM_PADDING + string + TRIGRAM_PADDING
+    return [padded[i:i + TRIGRAM_N]
+            for i in range(len(padded) - TRIGRAM_N + 1)]
+
+
+class _QueryTrigrams(dict):
+    """
+    The trigram counts of the last few queries, since the database calls
+    :func:`trigram_similarity` with the same query for every row.
+    """
+    size = 16
+
+    def __missing__(self, query):
+        if len(self) >= self.size:
+            self.clear()
+        counts = {}
+        for gram in _trigrams(query):
+            counts[gram] = counts.get(gram, 0) + 1
+        self[query] = counts
+        return counts
+
+_query_trigrams = _QueryTrigrams()
+
+
+def trigram_similarity(string, query):
+    """
+    The similarity between 0.0 and 1.0 of two strings, as computed by
+    :meth:`ngram.NGram.compare`.
+    """
+    if string is None or query is None:
+        return 0.0
+    query_counts = _query_trigrams[query]
+    remaining = query_counts.copy()
+    grams = _trigrams(string)
+    same = 0
+    for gram in grams:
+        count = remaining.get(gram)
+        if count:
+            remaining[gram] = count - 1
+            same += 1
+    if not same:
+        return 0.0
+    return float(same) / (len(grams) + sum(query_counts.itervalues()) - same)
+
+
+class LocationBackend(object):
+    """
+    The interface of the location search backends.
+    """
+
+    def ranked(self, query, limit=10):
+        """
+        :returns: the `limit` best matching ``(location, score)`` pairs
+                  for `query`, where `location` is a
+                  ``(location_type, pk, name)`` tuple. Pairs are ordered by
+                  decreasing score and then by name.
+        """
+        raise NotImplementedError("Subclasses should implement this.")
+
+    def search(self, query, limit=10):
+        """
+        :returns: the `limit` best matching ``(location_type, pk, name)``
+                  tuples for `query`
+        """
+        return [location for location, _score in self.ranked(query, limit)]
+
+    def invalidate(self):
+        """
+        Called when a ward or district is saved or deleted.
+        """
+
+
+class NGramLocationBackend(LocationBackend):
+    """
+    An in-process n-gram index of the locations.
+
+    :param str path:
+        where to pickle the indexed locations, defaults to the
+        ``FNCS_LOCATION_INDEX_PATH`` setting.
+    :param int timeout:
+        how many seconds to use an index for, defaults to the
+        ``FNCS_LOCATION_INDEX_TIMEOUT`` setting.
+    """
+
+    def __init__(self, path=None, timeout=None):
+        if path is None:
+            path = getattr(settings, 'FNCS_LOCATION_INDEX_PATH', None)
+        if timeout is None:
+            timeout = getattr(settings, 'FNCS_LOCATION_INDEX_TIMEOUT',
+                              DEFAULT_INDEX_TIMEOUT)
+        self.path = path
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._ngram = None
+        self._version = None
+        self._built_at = None
+
+    def load_locations(self):
+        """
+        Read all the locations to index from the database.
+        """
+        from magriculture.fncs.models.geo import Ward, District
+        locations = []
+        for location_type, model in [('ward', Ward), ('district', District)]:
+            locations.extend((location_type, pk, name) for pk, name
+                             in model.objects.values_list('pk', 'name'))
+        return locations
+
+    def _read(self, version):
+        if not (self.path and os.path.exists(self.path)):
+            return None
+        try:
+            with open(self.path, 'rb') as fp:
+                data = pickle.load(fp)
+        except (IOError, EOFError, pickle.PickleError), e:
+            logger.warning("Unable to read location index %r: %s" % (
+                self.path, e))
+            return None
+        if data.get('version') != version or self._expired(
+                data.get('built_at', 0)):
+            return None
+        return data['built_at'], data['locations']
+
+    def _write(self, version, built_at, locations):
+        if not self.path:
+            return
+        # write to a temporary file first so readers never see a partial
+        # index
+        tmp_path = '%s.%s.tmp' % (self.path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as fp:
+                pickle.dump({'version': version, 'built_at': built_at,
+                             'locations': locations}, fp,
+                            pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError), e:
+            logger.warning("Unable to write location index %r: %s" % (
+                self.path, e))
+
+    def _expired(self, built_at):
+        return time.time() - built_at >= self.timeout
+
+    def _is_current(self, version):
+        return (self._ngram is not None and self._version == version and
+                not self._expired(self._built_at))
+
+    def get_index(self):
+        """
+        :returns: the up to date :class:`ngram.NGram` index
+        """
+        version = cache.get(VERSION_CACHE_KEY)
+        if self._is_current(version):
+            return self._ngram
+        with self._lock:
+            if not self._is_current(version):
+                index = self._read(version)
+                if index is None:
+                    index = (time.time(), self.load_locations())
+                    self._write(version, *index)
+                self._built_at, locations = index
+                self._ngram = NGram(locations, key=_location_key)
+                self._version = version
+            return self._ngram
+
+    def ranked(self, query, limit=10):
+        results = self.get_index().search(query.lower())
+        results.sort(key=_ranking_key)
+        return results[:limit]
+
+    def invalidate(self):
+        """
+        Drop the index in this and, through the cache, all other
+        processes.
+        """
+        try:
+            cache.incr(VERSION_CACHE_KEY)
+        except ValueError:
+            cache.set(VERSION_CACHE_KEY, 1, VERSION_CACHE_TIMEOUT)
+        self._ngram = None
+        # the version isn't known to processes that start with an empty
+        # cache, so don't leave a stale index on disk for them
+        if self.path and os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+class TrigramLocationBackend(LocationBackend):
+    """
+    Ranks the locations in the database with a trigram ``similarity``
+    function.
+
+    PostgreSQL's ``pg_trgm`` only considers names whose similarity exceeds
+    its threshold (0.3 by default, see ``set_limit()``) and scores
+    trigrams of words rather than of the whole name, so the weaker matches
+    may be ranked differently from :class:`NGramLocationBackend`.
+    """
+
+    def _register_functions(self):
+        if connection.vendor == 'sqlite':
+            # make sure the connection is open
+            connection.cursor()
+            connection.connection.create_function(
+                'similarity', 2, trigram_similarity)
+
+    def _match(self):
+        if connection.vendor == 'postgresql':
+            # uses the trigram index, the % is escaped for the parameters
+            return 'WHERE LOWER(name) %% %s', 1
+        return '', 0
+
+    def ranked(self, query, limit=10):
+        from magriculture.fncs.models.geo import Ward, District
+        self._register_functions()
+        qn = connection.ops.quote_name
+        match, match_params = self._match()
+        selects = []
+        params = []
+        for location_type, model in [('ward', Ward), ('district', District)]:
+            selects.append(
+                "SELECT '%s' AS location_type, id, name, "
+                "similarity(LOWER(name), %%s) AS score FROM %s %s" % (
+                    location_type, qn(model._meta.db_table), match))
+            params.extend([query.lower()] * (1 + match_params))
+        sql = ("SELECT location_type, id, name, score FROM (%s) locations "
+               "WHERE score > 0 "
+               "ORDER BY score DESC, LOWER(name), location_type, id "
+               "LIMIT %%s" % (" UNION ALL ".join(selects),))
+        cursor = connection.cursor()
+        cursor.execute(sql, params + [limit])
+        return [((location_type, pk, name), score)
+                for location_type, pk, name, score in cursor.fetchall()]
+
+
+def load_backend(path):
+    """
+    :returns: an instance of the location backend class at the dotted
+              `path`
+    """
+    module_name, _, class_name = path.rpartition('.')
+    try:
+        backend_class = getattr(import_module(module_name), class_name)
+    except (ImportError, AttributeError), e:
+        raise ImproperlyConfigured(
+            "Unable to load location search backend %r: %s" % (path, e))
+    return backend_class()
+
+
+location_backend = load_backend(
+    getattr(settings, 'FNCS_LOCATION_SEARCH_BACKEND', DEFAULT_BACKEND))
@@ -0,0 +1,14 @@
+# Django
+from django.core.management.base import BaseCommand
+
+# Project
+from magriculture.fncs.models.props import PriceSummary
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the price summaries for every market, crop & unit"
+            " from the transaction and offer history")
+
+    def handle(self, *args, **options):
+        total = PriceSummary.rebuild()
+        self.stdout.write("Rebuilt %s price summaries\n" % (total,))
@@ -0,0 +1,31 @@
+# Python
+from optparse import make_option
+
+# Django
+from django.core.management.base import BaseCommand
+
+# Project
+from magriculture.fncs.models.props import CropReceipt
+
+
+class Command(BaseCommand):
+    help = ("Verify the stored sold amount of every crop receipt against"
+            " its transaction history and fix the ones that don't match")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--verify', action='store_true', dest='verify',
+                    default=False,
+                    help='Only report mismatches, do not fix them'),
+    )
+
+    def handle(self, *args, **options):
+        mismatched = CropReceipt.mismatched_sold_amounts()
+        for receipt in mismatched:
+            total_sold = receipt.total_sold or 0
+            self.stdout.write("CropReceipt %s: stored %s, sold %s\n" % (
+                receipt.pk, receipt.sold_amount, total_sold))
+            if not options['verify']:
+                CropReceipt.objects.filter(pk=receipt.pk).update(
+                    sold_amount=total_sold)
+        self.stdout.write("%s mismatched crop receipts\n" % (
+            len(mismatched),))
@@ -4,3 +4,4 @@ from magriculture.fncs.models.actors import (Actor, Farmer, FarmerGroup,
     ExtensionOfficer, MarketMonitor, Agent)
 from magriculture.fncs.models.props import (Crop, CropUnit, Transaction, 
     Offer)
+from magriculture.fncs.models.jobs import Job, JobChunk
@@ -1,16 +1,21 @@
 from datetime import datetime
 import random
 
+from django.conf import settings
 from django.db import models
+from django.db.transaction import commit_on_success
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import (post_init, post_save, post_delete,
+                                      m2m_changed)
 from django.contrib.auth.models import check_password, make_password
 
 from magriculture.fncs import errors
+from magriculture.fncs.identities import identity_cache
+from magriculture.fncs.roles import ActorRoles
+from magriculture.fncs.utils import bulk_create
 from magriculture.fncs.models.geo import District
 from magriculture.fncs.models.props import (Message, GroupMessage, Note,
-                                            Transaction, Crop)
-from magriculture.sms import send_sms
+                                            Transaction, Crop, CropReceipt)
 
 
 def create_actor(sender, instance, created, **kwargs):
@@ -86,6 +91,21 @@ class Identity(models.Model):
     def set_pin(self, raw_pin):
         self.pin = make_password(raw_pin)
 
+    @classmethod
+    def latest_msisdns(cls, actor_ids):
+        """
+        Find the most recent msisdn of each of the given actors with a
+        single query, like :meth:`Actor.get_msisdns` does for one actor.
+
+        :returns: dict of :class:`Actor` primary key to msisdn
+        """
+        msisdns = {}
+        identities = cls.objects.filter(actor__in=actor_ids).order_by(
+            'actor', '-created_at').values_list('actor_id', 'msisdn')
+        for actor_id, msisdn in identities:
+            msisdns.setdefault(actor_id, msisdn)
+        return msisdns
+
     def check_pin(self, pin):
         return check_password(pin, self.pin)
 
@@ -93,6 +113,30 @@ class Identity(models.Model):
         return u"%s (Identity)" % self.actor.name
 
 
+def remember_identity_msisdn(sender, instance, **kwargs):
+    """
+    Signal handler for Django, remember the msisdn an identity was loaded
+    or last saved with to forget it in the cache once it changed.
+    """
+    instance._cached_msisdn = instance.msisdn
+
+
+def invalidate_identity_cache(sender, instance, **kwargs):
+    """
+    Signal handler for Django, forget the cached identity for the msisdn,
+    and the msisdn it had before, once an identity changed.
+    """
+    identity_cache.invalidate(instance.msisdn)
+    previous = getattr(instance, '_cached_msisdn', None)
+    if previous is not None and previous != instance.msisdn:
+        identity_cache.invalidate(previous)
+    instance._cached_msisdn = instance.msisdn
+
+post_init.connect(remember_identity_msisdn, sender=Identity)
+post_save.connect(invalidate_identity_cache, sender=Identity)
+post_delete.connect(invalidate_identity_cache, sender=Identity)
+
+
 class Actor(models.Model):
     """
     A person with access to FNCS and who is able to interact with the
@@ -109,19 +153,42 @@ class Actor(models.Model):
         ('F', 'Female'),
     ))
 
+    def _role(self, role, related_objects):
+        """
+        Get the actor's only object for the role, from the roles loaded
+        by :meth:`roles` when available.
+        """
+        roles = getattr(self, '_roles_cache', None)
+        if roles is not None:
+            return roles.get(role)
+        # two rows are enough to tell that there's more than one
+        objects = list(related_objects.all()[:2])
+        if len(objects) > 1:
+            raise errors.ActorException(
+                'More than one %s for an actor' % (role,))
+        if objects:
+            return objects[0]
+
+    def roles(self):
+        """
+        Load all the roles of this actor with a single query. The ``as_*``
+        and ``is_*`` methods use these roles from then on instead of
+        querying for them again.
+
+        :rtype: magriculture.fncs.roles.ActorRoles
+        """
+        return ActorRoles.load(self)
+
     def as_agent(self):
         """
         Get the :class:`Agent` role for this actor, raises an
         :class:`magriculture.fncs.errors.ActorException` if there is more than
-        one agent available. Returns `None` if no agent exists.
+        one agent available or if no agent exists.
         """
-        agents = self.agent_set.all()
-        if agents.count() > 1:
-            raise errors.ActorException('More than one agent for an actor')
-        if agents.exists():
-            return agents[0]
-        else:
+        agent = self._role('agent', self.agent_set)
+        if agent is None:
             raise errors.ActorException('You need to be an agent to acces this page')
+        return agent
 
     def as_marketmonitor(self):
         """
@@ -130,12 +197,7 @@ class Actor(models.Model):
         if there is more than one :class:`MarketMonitor` available.
         Returns `None` if no agent exists.
         """
-        marketmonitors = self.marketmonitor_set.all()
-        if marketmonitors.count() > 1:
-            raise errors.ActorException('More than one marketmonitor for'
-                                        ' an actor')
-        if marketmonitors.exists():
-            return marketmonitors[0]
+        return self._role('marketmonitor', self.marketmonitor_set)
 
     def as_farmer(self):
         """
@@ -144,11 +206,7 @@ class Actor(models.Model):
         than one :class:`Farmer` available.
         Returns `None` if no farmer exists.
         """
-        farmers = self.farmer_set.all()
-        if farmers.count() > 1:
-            raise errors.ActorException('More than one farmer for an actor')
-        if farmers.exists():
-            return farmers[0]
+        return self._role('farmer', self.farmer_set)
 
     def as_extensionofficer(self):
         """
@@ -157,19 +215,15 @@ class Actor(models.Model):
         than one :class:`ExtensionOfficer` available.
         Returns `None` if no farmer exists.
         """
-        extensionofficers = self.extensionofficer_set.all()
-        if extensionofficers.count() > 1:
-            raise errors.ActorException("More than one extensionofficer"
-                                        " for an actor")
-        if extensionofficers.exists():
-            return extensionofficers[0]
-
-        return None
+        return self._role('extensionofficer', self.extensionofficer_set)
 
     def is_extensionofficer(self):
         """
         Checks if the user is an extension officer
         """
+        roles = getattr(self, '_roles_cache', None)
+        if roles is not None:
+            return roles.is_extensionofficer()
         return self.extensionofficer_set.exists()
 
     def as_fba(self):
@@ -179,11 +233,7 @@ class Actor(models.Model):
         than one :class:`FarmerBusinessAdvisor` available.
         returns `None` if no farmer exists.
         """
-        fbas = self.fba_set.all()
-        if fbas.count() > 1:
-            raise errors.ActorException("More than one fba for an actor")
-        if fbas.exists():
-            return fbas[0]
+        return self._role('fba', self.farmerbusinessadvisor_set)
 
     def send_message(self, recipient, message, group):
         """
@@ -202,11 +252,27 @@ class Actor(models.Model):
         :rtype: magriculture.fncs.models.props.Message
 
         """
-        msisdns = recipient.get_msisdns()
+        message = self.queue_message(recipient, message, group)
+        if message.status == Message.PENDING:
+            Message.deliver([message.pk])
+        return message
+
+    def queue_message(self, recipient, message, group):
+        """
+        Store a message to an other actor without delivering it, see
+        :meth:`magriculture.fncs.models.props.Message.deliver`.
+
+        :returns: the message stored
+        :rtype: magriculture.fncs.models.props.Message
+        """
+        msisdns = recipient.get_msisdns(limit=1)
         if msisdns:
-            send_sms(msisdns[0], message)
+            to_addr, status = msisdns[0], Message.PENDING
+        else:
+            to_addr, status = '', Message.NO_ADDRESS
         return Message.objects.create(sender=self, recipient=recipient,
-                                      content=message, group=group)
+                                      content=message, group=group,
+                                      to_addr=to_addr, status=status)
 
     def add_identity(self, msisdn, pin=None):
         identity = Identity(msisdn=msisdn, actor=self)
@@ -236,6 +302,9 @@ class Actor(models.Model):
         role. This is used in the to dynamically display the menu based
         on the user type.
         """
+        roles = getattr(self, '_roles_cache', None)
+        if roles is not None:
+            return roles.is_agent()
         return self.agent_set.exists()
 
     def send_message_to_farmer(self, farmer, message, group=None):
@@ -264,26 +333,58 @@ class Actor(models.Model):
                                                    content=message)
 
         groupmessage.farmergroups.add(farmergroups)
-        for farmer in farmergroups.members():
-            self.send_message_to_farmer(farmer, message, groupmessage)
+        for actor_ids in farmergroups.member_actor_ids():
+            self.queue_group_messages(groupmessage, actor_ids)
         return groupmessage
 
+    def queue_group_messages(self, groupmessage, actor_ids):
+        """
+        Store the group message for each of the given recipients with a
+        single insert and queue their delivery.
+
+        :param groupmessage: the
+            :class:`magriculture.fncs.models.props.GroupMessage` sent
+        :param actor_ids: list of :class:`Actor` primary keys
+        """
+        msisdns = Identity.latest_msisdns(actor_ids)
+        messages = []
+        for actor_id in actor_ids:
+            to_addr = msisdns.get(actor_id, '')
+            messages.append(Message(
+                sender=self, recipient_id=actor_id, group=groupmessage,
+                content=groupmessage.content, to_addr=to_addr,
+                status=Message.PENDING if to_addr else Message.NO_ADDRESS))
+        bulk_create(Message, messages)
+        # bulk_create doesn't set the primary keys
+        Message.deliver(list(Message.objects.filter(
+            group=groupmessage, recipient__in=actor_ids,
+            status=Message.PENDING).values_list('pk', flat=True)))
+
     @classmethod
     def _find_identity(cls, msisdn):
-        return Identity.objects.get(msisdn=msisdn)
+        """
+        :returns: the cached identity for the msisdn, see
+                  :class:`magriculture.fncs.identities.CachedIdentity`
+        :raises Identity.DoesNotExist: if there is no identity
+        """
+        identity = identity_cache.lookup(msisdn)
+        if identity is None:
+            raise Identity.DoesNotExist(
+                "No identity with msisdn %r" % (msisdn,))
+        return identity
 
     @classmethod
     def find(cls, msisdn):
-        return cls._find_identity(msisdn).actor
+        return cls.objects.get(pk=cls._find_identity(msisdn).actor_id)
 
     @classmethod
     def find_with_pin(cls, msisdn, pin):
         identity = cls._find_identity(msisdn)
         if identity.pin:
             if identity.check_pin(pin):
-                return identity.actor
+                return cls.objects.get(pk=identity.actor_id)
             raise errors.ActorException('Invalid pin')
-        return identity.actor
+        return cls.objects.get(pk=identity.actor_id)
 
     class Meta:
         ordering = ['-name']
@@ -451,6 +552,121 @@ class Farmer(models.Model):
 
         return farmer
 
+    @classmethod
+    @commit_on_success
+    def register(cls, registrations):
+        """
+        Create many farmers at once, in a single transaction.
+
+        The users, actors, identities and farmers for MSISDNs that aren't
+        registered yet are inserted with a fixed number of queries rather
+        than a few queries per farmer. Registrations for existing users
+        are handled like :meth:`create`.
+
+        :param list registrations:
+            dicts with the ``msisdn``, ``name``, ``surname`` and
+            optionally the ``id_number``, ``gender`` and the primary keys
+            of the farmer's ``crops``, ``wards`` and ``districts``.
+        :returns: the farmers, in the order of the registrations
+        :rtype: list of :class:`Farmer`
+        """
+        msisdns = [registration['msisdn'] for registration in registrations]
+        existing = set(User.objects.filter(
+            username__in=msisdns).values_list('username', flat=True))
+
+        farmers = {}
+        for registration in registrations:
+            if registration['msisdn'] in existing:
+                farmers[registration['msisdn']] = cls.create(
+                    registration['msisdn'], registration['name'],
+                    registration['surname'],
+                    id_number=registration.get('id_number'),
+                    gender=registration.get('gender') or cls.UNKNOWN)
+
+        new = [registration for registration in registrations
+               if registration['msisdn'] not in existing]
+        if new:
+            farmers.update(cls._insert_farmers(new))
+
+        cls._add_relations([(farmers[registration['msisdn']], registration)
+                            for registration in registrations])
+        return [farmers[msisdn] for msisdn in msisdns]
+
+    @classmethod
+    def _insert_farmers(cls, registrations):
+        """
+        Insert new users with their actors, identities and farmers without
+        going through the signals that :meth:`create` relies on.
+
+        :returns: dict of the farmers by MSISDN
+        """
+        msisdns = [registration['msisdn'] for registration in registrations]
+        bulk_create(User, [
+            User(username=registration['msisdn'],
+                 first_name=registration['name'],
+                 last_name=registration['surname'],
+                 password=make_password(None))
+            for registration in registrations])
+        user_ids = dict(User.objects.filter(
+            username__in=msisdns).values_list('username', 'pk'))
+
+        bulk_create(Actor, [
+            Actor(user_id=user_ids[registration['msisdn']],
+                  name='%s %s' % (registration['name'].strip(),
+                                  registration['surname'].strip()))
+            for registration in registrations])
+        actor_ids = dict(
+            (username, actor_id) for actor_id, username
+            in Actor.objects.filter(user__username__in=msisdns).values_list(
+                'pk', 'user__username'))
+
+        bulk_create(Identity, [
+            Identity(actor_id=actor_ids[msisdn], msisdn=msisdn)
+            for msisdn in msisdns])
+        # the cache may remember these MSISDNs as not having an identity
+        for msisdn in msisdns:
+            identity_cache.invalidate(msisdn)
+
+        bulk_create(cls, [
+            cls(actor_id=actor_ids[registration['msisdn']],
+                id_number=registration.get('id_number') or None,
+                gender=registration.get('gender') or cls.UNKNOWN)
+            for registration in registrations])
+        msisdns_by_actor = dict((actor_id, msisdn)
+                                for msisdn, actor_id in actor_ids.items())
+        return dict(
+            (msisdns_by_actor[farmer.actor_id], farmer) for farmer
+            in cls.objects.filter(actor__in=actor_ids.values())
+                          .select_related('actor__user'))
+
+    @classmethod
+    def _add_relations(cls, registrations):
+        """
+        Link the farmers to the crops, wards and districts of their
+        registrations with one insert per relation and refresh their
+        :class:`GroupMembership` rows.
+
+        :param list registrations: ``(farmer, registration)`` pairs
+        """
+        farmer_ids = [farmer.pk for farmer, _ in registrations]
+        for field_name in ['crops', 'wards', 'districts']:
+            field = cls._meta.get_field(field_name)
+            through = field.rel.through
+            source = '%s_id' % (field.m2m_field_name(),)
+            target = '%s_id' % (field.m2m_reverse_field_name(),)
+            linked = set(through.objects.filter(
+                **{'%s__in' % (source,): farmer_ids}).values_list(
+                source, target))
+            links = []
+            for farmer, registration in registrations:
+                for pk in registration.get(field_name, []):
+                    if (farmer.pk, pk) not in linked:
+                        linked.add((farmer.pk, pk))
+                        links.append(through(**{source: farmer.pk,
+                                                target: pk}))
+            bulk_create(through, links)
+        GroupMembership.refresh(farmer_ids)
+
     @classmethod
     def match(cls, msisdns=None, id_number=None):
         actors = set()
@@ -491,15 +707,44 @@ class FarmerGroup(models.Model):
 
     def members(self):
         """
-        :returns: the farmers member to this group by direct filtering
+        :returns: the farmers member to this group, filtered through the
+                  precomputed :class:`GroupMembership` table
         :rtype: magriculture.fncs.models.actors.Farmer
         """
-        data = {"crops": self.crop,
-                "districts__in": self.district.all()}
+        memberships = GroupMembership.objects.filter(
+            crop=self.crop_id, district__in=self.district.all(),
+            agent=self.get_agent())
+        return Farmer.objects.filter(pk__in=memberships.values('farmer'))
+
+    def get_agent(self):
+        """
+        :returns: the :class:`Agent` role of the group's actor, only the
+                  farmers of that agent are members. `None` if the actor
+                  isn't an agent.
+        """
+        if not hasattr(self, '_agent_cache'):
+            agents = list(Agent.objects.filter(actor=self.actor_id)[:1])
+            self._agent_cache = agents[0] if agents else None
+        return self._agent_cache
 
-        if self.actor.is_agent():
-            data["agent_farmer"] = self.actor.as_agent()
-        return (Farmer.objects.filter(**data).all().distinct())
+    def member_actor_ids(self, chunk_size=None):
+        """
+        Stream the :class:`Actor` primary keys of the members of this
+        group in chunks, ordered by farmer so that each chunk is a cheap
+        range query rather than an ever growing OFFSET.
+
+        :returns: generator of lists of :class:`Actor` primary keys
+        """
+        chunk_size = chunk_size or settings.GROUP_MESSAGE_CHUNK_SIZE
+        members = self.members().order_by('pk')
+        last_pk = 0
+        while True:
+            chunk = list(members.filter(pk__gt=last_pk).values_list(
+                'pk', 'actor_id')[:chunk_size])
+            if not chunk:
+                return
+            last_pk = chunk[-1][0]
+            yield [actor_id for _, actor_id in chunk]
 
     class Meta:
         ordering = ['-name']
@@ -510,6 +755,72 @@ class FarmerGroup(models.Model):
         return self.name
 
 
+class GroupMembership(models.Model):
+    """
+    A precomputed row for every combination of crop, district and agent
+    (or no agent) a farmer can be selected by when building a
+    :class:`FarmerGroup`.
+
+    It's kept up to date from the ``m2m_changed`` signals of
+    `Farmer.crops`, `Farmer.districts` & `Agent.farmers`, use
+    :meth:`rebuild` after changing those tables without signals.
+    """
+    farmer = models.ForeignKey('fncs.Farmer')
+    crop = models.ForeignKey('fncs.Crop')
+    district = models.ForeignKey('fncs.District')
+    #: `None` for the row matched by groups of actors that aren't agents
+    agent = models.ForeignKey('fncs.Agent', null=True)
+
+    class Meta:
+        app_label = 'fncs'
+        unique_together = ('farmer', 'crop', 'district', 'agent')
+
+    def __unicode__(self):
+        return u"%s (GroupMembership)" % (self.farmer_id,)
+
+    @classmethod
+    def refresh(cls, farmer_ids):
+        """
+        Recompute the memberships of the given farmers from their crops,
+        districts and agents.
+
+        :param farmer_ids: list of :class:`Farmer` primary keys
+        """
+        farmer_ids = list(farmer_ids)
+        crops, districts, agents = {}, {}, {}
+        for relations, through, field in [
+                (crops, Farmer.crops.through, 'crop_id'),
+                (districts, Farmer.districts.through, 'district_id'),
+                (agents, Agent.farmers.through, 'agent_id')]:
+            pairs = through.objects.filter(
+                farmer__in=farmer_ids).values_list('farmer_id', field)
+            for farmer_id, pk in pairs:
+                relations.setdefault(farmer_id, []).append(pk)
+
+        memberships = []
+        for farmer_id in farmer_ids:
+            for crop_id in crops.get(farmer_id, []):
+                for district_id in districts.get(farmer_id, []):
+                    for agent_id in [None] + agents.get(farmer_id, []):
+                        memberships.append(cls(
+                            farmer_id=farmer_id, crop_id=crop_id,
+                            district_id=district_id, agent_id=agent_id))
+        cls.objects.filter(farmer__in=farmer_ids).delete()
+        bulk_create(cls, memberships)
+
+    @classmethod
+    def rebuild(cls, chunk_size=500):
+        """
+        Recompute the memberships of all farmers.
+
+        :returns: the number of farmers
+        """
+        farmer_ids = list(Farmer.objects.values_list('pk', flat=True))
+        for i in range(0, len(farmer_ids), chunk_size):
+            cls.refresh(farmer_ids[i:i + chunk_size])
+        return len(farmer_ids)
+
+
 class ExtensionOfficer(models.Model):
     """A extension officer is an actor that is linked to a geographic zone and
     communicates with farmer groups"""
@@ -703,7 +1014,8 @@ class Agent(models.Model):
 
         :param farmer: a :class:`Farmer`
         """
-        return self.cropreceipt_set.filter(farmer=farmer, reconciled=False)
+        return self.cropreceipt_set.filter(
+            farmer=farmer, reconciled=False).select_related('unit', 'crop')
 
     def cropreceipts_available(self):
         """
@@ -726,6 +1038,9 @@ class Agent(models.Model):
         """
         Register a sale from a given crop-receipt.
 
+        The sale is stored in a single transaction and the messages to the
+        farmer are only queued for delivery once it is committed.
+
         :param crop_receipt: which crop receipt this sale is going out of
         :type crop_receipt: magriculture.fncs.models.props.CropReceipt
 
@@ -738,22 +1053,32 @@ class Agent(models.Model):
         :raises: :class:`magriculture.fncs.errors.CropReceiptException` if not
                  enough inventory
         """
-        if crop_receipt.remaining_inventory() < amount:
-            raise errors.CropReceiptException, 'not enough inventory'
-        transaction = Transaction.objects.create(
-            crop_receipt=crop_receipt, amount=amount, price=price,
-            created_at=datetime.now())
-
-        self.actor.send_message_to_farmer(crop_receipt.farmer,
-                                    transaction.as_sms())
-
-        # see if we've sold everything we have and then update the
-        # reconciled boolean
-        if crop_receipt.remaining_inventory() <= 0:
-            crop_receipt.reconciled = True
-            crop_receipt.save()
-            self.actor.send_message_to_farmer(crop_receipt.farmer,
-                                        crop_receipt.as_sms())
+        farmer_actor = crop_receipt.farmer.actor
+        with commit_on_success():
+            if not crop_receipt.sell(amount):
+                raise errors.CropReceiptException, 'not enough inventory'
+            transaction = Transaction(
+                crop_receipt=crop_receipt, amount=amount, price=price,
+                created_at=datetime.now())
+            # the amount is already counted by the sale
+            transaction._sold_amount = (crop_receipt.pk, amount)
+            transaction.save()
+
+            messages = [self.actor.queue_message(
+                farmer_actor, transaction.as_sms(), None)]
+
+            # see if we've sold everything we have and then update the
+            # reconciled boolean
+            if crop_receipt.remaining_inventory() <= 0:
+                # a save would overwrite the sold amount of the sales made
+                # meanwhile
+                crop_receipt.reconciled = True
+                CropReceipt.objects.filter(pk=crop_receipt.pk).update(
+                    reconciled=True)
+                messages.append(self.actor.queue_message(
+                    farmer_actor, crop_receipt.as_sms(), None))
+        Message.deliver([message.pk for message in messages
+                         if message.status == Message.PENDING])
         return transaction
 
     def sales_for(self, farmer):
@@ -851,3 +1176,31 @@ class FBAdvisorRelationShip(models.Model):
 
     class Meta:
         app_label = 'fncs'
+
+
+def update_group_memberships(sender, instance, action, pk_set, **kwargs):
+    """
+    Signal handler for Django, refreshes the :class:`GroupMembership`
+    rows of the farmers whose crops, districts or agents changed.
+    """
+    if isinstance(instance, Farmer):
+        farmer_ids = [instance.pk]
+    elif action == 'pre_clear':
+        # Remember who is being cleared, the rows are gone by post_clear
+        field = [f.name for f in sender._meta.fields
+                 if f.rel and isinstance(instance, f.rel.to)][0]
+        instance._cleared_farmer_ids = list(sender.objects.filter(
+            **{field: instance.pk}).values_list('farmer_id', flat=True))
+        return
+    elif action == 'post_clear':
+        farmer_ids = instance.__dict__.pop('_cleared_farmer_ids', [])
+    else:
+        farmer_ids = pk_set or []
+
+    if action in ('post_add', 'post_remove', 'post_clear') and farmer_ids:
+        GroupMembership.refresh(farmer_ids)
+
+m2m_changed.connect(update_group_memberships, sender=Farmer.crops.through)
+m2m_changed.connect(update_group_memberships,
+                    sender=Farmer.districts.through)
+m2m_changed.connect(update_group_memberships, sender=Agent.farmers.through)
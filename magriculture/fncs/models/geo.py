@@ -1,5 +1,8 @@
-from django.db import models
-from magriculture.fncs.models.props import Crop, Transaction
+from django.db import models, connection
+from django.db.models.signals import post_save, post_delete
+from magriculture.fncs.locations import location_backend
+from magriculture.fncs.responses import invalidate_responses
+from magriculture.fncs.models.props import Crop, CropReceipt, Transaction
 
 
 class Province(models.Model):
@@ -69,6 +72,22 @@ class Zone(models.Model):
         return u"%s (Zone)" % (self.name,)
 
 
+class DistrictManager(models.Manager):
+
+    def with_farmer_counts(self, agent, crop):
+        """
+        The districts with farmers growing `crop` for `agent`, each
+        annotated with the number of those farmers as `farmer_count`.
+        The counts come from
+        :class:`magriculture.fncs.models.actors.GroupMembership` in a
+        single GROUP BY query.
+        """
+        return self.filter(
+            groupmembership__agent=agent,
+            groupmembership__crop=crop).annotate(
+            farmer_count=models.Count('groupmembership'))
+
+
 class District(models.Model):
     """
     A geographic area
@@ -80,6 +99,8 @@ class District(models.Model):
     #: the code of this district, :func:`str`
     code = models.CharField(blank=True, max_length=100)
 
+    objects = DistrictManager()
+
     class Meta:
         ordering = ['-name']
         get_latest_by = 'pk'
@@ -90,10 +111,12 @@ class District(models.Model):
 
     def get_farmer_count(self, agent, crop):
         """
-        Get the total farmers based on the agent and crop selection
+        Get the total farmers based on the agent and crop selection,
+        see :meth:`DistrictManager.with_farmer_counts` for the counts of
+        many districts at once.
         """
-        return self.farmer_district.filter(agent_farmer=agent,
-                                           crops=crop).count()
+        return self.groupmembership_set.filter(agent=agent,
+                                               crop=crop).count()
 
 
 class Ward(models.Model):
@@ -166,20 +189,45 @@ class Market(models.Model):
         Return a list of markets ordered by most recent price of
         the given crop at each market.
 
+        The ranking is computed in a single query: the transactions for
+        the crop are numbered per market from most recent to oldest and
+        only the first `window_size` of them are summed. The sum is always
+        divided by `window_size`, so markets with fewer samples (or none at
+        all) are ranked lower. Ties are broken by market name.
+
         :param crop: :class:`magriculture.fncs.models.props.Crop`
         :param windows_size: int (how many samples to average the price over)
         :returns: :class:`magriculture.fncs.models.geo.Market`
         """
-        markets = Market.objects.all()
-        avg_prices = {}
-        for market in markets:
-            prices = Transaction.objects.filter(crop_receipt__market=market,
-                                                crop_receipt__crop=crop
-                                                ).order_by('-created_at')
-            # '-created_at' puts most recent price first
-            prices = prices.values_list('price', flat=True)[:window_size]
-            avg_prices[market.pk] = sum(prices) / float(window_size)
-        return sorted(markets, key=lambda market: avg_prices[market.pk], reverse=True)
+        qn = connection.ops.quote_name
+        sql = """
+            SELECT market.*,
+                   COALESCE(ranked.total, 0) / %%s AS average_price
+            FROM %(market)s market
+            LEFT OUTER JOIN (
+                SELECT recent.market_id, SUM(recent.price) AS total
+                FROM (
+                    SELECT receipt.market_id, trans.price,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY receipt.market_id
+                               ORDER BY trans.created_at DESC
+                           ) AS row_position
+                    FROM %(transaction)s trans
+                    INNER JOIN %(receipt)s receipt
+                        ON trans.crop_receipt_id = receipt.id
+                    WHERE receipt.crop_id = %%s
+                ) recent
+                WHERE recent.row_position <= %%s
+                GROUP BY recent.market_id
+            ) ranked ON ranked.market_id = market.id
+            ORDER BY average_price DESC, market.name ASC, market.id ASC
+        """ % {
+            'market': qn(cls._meta.db_table),
+            'transaction': qn(Transaction._meta.db_table),
+            'receipt': qn(CropReceipt._meta.db_table),
+        }
+        return list(cls.objects.raw(
+            sql, [float(window_size), crop.pk, window_size]))
 
     class Meta:
         ordering = ['name']
@@ -188,3 +236,23 @@ class Market(models.Model):
 
     def __unicode__(self):
         return self.name
+
+
+def invalidate_location_index(sender, instance, **kwargs):
+    """
+    Signal handler for Django, rebuild the location search index once a
+    ward or district changed.
+    """
+    location_backend.invalidate()
+
+post_save.connect(invalidate_location_index, sender=Ward)
+post_delete.connect(invalidate_location_index, sender=Ward)
+post_save.connect(invalidate_location_index, sender=District)
+post_delete.connect(invalidate_location_index, sender=District)
+
+post_save.connect(invalidate_responses, sender=Market)
+post_delete.connect(invalidate_responses, sender=Market)
+post_save.connect(invalidate_responses, sender=Ward)
+post_delete.connect(invalidate_responses, sender=Ward)
+post_save.connect(invalidate_responses, sender=District)
+post_delete.connect(invalidate_responses, sender=District)
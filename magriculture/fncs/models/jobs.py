@@ -0,0 +1,52 @@
+from django.db import models
+
+
+class Job(models.Model):
+    """
+    A job split into chunks that run as separate Celery tasks, see
+    :func:`magriculture.fncs.tasks.fan_out`.
+
+    The progress of the jobs is kept in the database rather than the cache
+    so that every worker process sees it.
+    """
+    #: the job id handed to the chunk tasks, :func:`str`
+    id = models.CharField(max_length=32, primary_key=True)
+    #: the timestamp :func:`datetime.datetime` the job was started at
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        get_latest_by = 'created_at'
+        app_label = 'fncs'
+
+    def __unicode__(self):
+        return u"Job %s" % (self.pk,)
+
+    def progress(self):
+        """
+        :returns: a ``(chunks done, total chunks)`` tuple
+        """
+        counts = dict(self.jobchunk_set.values_list('done').annotate(
+            count=models.Count('pk')).order_by())
+        return counts.get(True, 0), sum(counts.values())
+
+
+class JobChunk(models.Model):
+    """
+    A range of primary keys handled by a single task of a :class:`Job`.
+    """
+    #: the :class:`Job`
+    job = models.ForeignKey('fncs.Job')
+    #: the first primary key of the range, :func:`int`
+    first_pk = models.IntegerField()
+    #: the last primary key of the range, :func:`int`
+    last_pk = models.IntegerField()
+    #: whether the chunk's task completed, :func:`bool`
+    done = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('job', 'first_pk', 'last_pk')
+        app_label = 'fncs'
+
+    def __unicode__(self):
+        return u"%s-%s of %s" % (self.first_pk, self.last_pk, self.job)
@@ -1,5 +1,10 @@
-from django.db import models
+from functools import wraps
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.signals import post_init, post_save, post_delete
 from django.template.defaultfilters import floatformat
+from magriculture.fncs.responses import invalidate_responses
 
 
 CROP_QUALITY_CHOICES = (
@@ -10,6 +15,24 @@ CROP_QUALITY_CHOICES = (
     (0, 'Poor'),
 )
 
+#: how far a receipt's stored sold amount may be off its transaction
+#: history, floats don't add up exactly
+SOLD_AMOUNT_TOLERANCE = 1e-6
+
+
+def _atomic(func):
+    """
+    Run `func` in a transaction unless it's part of one already, where a
+    nested ``commit_on_success`` would commit the enclosing transaction.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if transaction.is_managed():
+            return func(*args, **kwargs)
+        with transaction.commit_on_success():
+            return func(*args, **kwargs)
+    return wrapper
+
 
 class Crop(models.Model):
     """
@@ -69,6 +92,9 @@ class CropReceipt(models.Model):
                                   choices=CROP_QUALITY_CHOICES)
     #: the amount of delivered in :class:`CropUnit`
     amount = models.FloatField('Quantity')
+    #: the amount sold so far, kept in step with the :class:`Transaction`
+    #: history by :meth:`sell` and the transactions' signal handlers
+    sold_amount = models.FloatField(blank=False, default=0)
     created_at = models.DateTimeField(blank=False)
     #: whether all of the delivered goods have been sold or not
     reconciled = models.BooleanField(blank=False, default=False)
@@ -80,17 +106,53 @@ class CropReceipt(models.Model):
 
     def remaining_inventory(self):
         """
-        Calculate how much inventory is still left based on the transaction
-        history
+        Calculate how much inventory is still left based on the stored
+        sold amount
+
+        :returns: :func:`float`
+        """
+        return self.amount - self.sold_amount
+
+    def sell(self, amount):
+        """
+        Atomically take `amount` out of the remaining inventory.
+
+        The check and the update happen in a single UPDATE statement so
+        concurrent sales cannot oversell a receipt.
+
+        :returns: :func:`bool`, False if there isn't enough inventory left
+        """
+        updated = CropReceipt.objects.filter(
+            pk=self.pk, amount__gte=models.F('sold_amount') + amount).update(
+            sold_amount=models.F('sold_amount') + amount)
+        if updated:
+            self.sold_amount = CropReceipt.objects.filter(
+                pk=self.pk).values_list('sold_amount', flat=True)[0]
+        return bool(updated)
+
+    def calculate_sold_amount(self):
+        """
+        Calculate how much has been sold from the transaction history
 
-        :returns: :func:`int`
+        :returns: :func:`float`
         """
         aggregate = Transaction.objects.filter(crop_receipt=self).aggregate(
             total_sold=models.Sum('amount'))
         # If there are no transactions, total_sold will be None, if
         # that's the case then we want to return zero
-        sold_inventory = aggregate.get('total_sold') or 0
-        return self.amount - sold_inventory
+        return aggregate.get('total_sold') or 0
+
+    @classmethod
+    def mismatched_sold_amounts(cls):
+        """
+        Return the receipts whose stored sold amount doesn't match their
+        transaction history, annotated with `total_sold`.
+        """
+        receipts = cls.objects.annotate(
+            total_sold=models.Sum('transaction__amount'))
+        return [receipt for receipt in receipts
+                if abs(receipt.sold_amount - (receipt.total_sold or 0)) >
+                SOLD_AMOUNT_TOLERANCE]
 
     def as_sms(self):
         """Return an SMS representation of a crop receipt."""
@@ -248,6 +310,196 @@ class Offer(models.Model):
             self.unit, self.crop, self.price_floor, self.price_ceiling)
 
 
+class PriceSummary(models.Model):
+    """
+    The most recent prices of a crop sold in a given unit at a given
+    market. Summaries are kept up to date as :class:`Transaction` and
+    :class:`Offer` records are saved or deleted so that price pages don't
+    need to query the raw history for every market, crop & unit.
+    """
+    TRANSACTION = 'transaction'
+    OFFER = 'offer'
+    #: how many of the most recent prices are kept
+    WINDOW_SIZE = 10
+
+    #: where the prices come from, either :class:`Transaction` prices or
+    #: the averaged floor & ceiling prices of an :class:`Offer`
+    source = models.CharField(max_length=20, choices=(
+        (TRANSACTION, 'Transaction'),
+        (OFFER, 'Offer'),
+    ))
+    #: the :class:`magriculture.fncs.models.geo.Market`
+    market = models.ForeignKey('fncs.Market')
+    #: the :class:`Crop`
+    crop = models.ForeignKey('fncs.Crop')
+    #: the :class:`CropUnit`
+    unit = models.ForeignKey('fncs.CropUnit')
+    #: comma separated prices, most recent first
+    prices = models.TextField(blank=True)
+    #: the average of `prices`, :func:`float`
+    mean = models.FloatField(null=True)
+    #: the most recent price, :func:`float`
+    last_price = models.FloatField(null=True)
+    #: :func:`datetime.datetime` of the most recent price
+    latest_at = models.DateTimeField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('source', 'market', 'crop', 'unit')
+        get_latest_by = 'updated_at'
+        app_label = 'fncs'
+
+    def price_list(self):
+        """
+        :returns: list of prices as floats, most recent first
+        """
+        if not self.prices:
+            return []
+        return [float(price) for price in self.prices.split(',')]
+
+    def set_prices(self, prices, latest_at):
+        """
+        Store the given prices, most recent first, and update the
+        derived fields.
+        """
+        prices = list(prices)[:self.WINDOW_SIZE]
+        self.prices = ','.join(repr(float(price)) for price in prices)
+        self.mean = sum(prices) / float(len(prices)) if prices else None
+        self.last_price = prices[0] if prices else None
+        self.latest_at = latest_at
+
+    def add_price(self, price, created_at):
+        """
+        Add a price to the summary if it is the most recent one.
+
+        :returns: `True` if the price was added, `False` if it is older
+                  than the prices already summarised and the summary needs
+                  to be refreshed instead.
+        """
+        if self.latest_at is not None and created_at < self.latest_at:
+            return False
+        self.set_prices([price] + self.price_list(), created_at)
+        return True
+
+    @classmethod
+    def _recent_prices(cls, source, market_id, crop_id, unit_id):
+        """
+        Return a list of (price, created_at) tuples from the raw history,
+        most recent first.
+        """
+        if source == cls.TRANSACTION:
+            history = Transaction.objects.filter(
+                crop_receipt__market=market_id, crop_receipt__crop=crop_id,
+                crop_receipt__unit=unit_id).values_list('price', 'created_at')
+            rows = history.order_by('-created_at', '-pk')[:cls.WINDOW_SIZE]
+            return list(rows)
+        history = Offer.objects.filter(
+            market=market_id, crop=crop_id, unit=unit_id).values_list(
+            'price_floor', 'price_ceiling', 'created_at')
+        rows = history.order_by('-created_at', '-pk')[:cls.WINDOW_SIZE]
+        return [((floor + ceiling) / 2.0, created_at)
+                for floor, ceiling, created_at in rows]
+
+    @classmethod
+    def _lock(cls, source, market_id, crop_id, unit_id):
+        """
+        Get or create the summary and lock it until the end of the
+        transaction, so that concurrent updates of a summary happen one
+        after the other instead of overwriting each other.
+
+        :returns: a ``(summary, created)`` tuple
+        """
+        summary, created = cls.objects.get_or_create(
+            source=source, market_id=market_id, crop_id=crop_id,
+            unit_id=unit_id)
+        if not created:
+            # a new summary is locked by its insert
+            summary = cls.objects.select_for_update().get(pk=summary.pk)
+        return summary, created
+
+    def _refresh(self):
+        rows = self._recent_prices(self.source, self.market_id,
+                                   self.crop_id, self.unit_id)
+        if not rows:
+            self.delete()
+            return None
+        self.set_prices([price for price, _ in rows], rows[0][1])
+        self.save()
+        return self
+
+    @classmethod
+    @_atomic
+    def refresh(cls, source, market_id, crop_id, unit_id):
+        """
+        Recalculate the summary from the raw price history.
+
+        :returns: the :class:`PriceSummary` or `None` if there is no
+                  price history.
+        """
+        summary, _ = cls._lock(source, market_id, crop_id, unit_id)
+        return summary._refresh()
+
+    @classmethod
+    @_atomic
+    def record(cls, source, market_id, crop_id, unit_id, price, created_at):
+        """
+        Incrementally add a newly created price to its summary, falling
+        back to :func:`refresh` when the price isn't the most recent one.
+        """
+        summary, created = cls._lock(source, market_id, crop_id, unit_id)
+        if created or not summary.add_price(price, created_at):
+            return summary._refresh()
+        summary.save()
+        return summary
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Throw away all summaries and recalculate them from the raw
+        price history.
+
+        :returns: the number of summaries created
+        """
+        cls.objects.all().delete()
+        keys = set()
+        for triple in CropReceipt.objects.filter(
+                transaction__isnull=False).values_list(
+                'market', 'crop', 'unit').distinct():
+            keys.add((cls.TRANSACTION,) + triple)
+        for triple in Offer.objects.values_list(
+                'market', 'crop', 'unit').distinct():
+            keys.add((cls.OFFER,) + triple)
+        for key in keys:
+            cls.refresh(*key)
+        return len(keys)
+
+    @classmethod
+    def history_for(cls, source, market, crop, unit):
+        """
+        Return the summarised prices for the market, crop & unit
+        combination.
+
+        :returns: list of prices as floats, most recent first.
+        """
+        summary = cls.summary_for(source, market, crop, unit)
+        return summary.price_list() if summary else []
+
+    @classmethod
+    def summary_for(cls, source, market, crop, unit):
+        """
+        :returns: the :class:`PriceSummary` or `None`
+        """
+        try:
+            return cls.objects.get(source=source, market=market, crop=crop,
+                                   unit=unit)
+        except cls.DoesNotExist:
+            return None
+
+    def __unicode__(self):
+        return u"%s of %s at %s (%s PriceSummary)" % (
+            self.unit, self.crop, self.market, self.get_source_display())
+
+
 class Message(models.Model):
     """
     A message sent or received via FNCS
@@ -265,6 +517,37 @@ class Message(models.Model):
     #: the :class:`GroupMessage` this message is part of
     group = models.ForeignKey('fncs.GroupMessage', null=True)
 
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    NO_ADDRESS = 'no_address'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+        (NO_ADDRESS, 'No address'),
+    )
+
+    #: the msisdn the message is delivered to as an SMS, :func:`str`
+    to_addr = models.CharField(blank=True, max_length=100)
+    #: the delivery status of the SMS, choices in `STATUS_CHOICES`
+    status = models.CharField(max_length=20, default=PENDING,
+                              choices=STATUS_CHOICES, db_index=True)
+    #: how many times delivery has been attempted, :func:`int`
+    attempts = models.IntegerField(default=0)
+    #: the timestamp :func:`datetime.datetime` the SMS was delivered at
+    sent_at = models.DateTimeField(blank=True, null=True)
+    #: identifies the messages stored together with a bulk insert, which
+    #: doesn't set their primary keys, :func:`str`
+    batch = models.CharField(blank=True, max_length=32, db_index=True)
+    #: the delivery task that last claimed the message for sending,
+    #: :func:`str`
+    claim = models.CharField(blank=True, max_length=32, db_index=True)
+    #: the timestamp :func:`datetime.datetime` of the last claim
+    claimed_at = models.DateTimeField(blank=True, null=True)
+
     class Meta:
         ordering = ['-created_at']
         get_latest_by = 'created_at'
@@ -274,6 +557,19 @@ class Message(models.Model):
         return u"Message from %s to %s at %s" % (
             self.sender, self.recipient, self.created_at)
 
+    @classmethod
+    def deliver(cls, message_ids):
+        """
+        Queue the given messages for delivery as SMSes by the Celery
+        workers, in batches of `settings.SMS_BATCH_SIZE`.
+
+        :param message_ids: list of :class:`Message` primary keys
+        """
+        from magriculture.fncs.tasks import deliver_messages
+        batch_size = settings.SMS_BATCH_SIZE
+        for i in range(0, len(message_ids), batch_size):
+            deliver_messages.delay(message_ids[i:i + batch_size])
+
 
 class GroupMessage(models.Model):
     """
@@ -323,3 +619,106 @@ class Note(models.Model):
     def __unicode__(self):
         return u"Note from %s to %s at %s" % (
             self.owner, self.about_actor, self.created_at)
+
+
+def update_transaction_price_summary(sender, instance, **kwargs):
+    """
+    Signal handler for Django, keeps the :class:`PriceSummary` of a
+    transaction's market, crop & unit up to date.
+    """
+    if kwargs.get('raw'):
+        # Fixtures are loaded without their related rows being guaranteed
+        # to exist, summaries can be rebuilt afterwards.
+        return
+
+    receipt = instance.crop_receipt
+    key = (PriceSummary.TRANSACTION, receipt.market_id, receipt.crop_id,
+           receipt.unit_id)
+    if kwargs.get('created'):
+        PriceSummary.record(*(key + (instance.price, instance.created_at)))
+    else:
+        PriceSummary.refresh(*key)
+
+
+def update_offer_price_summary(sender, instance, **kwargs):
+    """
+    Signal handler for Django, keeps the :class:`PriceSummary` of an
+    offer's market, crop & unit up to date.
+    """
+    if kwargs.get('raw'):
+        return
+
+    key = (PriceSummary.OFFER, instance.market_id, instance.crop_id,
+           instance.unit_id)
+    if kwargs.get('created'):
+        price = (instance.price_floor + instance.price_ceiling) / 2.0
+        PriceSummary.record(*(key + (price, instance.created_at)))
+    else:
+        PriceSummary.refresh(*key)
+
+post_save.connect(update_transaction_price_summary, sender=Transaction)
+post_delete.connect(update_transaction_price_summary, sender=Transaction)
+post_save.connect(update_offer_price_summary, sender=Offer)
+post_delete.connect(update_offer_price_summary, sender=Offer)
+
+
+def remember_sold_amount(sender, instance, **kwargs):
+    """
+    Signal handler for Django, remember the :class:`CropReceipt` and the
+    amount a transaction was loaded with, which is what's counted in the
+    receipt's `sold_amount`.
+    """
+    if instance.pk is None:
+        instance._sold_amount = None
+    else:
+        instance._sold_amount = (instance.crop_receipt_id, instance.amount)
+
+
+def _change_sold_amount(crop_receipt_id, amount):
+    CropReceipt.objects.filter(pk=crop_receipt_id).update(
+        sold_amount=models.F('sold_amount') + amount)
+
+
+def update_sold_amount(sender, instance, **kwargs):
+    """
+    Signal handler for Django, keeps the `sold_amount` of a transaction's
+    :class:`CropReceipt` in step with transactions created or changed
+    outside of
+    :meth:`magriculture.fncs.models.actors.Agent.register_sale`, like in
+    the admin or the API.
+    """
+    if kwargs.get('raw'):
+        return
+
+    sold_amount = (instance.crop_receipt_id, instance.amount)
+    if not hasattr(instance, '_sold_amount'):
+        # loaded with deferred fields, what was counted isn't known
+        receipt = instance.crop_receipt
+        CropReceipt.objects.filter(pk=receipt.pk).update(
+            sold_amount=receipt.calculate_sold_amount())
+    elif instance._sold_amount != sold_amount:
+        if instance._sold_amount is not None:
+            crop_receipt_id, amount = instance._sold_amount
+            _change_sold_amount(crop_receipt_id, -amount)
+        _change_sold_amount(*sold_amount)
+    instance._sold_amount = sold_amount
+
+
+def release_sold_amount(sender, instance, **kwargs):
+    """
+    Signal handler for Django, returns the amount of a deleted
+    transaction to its :class:`CropReceipt`'s inventory.
+    """
+    sold_amount = getattr(instance, '_sold_amount', None) or (
+        instance.crop_receipt_id, instance.amount)
+    crop_receipt_id, amount = sold_amount
+    _change_sold_amount(crop_receipt_id, -amount)
+
+post_init.connect(remember_sold_amount, sender=Transaction)
+post_save.connect(update_sold_amount, sender=Transaction)
+post_delete.connect(release_sold_amount, sender=Transaction)
+
+post_save.connect(invalidate_responses, sender=Crop)
+post_delete.connect(invalidate_responses, sender=Crop)
+post_save.connect(invalidate_responses, sender=CropUnit)
+post_delete.connect(invalidate_responses, sender=CropUnit)
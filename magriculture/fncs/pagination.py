@@ -0,0 +1,174 @@
+"""
+Keyset pagination for the API resources in :mod:`magriculture.fncs.api`.
+
+Rather than skipping ``offset`` rows, which the database has to read and
+throw away on every page, a page starts after the last object of the
+previous page. The position is handed to clients as an opaque ``cursor``
+that encodes the ordering keys of that object.
+"""
+# Python
+import json
+import base64
+from binascii import Error as Base64Error
+
+# Django
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# Third Party
+from tastypie.exceptions import BadRequest
+from tastypie.paginator import Paginator
+
+
+def _key_fields(keys):
+    """
+    :returns: ``(field_name, descending)`` pairs for ordering keys like
+              ``('-created_at', '-id')``
+    """
+    return [(key.lstrip('-'), key.startswith('-')) for key in keys]
+
+
+def after(keys, values):
+    """
+    :returns: a :class:`django.db.models.Q` for the objects that come
+              after the one with the key `values` when ordered by `keys`.
+    """
+    fields = _key_fields(keys)
+    condition = None
+    for i, (name, descending) in enumerate(fields):
+        lookups = dict((fields[j][0], values[j]) for j in range(i))
+        lookups['%s__%s' % (name, 'lt' if descending else 'gt')] = values[i]
+        condition = Q(**lookups) if condition is None else (
+            condition | Q(**lookups))
+    return condition
+
+
+def ordering_keys(model, keys=None):
+    """
+    :returns: `keys` or, when there are none, the fields of the default
+              ordering of the `model` followed by its primary key to break
+              the ties.
+    """
+    if keys:
+        return tuple(keys)
+    opts = model._meta
+    keys = [key for key in opts.ordering
+            if '__' not in key and key.lstrip('-') != opts.pk.name]
+    descending = bool(keys) and keys[-1].startswith('-')
+    keys.append('-%s' % (opts.pk.name,) if descending else opts.pk.name)
+    return tuple(keys)
+
+
+def key_values(obj, keys):
+    return [getattr(obj, name) for name, _ in _key_fields(keys)]
+
+
+def keyset_chunks(queryset, keys, chunk_size):
+    """
+    Iterate over the objects of the queryset ordered by `keys` in lists of
+    at most `chunk_size` objects, with a query per chunk.
+    """
+    queryset = queryset.order_by(*keys)
+    values = None
+    while True:
+        chunk = queryset
+        if values is not None:
+            chunk = chunk.filter(after(keys, values))
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        values = key_values(chunk[-1], keys)
+
+
+class KeysetPaginator(Paginator):
+    """
+    Pages through the objects ordered by `keys`, which need to identify an
+    object uniquely, or by the model's default ordering and primary key.
+
+    Requests with a ``cursor`` get the page after it, requests without one
+    the first page. The ``meta`` of a page has the ``limit``, the
+    ``next_cursor`` and a ``next`` link, which are `None` on the last
+    page. There is no ``total_count`` since counting all the objects is
+    what keyset pagination avoids, except for requests for all of them
+    with a ``limit`` of 0 where no ``max_limit`` applies.
+
+    Requests with an ``offset`` are paged like any other tastypie
+    resource, for older clients.
+    """
+    #: the fields to order and page by, prefixed by ``-`` for descending,
+    #: see :func:`ordering_keys`
+    keys = None
+
+    def __init__(self, request_data, objects, *args, **kwargs):
+        super(KeysetPaginator, self).__init__(
+            request_data, objects, *args, **kwargs)
+        self.keys = ordering_keys(objects.model, self.keys)
+
+    def encode_cursor(self, obj):
+        values = []
+        for value in key_values(obj, self.keys):
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            values.append(value)
+        return base64.urlsafe_b64encode(json.dumps(values))
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+            if not isinstance(values, list) or len(values) != len(self.keys):
+                raise ValueError(cursor)
+            opts = self.objects.model._meta
+            return [opts.get_field(name).to_python(value) for value, (name, _)
+                    in zip(values, _key_fields(self.keys))]
+        except (ValueError, TypeError, Base64Error, ValidationError):
+            raise BadRequest("Invalid cursor %r provided." % (cursor,))
+
+    def _generate_cursor_uri(self, limit, cursor):
+        if self.resource_uri is None:
+            return None
+        request_params = self.request_data.copy()
+        for name in ['limit', 'offset', 'cursor']:
+            if name in request_params:
+                del request_params[name]
+        request_params.update({'limit': limit, 'cursor': cursor})
+        return '%s?%s' % (self.resource_uri, request_params.urlencode())
+
+    def page(self):
+        if 'offset' in self.request_data:
+            return super(KeysetPaginator, self).page()
+        limit = self.get_limit()
+        objects = self.objects.order_by(*self.keys)
+        cursor = self.request_data.get('cursor')
+        if cursor:
+            objects = objects.filter(
+                after(self.keys, self.decode_cursor(cursor)))
+
+        if limit:
+            # one more than the page tells whether there's a next page
+            objects = list(objects[:limit + 1])
+        else:
+            objects = list(objects)
+        next_cursor = None
+        if limit and len(objects) > limit:
+            objects = objects[:limit]
+            next_cursor = self.encode_cursor(objects[-1])
+
+        meta = {
+            'limit': limit,
+            'next_cursor': next_cursor,
+            'next': next_cursor and self._generate_cursor_uri(
+                limit, next_cursor),
+        }
+        if not limit:
+            meta['total_count'] = len(objects)
+        return {self.collection_name: objects, 'meta': meta}
+
+
+class CreatedAtKeysetPaginator(KeysetPaginator):
+    """
+    Pages through the most recently created objects first.
+    """
+    keys = ('-created_at', '-id')
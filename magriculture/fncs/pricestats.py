@@ -0,0 +1,121 @@
+"""
+Price statistics for the sparklines and averages of the market price
+pages, see :mod:`magriculture.fncs.templatetags.fncs_tags`.
+
+The recent prices of every ``(source, market_id, crop_id, unit_id)``
+series asked for are read from the
+:class:`magriculture.fncs.models.props.PriceSummary` table with a single
+query and the statistics of all the series are calculated at once on a
+NumPy array with a row per series, padded with NaNs.
+"""
+# Python
+import warnings
+from collections import namedtuple
+
+# Third Party
+import numpy
+
+#: how many prices a moving average is taken over
+MOVING_AVERAGE_WINDOW = 3
+
+
+class PriceStats(namedtuple('PriceStats', [
+        'prices', 'mean', 'last_price', 'minimum', 'maximum', 'deviations',
+        'moving_averages', 'volatility'])):
+    """
+    The statistics of a series of prices.
+
+    ``prices`` are in the order of
+    :meth:`magriculture.fncs.models.props.PriceSummary.price_list`, most
+    recent first, and ``deviations`` and ``moving_averages`` have a value
+    for each of them. ``deviations`` are the prices as a percentage of
+    the ``mean`` and the moving average of a price is the average of it
+    and the prices before it, `None` while there are fewer than
+    :data:`MOVING_AVERAGE_WINDOW` of them. ``volatility`` is the standard
+    deviation of the relative changes between prices, `None` for a
+    single price.
+    """
+
+    @classmethod
+    def empty(cls):
+        return cls([], float('nan'), None, None, None, [], [], None)
+
+
+def _optional(value):
+    return None if numpy.isnan(value) else float(value)
+
+
+def calculate(series, window=MOVING_AVERAGE_WINDOW):
+    """
+    :param list series:
+        lists of prices, most recent first.
+    :returns: a list with the :class:`PriceStats` of every series.
+    """
+    if not series:
+        return []
+    length = max(len(prices) for prices in series) or 1
+    prices = numpy.empty((len(series), length))
+    prices.fill(numpy.nan)
+    for row, values in zip(prices, series):
+        row[:len(values)] = values
+    present = ~numpy.isnan(prices)
+    counts = present.sum(axis=1)
+
+    with warnings.catch_warnings():
+        # rows of NaNs, for series without prices, are expected
+        warnings.simplefilter('ignore', RuntimeWarning)
+        means = numpy.nanmean(prices, axis=1)
+        minimums = numpy.nanmin(prices, axis=1)
+        maximums = numpy.nanmax(prices, axis=1)
+        deviations = prices / means[:, numpy.newaxis] * 100
+        # the prices are most recent first, so every price's window is
+        # the price and the ones to the right of it
+        totals = numpy.cumsum(numpy.where(present, prices, 0)[:, ::-1],
+                              axis=1)[:, ::-1]
+        window_totals = totals.copy()
+        window_totals[:, :-window] -= totals[:, window:]
+        moving_averages = window_totals / window
+        positions = numpy.arange(length)[numpy.newaxis, :]
+        moving_averages[positions > (counts - window)[:, numpy.newaxis]] = (
+            numpy.nan)
+        changes = prices[:, :-1] / prices[:, 1:] - 1
+        volatilities = numpy.nanstd(changes, axis=1)
+
+    stats = []
+    for i, values in enumerate(series):
+        count = counts[i]
+        if not count:
+            stats.append(PriceStats.empty())
+            continue
+        stats.append(PriceStats(
+            list(values), float(means[i]), float(values[0]),
+            float(minimums[i]), float(maximums[i]),
+            deviations[i, :count].tolist(),
+            [_optional(value) for value in moving_averages[i, :count]],
+            _optional(volatilities[i])))
+    return stats
+
+
+def price_stats(keys, window=MOVING_AVERAGE_WINDOW):
+    """
+    :param list keys:
+        ``(source, market_id, crop_id, unit_id)`` tuples of the series.
+    :returns: a dict with the :class:`PriceStats` of every key, series
+              without a price summary are empty.
+    """
+    from magriculture.fncs.models.props import PriceSummary
+    keys = list(set(keys))
+    if not keys:
+        return {}
+    sources, markets, crops, units = [set(column) for column in zip(*keys)]
+    summaries = PriceSummary.objects.filter(
+        source__in=sources, market__in=markets, crop__in=crops,
+        unit__in=units).values_list('source', 'market', 'crop', 'unit',
+                                    'prices')
+    prices = dict(((source, market, crop, unit), summary_prices)
+                  for source, market, crop, unit, summary_prices in summaries)
+    series = []
+    for key in keys:
+        summary = PriceSummary(prices=prices.get(key, ''))
+        series.append(summary.price_list())
+    return dict(zip(keys, calculate(series, window)))
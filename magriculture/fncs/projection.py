@@ -0,0 +1,106 @@
+"""
+Read ``__`` separated field paths of a model, like the
+``crop_receipt__farmer__actor__name`` of a
+:class:`magriculture.fncs.models.props.Transaction`, for many objects at
+once for the CSV exports.
+"""
+# Python
+from itertools import islice
+
+# Django
+from django.db.models import ManyToManyField
+from django.db.models.fields import FieldDoesNotExist
+
+# Project
+from magriculture.fncs.errors import ProjectionException
+
+
+class Projection(object):
+    """
+    Compiles field paths into a single ``values_list`` query with the
+    joins needed to follow them.
+
+    Paths that end at a related object, like ``crop_receipt__market``,
+    are exported as the object's unicode representation. These objects
+    are fetched with one query per related model for every `batch_size`
+    rows.
+
+    :param model:
+        the model class the paths start from
+    :param list field_names:
+        the field paths
+    :param int batch_size:
+        how many rows to read related objects for at a time
+    :raises ProjectionException:
+        if a path does not exist on the model
+    """
+
+    def __init__(self, model, field_names, batch_size=1000):
+        self.model = model
+        self.field_names = list(field_names)
+        self.batch_size = batch_size
+        self.related_models = [self._compile(field_name)
+                               for field_name in self.field_names]
+
+    def _compile(self, field_name):
+        """
+        Validate the path and return the model it ends at when it ends
+        at a related object, otherwise `None`.
+        """
+        opts = self.model._meta
+        names = field_name.split("__")
+        for i, name in enumerate(names):
+            try:
+                field = opts.pk if name == 'pk' else opts.get_field(name)
+            except FieldDoesNotExist:
+                raise ProjectionException(
+                    "%r has no field %r in %r" % (
+                        opts.object_name, name, field_name))
+            if isinstance(field, ManyToManyField):
+                raise ProjectionException(
+                    "%r follows the many to many field %r" % (
+                        field_name, name))
+            if i == len(names) - 1:
+                return field.rel.to if field.rel else None
+            if not field.rel:
+                raise ProjectionException(
+                    "%r is not a relation in %r" % (name, field_name))
+            opts = field.rel.to._meta
+
+    def _format(self, values):
+        """
+        Turn the ``(pk, value, ...)`` tuples into CSV rows.
+        """
+        related_ids = {}
+        for i, related_model in enumerate(self.related_models):
+            if related_model is not None:
+                ids = related_ids.setdefault(related_model, set())
+                ids.update(row[i + 1] for row in values)
+        related_objects = dict(
+            (related_model, related_model._default_manager.in_bulk(
+                [pk for pk in ids if pk is not None]))
+            for related_model, ids in related_ids.items())
+
+        for row in values:
+            data = []
+            for related_model, value in zip(self.related_models, row[1:]):
+                if related_model is not None and value is not None:
+                    value = related_objects[related_model][value]
+                data.append(unicode(value).encode('utf-8'))
+            yield data
+
+    def _values(self, queryset):
+        return queryset.values_list('pk', *self.field_names)
+
+    def rows(self, queryset):
+        """
+        Iterate over the CSV rows for the objects in the queryset, in the
+        queryset's order.
+        """
+        values = self._values(queryset).iterator()
+        while True:
+            batch = list(islice(values, self.batch_size))
+            if not batch:
+                return
+            for row in self._format(batch):
+                yield row
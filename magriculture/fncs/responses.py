@@ -0,0 +1,126 @@
+"""
+A cache of the API responses for the reference data that rarely changes,
+see :class:`magriculture.fncs.api.CachedModelResource`.
+
+Every model has a version in the cache and a response is cached under the
+version of the model it was read from. Saving or deleting an object of
+the model replaces its version, after which the responses cached under
+the old version aren't used again. Responses have an ``ETag`` and
+requests with a matching ``If-None-Match`` get a ``304 Not Modified``.
+
+The cache is the Django cache backend or alias named by the
+``FNCS_RESPONSE_CACHE`` setting, the ``default`` cache unless set. Like
+the identity cache, see :mod:`magriculture.fncs.identities`, it needs to
+be shared by all the processes for a change to be seen everywhere, with a
+cache in every process a change can take up to
+``FNCS_RESPONSE_CACHE_TIMEOUT`` seconds to be seen by the other processes.
+"""
+# Python
+import uuid
+import hashlib
+
+# Django
+from django.conf import settings
+from django.core.cache import get_cache
+from django.http import HttpResponse, HttpResponseNotModified
+
+DEFAULT_BACKEND = 'default'
+DEFAULT_TIMEOUT = 5 * 60
+
+
+class ResponseCache(object):
+    """
+    Caches the successful responses of views by model version and request.
+
+    :param str backend:
+        the Django cache backend or alias to use.
+    :param int timeout:
+        how many seconds to cache a response for.
+    """
+
+    def __init__(self, backend=DEFAULT_BACKEND, timeout=DEFAULT_TIMEOUT):
+        self.cache = get_cache(backend)
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+
+    def _version_key(self, model):
+        return 'fncs:response-version:%s' % (model._meta.db_table,)
+
+    def version(self, model):
+        """
+        :returns: the current version of the model's responses
+        """
+        key = self._version_key(model)
+        version = self.cache.get(key)
+        if version is None:
+            self.cache.add(key, uuid.uuid4().hex, self.timeout)
+            # another process may have added a version first
+            version = self.cache.get(key) or ''
+        return version
+
+    def _key(self, model, request):
+        request_key = hashlib.md5('\n'.join([
+            request.path,
+            '&'.join(sorted(
+                '%s=%s' % item for item in request.GET.iteritems())),
+            request.META.get('HTTP_ACCEPT', ''),
+        ]).encode('utf-8')).hexdigest()
+        return 'fncs:response:%s:%s' % (self.version(model), request_key)
+
+    def respond(self, model, request, view):
+        """
+        :returns: the cached response for the request or, when there is
+                  none, the response of `view` after caching it if it was
+                  successful.
+        """
+        key = self._key(model, request)
+        cached = self.cache.get(key)
+        if cached is None:
+            self.misses += 1
+            response = view()
+            if response.status_code != 200:
+                return response
+            etag = '"%s"' % (hashlib.md5(response.content).hexdigest(),)
+            cached = (response.content, response['Content-Type'], etag)
+            self.cache.set(key, cached, self.timeout)
+            hit = False
+        else:
+            self.hits += 1
+            hit = True
+        content, content_type, etag = cached
+        if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
+
+    def invalidate(self, model):
+        """
+        Forget all the cached responses for the model.
+        """
+        self.cache.delete(self._version_key(model))
+
+    def stats(self):
+        """
+        :returns: the number of cache hits and misses and the hit rate in
+                  this process
+        """
+        requests = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': float(self.hits) / requests if requests else 0.0}
+
+
+response_cache = ResponseCache(
+    getattr(settings, 'FNCS_RESPONSE_CACHE', DEFAULT_BACKEND),
+    getattr(settings, 'FNCS_RESPONSE_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+
+
+def invalidate_responses(sender, **kwargs):
+    """
+    Signal handler for Django, forget the cached responses for a model once
+    one of its objects changed.
+    """
+    response_cache.invalidate(sender)
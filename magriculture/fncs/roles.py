@@ -0,0 +1,155 @@
+"""
+The roles an :class:`magriculture.fncs.models.actors.Actor` plays, loaded
+once per request.
+
+:class:`RolesMiddleware` attaches the logged in actor's :class:`ActorRoles`
+to every request as ``request.roles``. The actor and its role rows are
+only read from the database when ``request.roles`` is first used, with
+one query for the actor and one for all of its roles. After that
+:class:`magriculture.fncs.decorators.SpecificRightsRequired`, the views
+and the actor's ``as_*`` and ``is_*`` methods don't query for roles
+again.
+"""
+# Django
+from django.db import connection
+from django.utils.functional import SimpleLazyObject
+
+# Project
+from magriculture.fncs import errors
+
+#: the names of the roles and the models storing them
+ROLES = (
+    ('agent', 'Agent'),
+    ('farmer', 'Farmer'),
+    ('marketmonitor', 'MarketMonitor'),
+    ('extensionofficer', 'ExtensionOfficer'),
+    ('fba', 'FarmerBusinessAdvisor'),
+)
+
+
+def _role_models():
+    from magriculture.fncs.models import actors
+    return [(role, getattr(actors, model_name))
+            for role, model_name in ROLES]
+
+
+def _is_bare(model):
+    """
+    Whether the only columns of the role's model are its primary key and
+    the actor, in which case the role can be built from the ids alone.
+    """
+    columns = set(field.attname for field in model._meta.fields)
+    return columns == set([model._meta.pk.attname, 'actor_id'])
+
+
+class ActorRoles(object):
+    """
+    The roles of an actor.
+
+    :param actor:
+        the :class:`magriculture.fncs.models.actors.Actor`, `None` for
+        anonymous users.
+    :param dict role_ids:
+        the primary keys of the actor's role objects by role name.
+    """
+
+    def __init__(self, actor, role_ids):
+        self.actor = actor
+        self.role_ids = role_ids
+        self._objects = {}
+
+    @classmethod
+    def load(cls, actor):
+        """
+        Read the ids of all the actor's roles with a single query and
+        cache the roles on the actor, see
+        :meth:`magriculture.fncs.models.actors.Actor.roles`.
+        """
+        qn = connection.ops.quote_name
+        selects = []
+        for role, model in _role_models():
+            opts = model._meta
+            selects.append("SELECT '%s', %s FROM %s WHERE %s = %%s" % (
+                role, qn(opts.pk.column), qn(opts.db_table),
+                qn(opts.get_field('actor').column)))
+        cursor = connection.cursor()
+        cursor.execute(" UNION ALL ".join(selects), [actor.pk] * len(selects))
+        role_ids = {}
+        for role, pk in cursor.fetchall():
+            role_ids.setdefault(role, []).append(pk)
+        roles = cls(actor, role_ids)
+        actor._roles_cache = roles
+        return roles
+
+    @classmethod
+    def for_user(cls, user):
+        """
+        :returns: the roles of the user's actor, without any roles for
+                  anonymous users.
+        """
+        if not user.is_authenticated():
+            return cls(None, {})
+        actor = user.actor
+        # share the actor with user.get_profile()
+        user._profile_cache = actor
+        return actor.roles()
+
+    def has(self, role):
+        """
+        Whether the actor has the named role.
+        """
+        return bool(self.role_ids.get(role))
+
+    def get(self, role):
+        """
+        :returns: the actor's role object for the named role, or `None` if
+                  the actor doesn't have the role.
+        :raises magriculture.fncs.errors.ActorException:
+            if the actor has the role more than once.
+        """
+        pks = self.role_ids.get(role, [])
+        if len(pks) > 1:
+            raise errors.ActorException(
+                'More than one %s for an actor' % (role,))
+        if not pks:
+            return None
+        if role not in self._objects:
+            model = dict(_role_models())[role]
+            if _is_bare(model):
+                obj = model(pk=pks[0], actor=self.actor)
+                obj._state.adding = False
+                obj._state.db = connection.alias
+            else:
+                obj = model._default_manager.get(pk=pks[0])
+                setattr(obj, model._meta.get_field('actor').get_cache_name(),
+                        self.actor)
+            self._objects[role] = obj
+        return self._objects[role]
+
+    def is_agent(self):
+        return self.has('agent')
+
+    def is_extensionofficer(self):
+        return self.has('extensionofficer')
+
+
+def get_roles(request):
+    """
+    :returns: the :class:`ActorRoles` of the request's user, also for
+              requests that didn't pass through :class:`RolesMiddleware`.
+    """
+    if not hasattr(request, 'roles'):
+        request.roles = ActorRoles.for_user(request.user)
+    return request.roles
+
+
+class RolesMiddleware(object):
+    """
+    Attaches the :class:`ActorRoles` of the logged in user to the request
+    as ``request.roles``. Needs to come after
+    :class:`django.contrib.auth.middleware.AuthenticationMiddleware`.
+    """
+
+    def process_request(self, request):
+        request.roles = SimpleLazyObject(
+            lambda: ActorRoles.for_user(request.user))
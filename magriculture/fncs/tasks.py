@@ -2,35 +2,211 @@
 from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 from datetime import datetime, timedelta
-from StringIO import StringIO
+from functools import wraps
 from zipfile import ZipFile, ZIP_DEFLATED
 from django.core.mail import EmailMessage
+from django.db import connection
+from django.db.models import F, Q
+from django.db.transaction import commit_on_success
 import csv
+import os
+import shutil
+import tempfile
+import uuid
 
 # Project
-from magriculture.fncs.models.props import CropReceipt
+from magriculture import sms
+from magriculture.fncs.models.actors import Identity
+from magriculture.fncs.models.jobs import Job, JobChunk
+from magriculture.fncs.models.props import CropReceipt, Message, Transaction
+from magriculture.fncs.projection import Projection
+from magriculture.fncs.utils import bulk_create, filter_by_spec
 
 # Celery
+from celery import chord, group
 from celery.utils.log import get_task_logger
 from celery.decorators import task
 
 logger = get_task_logger(__name__)
 
+# how long to keep the progress of jobs run with fan_out
+JOB_TIMEOUT = timedelta(days=1)
+
+
+def partition(queryset, chunk_size):
+    """
+    Split the primary keys of the queryset into inclusive
+    ``[first_pk, last_pk]`` ranges of `chunk_size` objects each, with a
+    query per range.
+
+    The ranges start and end at the primary keys of the objects in the
+    queryset, so gaps between the keys don't leave empty ranges.
+    """
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    first = list(pks[:1])
+    ranges = []
+    while first:
+        # the last key of this range and the first key of the next one
+        bounds = list(pks.filter(pk__gte=first[0])[
+            chunk_size - 1:chunk_size + 1])
+        if not bounds:
+            bounds = list(pks.filter(pk__gte=first[0]).reverse()[:1])
+        ranges.append([first[0], bounds[0]])
+        first = bounds[1:]
+    return ranges
+
+
+def job_progress(job_id):
+    """
+    :returns: a ``(chunks done, total chunks)`` tuple for a job started by
+              :func:`fan_out`, or `None` if the job is unknown
+    """
+    try:
+        return Job.objects.get(pk=job_id).progress()
+    except Job.DoesNotExist:
+        return None
+
+
+def chunk_task(**options):
+    """
+    Decorator turning a function into the Celery task that handles a
+    single chunk of a job started by :func:`fan_out`. The function is
+    called with the job id, the chunk's first and last primary key and
+    then the job's arguments.
+
+    Every chunk is recorded as a :class:`magriculture.fncs.models.jobs.JobChunk`,
+    so a chunk that is delivered again after it completed, for example
+    because its worker was lost before acknowledging it, is skipped.
+    Completed chunks count towards the job's progress.
+
+    :param options: passed on to the ``task`` decorator
+    """
+    def decorator(func):
+        @wraps(func)
+        def run_chunk(job_id, first_pk, last_pk, *args):
+            chunk = JobChunk.objects.filter(
+                job=job_id, first_pk=first_pk, last_pk=last_pk)
+            if chunk.filter(done=True).exists():
+                logger.info("Skipping chunk %s-%s of job %s, already done" % (
+                    first_pk, last_pk, job_id))
+                return None
+            result = func(job_id, first_pk, last_pk, *args)
+            chunk.update(done=True)
+            return result
+        return task(**options)(run_chunk)
+    return decorator
+
+
+def fan_out(chunk, queryset, chunk_size, args=(), callback=None,
+            callback_args=()):
+    """
+    Partition the queryset into primary key ranges and run the chunk task
+    for all of them in parallel, as a Celery group.
+
+    If a `callback` task is given the chunks run as a chord instead and
+    the callback is called with the list of chunk results, the job id,
+    the ranges and then `callback_args` once all the chunks are done.
+
+    :param chunk: a task decorated with :func:`chunk_task`
+    :param int chunk_size: how many objects each chunk covers
+    :param tuple args: the arguments for every chunk
+    :returns: the job id, see :func:`job_progress`
+    """
+    Job.objects.filter(created_at__lt=datetime.now() - JOB_TIMEOUT).delete()
+    job_id = uuid.uuid4().hex
+    ranges = partition(queryset, chunk_size)
+    with commit_on_success():
+        job = Job.objects.create(pk=job_id)
+        bulk_create(JobChunk, [
+            JobChunk(job=job, first_pk=first_pk, last_pk=last_pk)
+            for first_pk, last_pk in ranges])
+    header = [chunk.s(job_id, first_pk, last_pk, *args)
+              for first_pk, last_pk in ranges]
+    if callback is None:
+        if header:
+            group(header).apply_async()
+    elif header:
+        chord(header)(callback.s(job_id, ranges, *callback_args))
+    else:
+        # a chord without chunks never calls its callback
+        callback.delay([], job_id, ranges, *callback_args)
+    return job_id
+
+
+def stale_crop_receipts(days_ago):
+    """
+    The unreconciled crop receipts created before `days_ago` with
+    inventory left.
+    """
+    return CropReceipt.objects.filter(
+        reconciled=False, created_at__lt=days_ago,
+        amount__gt=F('sold_amount'))
+
+
 @task
 def query_crop_receipt_for_old_crops(days):
     """
     This will form the celery worker that will be run to query
-    the crop reciept for old stock
+    the crop reciept for old stock.
+
+    The receipts with inventory left are reconciled by
+    :func:`reconcile_crop_receipts` chunks of
+    `settings.RECONCILE_CHUNK_SIZE` receipts each.
+
+    :returns: the job id, see :func:`job_progress`
     """
     logger.info("Performing query for old Receipts")
     days_ago = datetime.today() - timedelta(days=days)
-    crop_receipts = (CropReceipt.objects.
-                    filter(reconciled=False).
-                    filter(created_at__lt=days_ago).
-                    all())
+    return fan_out(reconcile_crop_receipts, stale_crop_receipts(days_ago),
+                   settings.RECONCILE_CHUNK_SIZE, args=(days_ago,))
+
 
-    for crop_receipt in crop_receipts:
-        check_inventory_left(crop_receipt)
+def unsold_inventory_message(remaining, units, crop):
+    return (_("Sorry but %(remaining)s %(units)s of %(crop)s have not been sold") %
+            {'remaining': remaining, 'units': units, 'crop': crop})
+
+
+@chunk_task(ignore_result=True)
+def reconcile_crop_receipts(job_id, first_pk, last_pk, days_ago):
+    """
+    Tell the farmers how much of the crops of the stale receipts in the
+    primary key range have not been sold, mark the receipts as reconciled
+    and queue the messages for delivery, with a fixed number of queries.
+    """
+    qn = connection.ops.quote_name
+    table = qn(CropReceipt._meta.db_table)
+    receipts = list(stale_crop_receipts(days_ago).filter(
+        pk__range=(first_pk, last_pk)).extra(select={
+            'remaining': '%s.%s - %s.%s' % (table, qn('amount'),
+                                             table, qn('sold_amount'))
+        }).values_list('pk', 'remaining', 'farmer__actor', 'agent__actor',
+                       'crop__name', 'unit__name').order_by())
+    if not receipts:
+        return
+
+    msisdns = Identity.latest_msisdns([receipt[2] for receipt in receipts])
+    # bulk_create doesn't set the primary keys, the batch finds the
+    # messages of this chunk and none of the chunks running alongside it
+    batch = uuid.uuid4().hex
+    messages = []
+    for _pk, remaining, farmer_actor_id, agent_actor_id, crop, units \
+            in receipts:
+        to_addr = msisdns.get(farmer_actor_id, '')
+        messages.append(Message(
+            sender_id=agent_actor_id, recipient_id=farmer_actor_id,
+            content=unsold_inventory_message(remaining, units, crop),
+            group=None, to_addr=to_addr, batch=batch,
+            status=Message.PENDING if to_addr else Message.NO_ADDRESS))
+
+    with commit_on_success():
+        CropReceipt.objects.filter(
+            pk__in=[receipt[0] for receipt in receipts]).update(
+            reconciled=True)
+        bulk_create(Message, messages)
+        message_ids = list(Message.objects.filter(
+            batch=batch, status=Message.PENDING).values_list(
+            'pk', flat=True))
+    Message.deliver(message_ids)
 
 
 def check_inventory_left(crop_receipt):
@@ -46,61 +222,194 @@ def check_inventory_left(crop_receipt):
     if remaining > 0:
         recipient = crop_receipt.farmer.actor
         crop = crop_receipt.crop.name
-        message = (_("Sorry but %(remaining)s %(units)s of %(crop)s have not been sold") %
-                   {'remaining': remaining, 'units': crop_receipt.unit.name, 'crop': crop})
+        message = unsold_inventory_message(
+            remaining, crop_receipt.unit.name, crop)
         crop_receipt.agent.actor.send_message(recipient, message, None)
         crop_receipt.reconciled = True
-        crop_receipt.save()
+        CropReceipt.objects.filter(pk=crop_receipt.pk).update(
+            reconciled=True)
 
 
-def email_export(recipient, io):
-    zipio = StringIO()
-    zf = ZipFile(zipio, "a", ZIP_DEFLATED)
-    zf.writestr("transactions-export.csv", io.getvalue())
-    zf.close()
-
+def email_export(recipient, zip_path):
     email = EmailMessage(
         'LimaLinks Transaction export snapshot',
         'Please find the transactions attached.',
         settings.DEFAULT_FROM_EMAIL, [recipient])
-    email.attach('transactions-export.zip', zipio.getvalue(), 'application/zip')
+    email.attach_file(zip_path, 'application/zip')
     email.send()
 
 
+def _export_part_path(job_id, first_pk):
+    return os.path.join(settings.EXPORT_DIR or tempfile.gettempdir(),
+                        "transactions-export-%s-%s.csv" % (job_id, first_pk))
+
+
 @task(ignore_result=True)
-def export_transactions(field_names, labels, queryset, user):
+def export_transactions(field_names, labels, filter_spec, user,
+                        chunk_size=None):
     """
     Export the transactions in the system including related users info.
 
+    The transactions are written to CSV files by
+    :func:`export_transaction_chunk` chunks of `chunk_size` in parallel,
+    then :func:`finish_transaction_export` joins them into the zip file
+    that is emailed, so the export doesn't need to fit in memory.
+
     :param list field_names:
         model field names
     :param list labels:
         headers for the csv
-    :param object queryset:
-        queryset from user select
+    :param dict filter_spec:
+        the transactions to export, see
+        :func:`magriculture.fncs.utils.filter_by_spec`
     :param User user:
         logged in admin user
+    :param int chunk_size:
+        how many transactions each chunk covers, defaults to
+        `settings.EXPORT_CHUNK_SIZE`
+    :returns: the job id, see :func:`job_progress`
     """
     logger.info("Exporting transactions")
-    recipient = user.email
+    # fail before starting the chunks if the fields don't exist
+    Projection(Transaction, field_names)
+    queryset = filter_by_spec(Transaction.objects.all(), filter_spec)
+    return fan_out(
+        export_transaction_chunk, queryset,
+        chunk_size or settings.EXPORT_CHUNK_SIZE,
+        args=(field_names, filter_spec),
+        callback=finish_transaction_export,
+        callback_args=(labels, user.email))
+
+
+@chunk_task()
+def export_transaction_chunk(job_id, first_pk, last_pk, field_names,
+                             filter_spec):
+    """
+    Write the CSV rows of the transactions in the primary key range to a
+    file in `settings.EXPORT_DIR`.
+    """
+    queryset = filter_by_spec(Transaction.objects.all(), filter_spec).filter(
+        pk__range=(first_pk, last_pk)).order_by('pk')
+    path = _export_part_path(job_id, first_pk)
+    with open(path, "wb") as fp:
+        csv.writer(fp).writerows(
+            Projection(Transaction, field_names).rows(queryset))
+    return path
+
+
+@task(ignore_result=True)
+def finish_transaction_export(results, job_id, ranges, labels, recipient):
+    """
+    Join the CSV files written by the chunks of an export in order and
+    email them as a zip file.
+    """
     labels = [l.encode('utf-8') for l in labels]
+    part_paths = [_export_part_path(job_id, first_pk)
+                  for first_pk, _last_pk in ranges]
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        csv_path = os.path.join(tmp_dir, "transactions-export.csv")
+        with open(csv_path, "wb") as fp:
+            csv.writer(fp).writerow(labels)
+            for part_path in part_paths:
+                with open(part_path, "rb") as part:
+                    shutil.copyfileobj(part, fp)
+
+        zip_path = os.path.join(tmp_dir, "transactions-export.zip")
+        zf = ZipFile(zip_path, "w", ZIP_DEFLATED)
+        zf.write(csv_path, "transactions-export.csv")
+        zf.close()
+        email_export(recipient, zip_path)
+    finally:
+        shutil.rmtree(tmp_dir)
+        for part_path in part_paths:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+
+@task(ignore_result=True, max_retries=settings.SMS_MAX_RETRIES)
+def deliver_messages(message_ids):
+    """
+    Deliver a batch of pending messages as SMSes and record their
+    delivery status.
+
+    The pending messages of the batch are claimed by moving them to
+    sending under a claim of this task before they are sent, so a message
+    that was queued more than once is only sent by the task that claimed
+    it. Claimed messages that aren't sent, whether their delivery failed
+    or sending raised, are pending again. Failed messages are retried with
+    an exponential backoff, starting at `settings.SMS_RETRY_DELAY`
+    seconds, and marked as failed once `settings.SMS_MAX_RETRIES` is
+    exceeded.
+
+    :param list message_ids:
+        primary keys of :class:`magriculture.fncs.models.props.Message`
+    """
+    claim = uuid.uuid4().hex
+    Message.objects.filter(pk__in=message_ids, status=Message.PENDING).update(
+        status=Message.SENDING, claim=claim, claimed_at=datetime.now())
+    messages = list(Message.objects.filter(
+        claim=claim, status=Message.SENDING))
+    sent, failed = [], []
+    last_error = None
+    try:
+        results = sms.default_sender.send_bulk(
+            [(message.to_addr, message.content) for message in messages])
+        for message, result in zip(messages, results):
+            if isinstance(result, sms.SmsSendingError):
+                logger.warning("Failed to deliver message %s: %s" % (
+                    message.pk, result))
+                last_error = result
+                failed.append(message.pk)
+            else:
+                sent.append(message.pk)
+    finally:
+        Message.objects.filter(pk__in=sent).update(
+            attempts=F('attempts') + 1, status=Message.SENT,
+            sent_at=datetime.now())
+        Message.objects.filter(claim=claim, status=Message.SENDING).update(
+            attempts=F('attempts') + 1, status=Message.PENDING)
 
-    io = StringIO()
-    writer = csv.writer(io)
-    writer.writerow(labels)
-
-    for obj in queryset:
-        data = []
-        for field_name in field_names:
-            field_obj = obj
-            for name in field_name.split("__"):
-                if hasattr(field_obj, name):
-                    field_obj = getattr(field_obj, name)
-                else:
-                    field_obj = "ERROR!"
-                    break
-
-            data.append(field_obj)
-        data = [unicode(entry).encode('utf-8') for entry in data]
-        writer.writerow(data)
-    email_export(recipient, io)
+    if not failed:
+        return
+
+    retries = deliver_messages.request.retries
+    if retries >= deliver_messages.max_retries:
+        Message.objects.filter(pk__in=failed).update(status=Message.FAILED)
+        return
+    deliver_messages.retry(
+        args=[failed], exc=last_error,
+        countdown=settings.SMS_RETRY_DELAY * (2 ** retries))
+
+
+@task(ignore_result=True)
+def deliver_pending_messages(minutes=5):
+    """
+    Queue delivery for the messages that should have been delivered by
+    now:
+
+    * messages that have been pending for longer than the given number of
+      minutes without a delivery attempt, for example because the broker
+      was unavailable when they were stored.
+    * failed messages that are still pending twice their retry delay
+      after their last attempt, for example because sending raised.
+    * messages that have been sending for longer than
+      `settings.SMS_SENDING_TIMEOUT` seconds, whose worker was lost. These
+      may have been sent before the worker was lost and are sent again.
+    """
+    now = datetime.now()
+    lost = list(Message.objects.filter(
+        status=Message.SENDING, claimed_at__lt=now - timedelta(
+            seconds=settings.SMS_SENDING_TIMEOUT)).values_list(
+        'pk', flat=True))
+    Message.objects.filter(pk__in=lost, status=Message.SENDING).update(
+        status=Message.PENDING)
+    due = Q(pk__in=lost)
+    due |= Q(attempts=0, created_at__lt=now - timedelta(minutes=minutes))
+    for attempts in range(1, settings.SMS_MAX_RETRIES + 2):
+        due |= Q(attempts=attempts, claimed_at__lt=now - timedelta(
+            seconds=settings.SMS_RETRY_DELAY * (2 ** attempts)))
+    message_ids = list(Message.objects.filter(
+        due, status=Message.PENDING).values_list('pk', flat=True))
+    logger.info("Queueing %s pending messages" % (len(message_ids),))
+    Message.deliver(message_ids)
@@ -1,6 +1,7 @@
 from django import template
 from django.template.defaultfilters import floatformat
-from magriculture.fncs.models.props import Transaction, Offer
+from magriculture.fncs.models.props import PriceSummary
+from magriculture.fncs.pricestats import price_stats
 
 register = template.Library()
 
@@ -27,45 +28,45 @@ SPARKLINE_TEMPLATE = ''.join([
     '&chf=bg,s,%s' % SPARKLINE_BACKGROUND
 ])
 
-def mean(floats):
-    if len(floats) == 0:
-        return float('nan')
-    return sum(floats) / len(floats)
+def stats_for(context, source, market, crop, unit):
+    """
+    :returns: the :class:`magriculture.fncs.pricestats.PriceStats` from the
+              ``price_stats`` the view calculated for the page, or from
+              the database if the view didn't.
+    """
+    key = (source, market.pk, crop.pk, unit.pk)
+    stats = context.get('price_stats') or {}
+    if key not in stats:
+        stats = price_stats([key])
+    return stats[key]
 
-def deviation(value, average):
-    return (float(value)/float(average) * 100)
+@register.simple_tag(takes_context=True)
+def average_crop_price(context, market, crop, unit):
+    return floatformat(stats_for(
+        context, PriceSummary.TRANSACTION, market, crop, unit).mean, 2)
 
-@register.simple_tag
-def average_crop_price(market, crop, unit):
-    prices = list(Transaction.price_history_for(market, crop, unit)[:10])
-    return floatformat(mean(prices), 2)
-    
-@register.simple_tag
-def average_opening_price(market, crop, unit):
-    prices = list(Offer.average_price_history_for(market, crop, unit)[:10])
-    return floatformat(mean(prices), 2)
+@register.simple_tag(takes_context=True)
+def average_opening_price(context, market, crop, unit):
+    return floatformat(stats_for(
+        context, PriceSummary.OFFER, market, crop, unit).mean, 2)
 
-@register.simple_tag
-def price_sparkline(market, crop, unit):
-    prices = list(Transaction.price_history_for(market, crop, unit)[:10])
-    if prices:
-        last_price = prices[-1]
-        average = mean(prices)
-        values = [deviation(price, average) for price in prices]
-        return sparkline(values, "%s ZMK" % int(last_price))
+def stats_sparkline(stats, empty_label):
+    if stats.prices:
+        return sparkline(stats.deviations, "%s ZMK" % int(stats.last_price))
     else:
-        return sparkline([], "No transactions yet")
+        return sparkline([], empty_label)
 
-@register.simple_tag
-def opening_price_sparkline(market, crop, unit):
-    prices = list(Offer.average_price_history_for(market, crop, unit)[:10])
-    if prices:
-        last_price = prices[-1]
-        average = mean(prices)
-        values = [deviation(price, average) for price in prices]
-        return sparkline(values, "%s ZMK" % int(last_price))
-    else:
-        return sparkline([], "No opening prices yet")
+@register.simple_tag(takes_context=True)
+def price_sparkline(context, market, crop, unit):
+    return stats_sparkline(stats_for(
+        context, PriceSummary.TRANSACTION, market, crop, unit),
+        "No transactions yet")
+
+@register.simple_tag(takes_context=True)
+def opening_price_sparkline(context, market, crop, unit):
+    return stats_sparkline(stats_for(
+        context, PriceSummary.OFFER, market, crop, unit),
+        "No opening prices yet")
 
 
 @register.filter
@@ -0,0 +1,104 @@
+"""
+A local stand-in for the Vumi Go HTTP API's messages.json endpoint.
+"""
+# Python
+import json
+import time
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+
+class FakeVumiGoServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections += 1
+        ThreadingMixIn.process_request(self, request, client_address)
+
+
+class FakeVumiGoHandler(BaseHTTPRequestHandler):
+    # keep connections alive between requests
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_PUT(self):
+        server = self.server
+        length = int(self.headers.getheader('content-length', 0))
+        payload = json.loads(self.rfile.read(length))
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            server.requests.append((self.path, payload))
+            fail = server.failures > 0
+            if fail:
+                server.failures -= 1
+        if fail:
+            self.respond(500, "text/plain", "Internal Server Error")
+            return
+        reply = dict(payload, message_id=str(len(server.requests)))
+        self.respond(200, "application/json; charset=utf-8",
+                     json.dumps(reply))
+
+    def respond(self, code, content_type, body):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeVumiGo(object):
+    """
+    Serve the fake messages.json endpoint from a background thread::
+
+        fake = FakeVumiGo()
+        fake.start()
+        sender = VumiGoSender(fake.url, 'account', 'conversation', 'token')
+        ...
+        fake.stop()
+
+    :param int failures:
+        how many requests should receive a 500 response before
+        requests start succeeding.
+    :param float latency:
+        seconds to wait before responding, to mimic the network.
+    """
+
+    def __init__(self, failures=0, latency=0):
+        self.server = FakeVumiGoServer(('127.0.0.1', 0), FakeVumiGoHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.failures = failures
+        self.server.connections = 0
+        self.server.latency = latency
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%s/api/v1/go/http_api" % (
+            self.server.server_port,)
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    @property
+    def connections(self):
+        return self.server.connections
+
+    def set_failures(self, failures):
+        with self.server.lock:
+            self.server.failures = failures
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -2,15 +2,18 @@
 from datetime import datetime, timedelta
 
 # Django
-from django.test import TestCase
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
 
 # Project
 from magriculture.fncs.tests import utils
-from magriculture.fncs.models.actors import (Actor, Farmer, FarmerGroup,
-                                             Identity)
-from magriculture.fncs.models.props import Message, GroupMessage, Note, Crop
+from magriculture.fncs.models.actors import (
+    Actor, Agent, ExtensionOfficer, Farmer, FarmerBusinessAdvisor,
+    FarmerGroup, GroupMembership, Identity, MarketMonitor)
+from magriculture.fncs.models.props import (Message, GroupMessage, Note, Crop,
+                                            CropReceipt, Transaction)
 from magriculture.fncs.errors import ActorException
 from magriculture.fncs import errors
 from nose.tools import raises
@@ -246,6 +249,129 @@ class TestSendMessage(TestCase):
         self.assertEquals(sorted(message_list), sorted(farmers_list))
 
 
+class FarmerGroupMessageTestCase(TestCase):
+
+    def setUp(self):
+        self.agent = utils.create_agent()
+        self.crop = utils.create_crop("potatoes")
+        self.farmers = [utils.create_farmer(msisdn=str(27761234570 + i))
+                        for i in range(5)]
+        for farmer in self.farmers:
+            farmer.crops.add(self.crop)
+            self.agent.farmers.add(farmer)
+        self.group = FarmerGroup.objects.create(
+            name="potato farmers", actor=self.agent.actor, crop=self.crop)
+        self.group.district.add(self.farmers[0].districts.all()[0])
+
+    def test_member_actor_ids(self):
+        chunks = list(self.group.member_actor_ids(chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual(sorted(sum(chunks, [])),
+                         sorted(farmer.actor.pk for farmer in self.farmers))
+
+    def test_latest_msisdns(self):
+        actor = self.farmers[0].actor
+        actor.add_identity('27769999999')
+        msisdns = Identity.latest_msisdns(
+            [farmer.actor.pk for farmer in self.farmers[:2]])
+        self.assertEqual(msisdns, {
+            actor.pk: '27769999999',
+            self.farmers[1].actor.pk: '27761234571',
+        })
+
+    def test_send_message_to_farmergroups(self):
+        self.farmers[0].actor.add_identity('27769999999')
+        self.farmers[1].actor.identity_set.all().delete()
+        with self.settings(GROUP_MESSAGE_CHUNK_SIZE=2):
+            groupmessage = self.agent.actor.send_message_to_farmergroups(
+                self.group, 'hello')
+
+        messages = Message.objects.filter(group=groupmessage)
+        self.assertEqual(sorted(messages.values_list('recipient', 'to_addr',
+                                                     'status', 'content')),
+                         sorted([
+                             (self.farmers[0].actor.pk, '27769999999',
+                              Message.SENT, 'hello'),
+                             (self.farmers[1].actor.pk, '',
+                              Message.NO_ADDRESS, 'hello'),
+                             (self.farmers[2].actor.pk, '27761234572',
+                              Message.SENT, 'hello'),
+                             (self.farmers[3].actor.pk, '27761234573',
+                              Message.SENT, 'hello'),
+                             (self.farmers[4].actor.pk, '27761234574',
+                              Message.SENT, 'hello'),
+                         ]))
+        self.assertEqual(set(messages.values_list('sender', flat=True)),
+                         set([self.agent.actor.pk]))
+
+
+class GroupMembershipTestCase(TestCase):
+
+    def setUp(self):
+        self.agent = utils.create_agent()
+        self.farmer = utils.create_farmer()
+        self.district = self.farmer.districts.all()[0]
+        self.crop = utils.create_crop("potatoes")
+
+    def get_memberships(self):
+        return sorted(GroupMembership.objects.filter(
+            farmer=self.farmer).values_list('crop', 'district', 'agent'))
+
+    def test_memberships_follow_farmer_changes(self):
+        self.assertEqual(self.get_memberships(), [])
+        self.farmer.crops.add(self.crop)
+        self.assertEqual(self.get_memberships(), [
+            (self.crop.pk, self.district.pk, None)])
+
+        self.agent.farmers.add(self.farmer)
+        self.assertEqual(self.get_memberships(), [
+            (self.crop.pk, self.district.pk, None),
+            (self.crop.pk, self.district.pk, self.agent.pk)])
+
+        other_district = utils.create_district("other", self.district.province)
+        other_district.farmer_district.add(self.farmer)
+        self.assertEqual(len(self.get_memberships()), 4)
+
+        self.farmer.districts.remove(self.district)
+        self.assertEqual(self.get_memberships(), [
+            (self.crop.pk, other_district.pk, None),
+            (self.crop.pk, other_district.pk, self.agent.pk)])
+
+        self.agent.farmers.clear()
+        self.assertEqual(self.get_memberships(), [
+            (self.crop.pk, other_district.pk, None)])
+
+        self.crop.farmer_crop.clear()
+        self.assertEqual(self.get_memberships(), [])
+
+    def test_rebuild(self):
+        self.farmer.crops.add(self.crop)
+        GroupMembership.objects.all().delete()
+        self.assertEqual(GroupMembership.rebuild(), 1)
+        self.assertEqual(self.get_memberships(), [
+            (self.crop.pk, self.district.pk, None)])
+
+    def test_members(self):
+        self.farmer.crops.add(self.crop)
+        other_farmer = utils.create_farmer(msisdn='27761234570')
+        other_farmer.crops.add(self.crop)
+        self.agent.farmers.add(self.farmer)
+
+        group = FarmerGroup.objects.create(
+            name="potato farmers", actor=self.agent.actor, crop=self.crop)
+        group.district.add(self.district)
+        self.assertEqual(list(group.members()), [self.farmer])
+        self.assertEqual(self.district.get_farmer_count(self.agent,
+                                                        self.crop), 1)
+
+        officer = utils.create_extension_officer()
+        group.actor = officer.actor
+        group.save()
+        group = FarmerGroup.objects.get(pk=group.pk)
+        self.assertEqual(sorted(farmer.pk for farmer in group.members()),
+                         sorted([self.farmer.pk, other_farmer.pk]))
+
+
 class TestCreateFarmerWithFixtureData(TestCase):
     """
     Test Send Message to Farmer Groups
@@ -341,6 +467,87 @@ class AgentTestCase(TestCase):
         self.assertTrue(farmer.is_growing_crop(crop))
         self.assertIn(transaction, agent.sales_for(farmer))
 
+    def test_agent_sale_updates_sold_amount(self):
+        farmer = utils.create_farmer()
+        market = utils.create_market("market", farmer.districts.all()[0])
+        agent = utils.create_agent()
+        crop = utils.create_crop("potatoes")
+        unit = utils.create_crop_unit("boxes")
+
+        receipt = agent.take_in_crop(market, farmer, 10, unit, crop)
+        # a second, stale copy of the same receipt
+        stale_receipt = CropReceipt.objects.get(pk=receipt.pk)
+        agent.register_sale(receipt, 6, 20)
+        self.assertEquals(receipt.sold_amount, 6)
+        self.assertEquals(receipt.remaining_inventory(), 4)
+
+        # the stale copy can't be used to oversell
+        self.assertRaises(errors.CropReceiptException,
+                          agent.register_sale, stale_receipt, 6, 20)
+        self.assertEquals(Transaction.objects.count(), 1)
+
+        transaction = agent.register_sale(stale_receipt, 4, 20)
+        receipt = CropReceipt.objects.get(pk=receipt.pk)
+        self.assertEquals(receipt.sold_amount, 10)
+        self.assertTrue(receipt.reconciled)
+
+        transaction.delete()
+        receipt = CropReceipt.objects.get(pk=receipt.pk)
+        self.assertEquals(receipt.remaining_inventory(), 4)
+        self.assertEquals(CropReceipt.mismatched_sold_amounts(), [])
+
+    def test_agent_sale_reconciles_receipt(self):
+        farmer = utils.create_farmer()
+        market = utils.create_market("market", farmer.districts.all()[0])
+        agent = utils.create_agent()
+        crop = utils.create_crop("potatoes")
+        unit = utils.create_crop_unit("boxes")
+
+        receipt = agent.take_in_crop(market, farmer, 10, unit, crop)
+        # changed after the receipt was read
+        CropReceipt.objects.filter(pk=receipt.pk).update(quality=1)
+        agent.register_sale(receipt, 10, 20)
+        self.assertTrue(receipt.reconciled)
+        receipt = CropReceipt.objects.get(pk=receipt.pk)
+        self.assertTrue(receipt.reconciled)
+        self.assertEquals(receipt.quality, 1)
+        self.assertEquals(receipt.sold_amount, 10)
+
+    def test_transactions_update_sold_amount(self):
+        farmer = utils.create_farmer()
+        market = utils.create_market("market", farmer.districts.all()[0])
+        agent = utils.create_agent()
+        crop = utils.create_crop("potatoes")
+        unit = utils.create_crop_unit("boxes")
+        receipt = agent.take_in_crop(market, farmer, 10, unit, crop)
+        other_receipt = agent.take_in_crop(market, farmer, 10, unit, crop)
+
+        def sold_amounts():
+            return [CropReceipt.objects.get(pk=r.pk).sold_amount
+                    for r in [receipt, other_receipt]]
+
+        # as created in the admin or through the API
+        transaction = Transaction.objects.create(
+            crop_receipt=receipt, amount=3, price=20,
+            created_at=datetime.now())
+        self.assertEquals(sold_amounts(), [3, 0])
+        transaction = Transaction.objects.get(pk=transaction.pk)
+        transaction.amount = 5
+        transaction.save()
+        self.assertEquals(sold_amounts(), [5, 0])
+        transaction.crop_receipt = other_receipt
+        transaction.save()
+        self.assertEquals(sold_amounts(), [0, 5])
+        Transaction.objects.only('pk').get(pk=transaction.pk).save()
+        self.assertEquals(sold_amounts(), [0, 5])
+        transaction.delete()
+        self.assertEquals(sold_amounts(), [0, 0])
+
+        agent.register_sale(receipt, 0.1, 20)
+        agent.register_sale(receipt, 0.2, 20)
+        CropReceipt.objects.filter(pk=receipt.pk).update(sold_amount=0.3)
+        self.assertEquals(CropReceipt.mismatched_sold_amounts(), [])
+
     def test_actor_as_agent(self):
         agent = utils.create_agent()
         actor = agent.actor
@@ -383,6 +590,33 @@ class AgentTestCase(TestCase):
         self.assertIn(note, agent.notes_for(farmer))
 
 
+class AgentSaleTransactionTestCase(TransactionTestCase):
+
+    def test_sale_messages_queued_after_commit(self):
+        farmer = utils.create_farmer()
+        market = utils.create_market("market", farmer.districts.all()[0])
+        agent = utils.create_agent()
+        receipt = agent.take_in_crop(market, farmer, 10,
+                                     utils.create_crop_unit("boxes"),
+                                     utils.create_crop("potatoes"))
+        delivered = []
+
+        def deliver(message_ids):
+            # outside of the sale's transaction
+            self.assertFalse(transaction.is_managed())
+            delivered.extend(message_ids)
+
+        default_deliver = Message.__dict__['deliver']
+        Message.deliver = staticmethod(deliver)
+        try:
+            agent.register_sale(receipt, 10, 20)
+        finally:
+            Message.deliver = default_deliver
+        self.assertEqual(sorted(delivered), sorted(Message.objects.filter(
+            recipient=farmer.actor).values_list('pk', flat=True)))
+        self.assertEqual(len(delivered), 2)
+
+
 class MarketMonitorTestCase(TestCase):
 
     def test_market_monitor_registration(self):
@@ -563,3 +797,57 @@ class IdentityTestCase(ActorTestCase):
         self.assertEquals(Actor.find_with_pin('1234', '1234'), farmer.actor)
         self.assertRaises(ActorException, Actor.find_with_pin, '1234',
                           'bad-pin')
+
+
+class ActorRolesTestCase(TestCase):
+
+    def setUp(self):
+        self.actor = utils.create_generic_user().get_profile()
+
+    def assertRole(self, accessor, model, **kwargs):
+        with self.assertNumQueries(1):
+            self.assertEqual(accessor(), None)
+        role = model.objects.create(actor=self.actor, **kwargs)
+        with self.assertNumQueries(1):
+            self.assertEqual(accessor(), role)
+        model.objects.create(actor=self.actor, **kwargs)
+        with self.assertNumQueries(1):
+            self.assertRaises(ActorException, accessor)
+
+    def test_as_agent(self):
+        with self.assertNumQueries(1):
+            self.assertRaises(ActorException, self.actor.as_agent)
+        agent = Agent.objects.create(actor=self.actor)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.actor.as_agent(), agent)
+        Agent.objects.create(actor=self.actor)
+        with self.assertNumQueries(1):
+            self.assertRaises(ActorException, self.actor.as_agent)
+
+    def test_as_farmer(self):
+        self.assertRole(self.actor.as_farmer, Farmer)
+
+    def test_as_marketmonitor(self):
+        self.assertRole(self.actor.as_marketmonitor, MarketMonitor)
+
+    def test_as_extensionofficer(self):
+        self.assertRole(self.actor.as_extensionofficer, ExtensionOfficer)
+
+    def test_as_fba(self):
+        self.assertRole(self.actor.as_fba, FarmerBusinessAdvisor)
+
+    def test_roles(self):
+        agent = Agent.objects.create(actor=self.actor)
+        officer = ExtensionOfficer.objects.create(actor=self.actor)
+        with self.assertNumQueries(1):
+            roles = self.actor.roles()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.actor.as_agent(), agent)
+            self.assertEqual(self.actor.as_extensionofficer(), officer)
+            self.assertEqual(self.actor.as_marketmonitor(), None)
+            self.assertEqual(self.actor.as_fba(), None)
+            self.assertTrue(self.actor.is_agent())
+            self.assertEqual(roles.role_ids, {
+                'agent': [agent.pk],
+                'extensionofficer': [officer.pk],
+            })
@@ -1,10 +1,19 @@
 """ Test for magriculture.fncs.admin. """
 
+import csv
+from StringIO import StringIO
+from zipfile import ZipFile
+
+from django.contrib import admin
 from django.contrib.auth.models import User
+from django.core import mail
 from django.core.urlresolvers import reverse
 from django.test import TestCase
 from django.test.client import Client
 
+from magriculture.fncs.actions import ExportFarmersAsCSV
+from magriculture.fncs.models.actors import Farmer
+from magriculture.fncs.models.props import Transaction
 from magriculture.fncs.tests import utils
 
 
@@ -122,3 +131,70 @@ class FarmerAdminTestCase(TestCase):
             "2,4,name surname,27731234568,1,Chingola,3,,,0",
             "1,3,name surname,27731234567,1,Kitwe,2,,,0",
         ])
+
+    def test_custom_farmer_export_query_count(self):
+        farmers = self.create_farmers()
+        self.add_crop_receipts(farmers[0], [utils.create_crop("beans")])
+        self.add_markets(farmers[1], ['Chingola', 'Ndola'])
+        self.add_msisdns(farmers[2], ['+1234'])
+        export = ExportFarmersAsCSV()
+        # the farmer ids and then farmers, identities, markets and crops
+        for farmer_count in [1, 3]:
+            queryset = Farmer.objects.filter(
+                pk__in=[f.pk for f in farmers[:farmer_count]])
+            with self.assertNumQueries(5):
+                rows = list(export._csv_rows(queryset))
+            self.assertEqual(len(rows), farmer_count + 1)
+        # the same again for every chunk
+        export.chunk_size = 2
+        with self.assertNumQueries(9):
+            rows = list(export._csv_rows(Farmer.objects.all()))
+        self.assertEqual(len(rows), 4)
+
+
+class TransactionAdminTestCase(TestCase):
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com',
+                                      'password')
+        self.client = Client()
+        self.client.login(username='admin', password='password')
+        receipt = utils.create_crop_receipt(amount=150)
+        self.transactions = [utils.create_transaction(receipt)
+                             for i in range(3)]
+
+    def export_task(self, transactions, query_string='', **extra):
+        action = {
+            'action': 'farmer_export_task',
+            '_selected_action': [unicode(t.pk) for t in transactions],
+        }
+        action.update(extra)
+        self.client.post(
+            reverse('admin:fncs_transaction_changelist') + query_string,
+            action)
+        [email] = mail.outbox
+        [(_, content, _)] = email.attachments
+        zipfile = ZipFile(StringIO(content), 'r')
+        fp = zipfile.open('transactions-export.csv', 'r')
+        return [row['TransactionID'] for row in csv.DictReader(fp)]
+
+    def test_export_selected(self):
+        first, second, third = self.transactions
+        self.assertEqual(self.export_task([first, third]),
+                         [str(first.pk), str(third.pk)])
+
+    def test_export_select_across(self):
+        self.assertEqual(
+            self.export_task(self.transactions[:1], select_across='1'),
+            [str(t.pk) for t in self.transactions])
+
+    def test_export_select_across_filtered_page(self):
+        first, second, third = self.transactions
+        transaction_admin = admin.site._registry[Transaction]
+        transaction_admin.list_per_page = 1
+        try:
+            exported = self.export_task(
+                [third], select_across='1',
+                query_string='?p=1&id__in=%s,%s' % (first.pk, third.pk))
+        finally:
+            del transaction_admin.list_per_page
+        self.assertEqual(exported, [str(first.pk), str(third.pk)])
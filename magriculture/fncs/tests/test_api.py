@@ -1,21 +1,25 @@
 """Tests for magriculture.fncs.api."""
 # Python
 import json
+from datetime import datetime
 
 # Django
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test.client import Client
 
 # Project
 from magriculture.fncs.tests import utils
-from magriculture.fncs.models.props import Transaction
+from magriculture.fncs.models.props import Crop, Transaction
 from magriculture.fncs.models.actors import Actor, Farmer
 from magriculture.fncs.models.geo import Market
+from magriculture.fncs.urls import api_resources
+from magriculture.fncs.utils import bulk_create
 
 # Third Party
-from tastypie.test import ResourceTestCase
+from tastypie.test import ResourceTestCase, TestApiClient
 
 
 class ApiTestCase(TestCase):
@@ -66,6 +70,65 @@ class ApiTestCase(TestCase):
             [market.pk, market.name] for market in reversed_markets[:2]
             ])
 
+    def test_get_price_history_summary(self):
+        crop, markets = self.create_highest_markets(prices=[50, 100])
+        url = reverse('fncs:api_transaction_price_history',
+                      kwargs={'resource_name': 'transaction',
+                              'api_name': 'v1'})
+        params = {'market': markets[1].pk, 'crop': crop.pk}
+        with self.assertNumQueries(1):
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        history = json.loads(response.content)["objects"]
+        # the same document as the price summary
+        self.assertEqual(history, json.loads(self.client.get(
+            reverse('fncs:api_get_price_summary'), params).content))
+        self.assertEqual(len(history), 1)
+        self.assertEqual(history[0]["unit_name"], "boxes")
+        self.assertEqual(history[0]["prices"], [100.0] * 10)
+        response = self.client.get(
+            url, params, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_get_price_summary(self):
+        crop, markets = self.create_highest_markets(prices=[50, 100])
+        url = reverse('fncs:api_get_price_summary')
+        params = {'market': markets[1].pk, 'crop': crop.pk}
+        with self.assertNumQueries(1):
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(json.loads(response.content), [{
+            "unit_id": crop.units.get(name="boxes").pk,
+            "unit_name": "boxes",
+            "prices": [100.0] * 10,
+            "mean": 100.0,
+        }])
+
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                url, params, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(
+            url, params, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+
+        etag = response["ETag"]
+        agent = utils.create_agent()
+        receipt = agent.take_in_crop(markets[1], utils.create_farmer(), 10,
+                                     crop.units.get(name="boxes"), crop)
+        agent.register_sale(receipt, 10, 200)
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)[0]["prices"][0], 200.0)
+
+    def test_get_price_summary_invalid(self):
+        response = self.client.get(reverse('fncs:api_get_price_summary'), {
+            'market': 'market',
+            })
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header("ETag"))
+
 
 class TestCreateFarmerApi(ResourceTestCase):
     fixtures = ["test_province.json",
@@ -384,7 +447,7 @@ class TestGetPriceHistory(ResourceTestCase):
         url = reverse('fncs:api_dispatch_list',
                       kwargs={'resource_name': 'transaction',
                               'api_name': 'v1'})
-        response = self.client.get(url)
+        response = self.client.get(url, {'limit': 0})
         self.assertEqual("application/json", response["Content-Type"])
         self.assertEqual(response.status_code, 200)
         json_item = json.loads(response.content)
@@ -473,3 +536,396 @@ class TestGetPriceHistory(ResourceTestCase):
         self.assertIn("objects", json_item)
         market = json_item["objects"]
         self.assertEqual(len(market), 0)
+
+
+class TestRegisterFarmerApi(ResourceTestCase):
+    fixtures = ["test_province.json",
+                "test_district.json",
+                "test_ward.json",
+                "test_crop_unit.json",
+                "test_crop.json"]
+
+    def setUp(self):
+        super(TestRegisterFarmerApi, self).setUp()
+        self.url = reverse('fncs:api_farmer_register',
+                           kwargs={'resource_name': 'farmer',
+                                   'api_name': 'v1'})
+
+    def farmer_data(self, msisdn, **kwargs):
+        data = {"msisdn": msisdn,
+                "first_name": "first_%s" % (msisdn,),
+                "last_name": "last_%s" % (msisdn,),
+                "crop": "Rice",
+                "ward": "test_ward",
+                "district": 4}
+        data.update(kwargs)
+        return data
+
+    def register(self, data):
+        return self.api_client.post(self.url, data=data, format="json")
+
+    def test_register_farmer(self):
+        response = self.register(self.farmer_data(
+            "27721231234", id_number="123456789", gender="F",
+            crops=["Rice", "Maize"]))
+        self.assertEqual(response.status_code, 201)
+        json_item = json.loads(response.content)
+        self.assertEqual("123456789", json_item["id_number"])
+        self.assertEqual("F", json_item["gender"])
+        self.assertEqual("27721231234",
+                         json_item["actor"]["user"]["username"])
+        self.assertEqual("first_27721231234 last_27721231234",
+                         json_item["actor"]["name"])
+        self.assertEqual(["Maize", "Rice"],
+                         sorted(crop["name"] for crop in json_item["crops"]))
+        self.assertEqual(["test_ward"],
+                         [ward["name"] for ward in json_item["wards"]])
+        self.assertEqual(["Kafue"], [district["name"] for district
+                                     in json_item["districts"]])
+
+        farmer = Farmer.objects.get(pk=json_item["id"])
+        self.assertEqual(farmer.actor.user.password, '!')
+        self.assertEqual(Actor.find("27721231234"), farmer.actor)
+        self.assertEqual(farmer.actor.as_farmer(), farmer)
+        self.assertEqual(farmer.groupmembership_set.count(), 2)
+
+    def test_register_farmers(self):
+        response = self.register([self.farmer_data("2772123123%s" % i)
+                                  for i in range(5)])
+        self.assertEqual(response.status_code, 201)
+        objects = json.loads(response.content)["objects"]
+        self.assertEqual([item["msisdn"] for item in objects],
+                         ["2772123123%s" % i for i in range(5)])
+        for item in objects:
+            farmer = Farmer.objects.get(pk=item["id"])
+            self.assertEqual(farmer.actor.user.username, item["msisdn"])
+            self.assertEqual([crop.name for crop in farmer.crops.all()],
+                             ["Rice"])
+            self.assertEqual(farmer.actor.get_msisdns(), [item["msisdn"]])
+
+    def test_register_farmers_queries(self):
+        registrations = [self.farmer_data("2772000%04d" % i)
+                         for i in range(60)]
+        with self.assertNumQueries(19):
+            Farmer.register([{
+                "msisdn": data["msisdn"],
+                "name": data["first_name"],
+                "surname": data["last_name"],
+                "crops": [1], "wards": [1], "districts": [4],
+            } for data in registrations])
+        self.assertEqual(Farmer.objects.count(), 60)
+
+    def test_register_existing_user(self):
+        farmer = utils.create_farmer(msisdn="27721231234")
+        response = self.register(self.farmer_data(
+            "27721231234", first_name="new", last_name="name"))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content)["id"], farmer.pk)
+        self.assertEqual(Actor.objects.get(pk=farmer.actor.pk).name,
+                         "new name")
+        self.assertEqual(Farmer.objects.count(), 1)
+        self.assertIn("Rice",
+                      [crop.name for crop in farmer.crops.all()])
+
+    def test_register_msisdn_as_given(self):
+        farmer = utils.create_farmer(msisdn="0961234567")
+        response = self.register([self.farmer_data("0961234567"),
+                                  self.farmer_data("0961234568")])
+        self.assertEqual(response.status_code, 201)
+        objects = json.loads(response.content)["objects"]
+        self.assertEqual(objects[0]["id"], farmer.pk)
+        self.assertEqual(Farmer.objects.count(), 2)
+        # as the USSD app looks farmers up
+        self.assertEqual(Actor.find("0961234568").as_farmer().pk,
+                         objects[1]["id"])
+
+    def test_register_invalid(self):
+        response = self.register([
+            self.farmer_data("27721231230"),
+            self.farmer_data("27721231231", crop="Cassava"),
+            self.farmer_data("27721231230"),
+            {"msisdn": "27721231233"},
+            self.farmer_data("27721231234", crop=True),
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)["errors"], {
+            "1": ["Unknown crop u'Cassava'"],
+            "2": ["msisdn 27721231230 is registered twice"],
+            "3": ["first_name is required", "last_name is required"],
+            "4": ["Unknown crop True"],
+        })
+        self.assertEqual(Farmer.objects.count(), 0)
+        self.assertEqual(User.objects.count(), 0)
+
+
+class TestRegisterFarmerApiTransaction(TransactionTestCase):
+    fixtures = ["test_province.json",
+                "test_district.json",
+                "test_ward.json",
+                "test_crop_unit.json",
+                "test_crop.json"]
+
+    def test_register_duplicate_id_number(self):
+        utils.create_farmer(msisdn="27721231230", id_number="123")
+        url = reverse('fncs:api_farmer_register',
+                      kwargs={'resource_name': 'farmer', 'api_name': 'v1'})
+        response = TestApiClient().post(url, format="json", data=[
+            {"msisdn": "27721231231", "first_name": "first",
+             "last_name": "last"},
+            {"msisdn": "27721231232", "first_name": "first",
+             "last_name": "last", "id_number": "123"},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(User.objects.filter(
+            username__in=["27721231231", "27721231232"]).exists())
+
+
+class ApiQueryCountTestCase(TestCase):
+    """
+    The number of queries for a page of a list endpoint shouldn't grow
+    with the size of the page.
+    """
+    page_sizes = (1, 5)
+    sparse_params = ({}, {'depth': 0}, {'depth': 1}, {'fields': 'id'})
+
+    def setUp(self):
+        self.client = Client()
+        crops = [utils.create_crop("crop %s" % i,
+                                   units=["unit %s" % i, "boxes"])
+                 for i in range(5)]
+        for i in range(5):
+            farmer = utils.create_farmer(
+                msisdn="2776123456%s" % i, district_name="district %s" % i,
+                ward_name="ward %s" % i)
+            agent = utils.create_agent(msisdn="2776765432%s" % i)
+            market = utils.create_market("market %s" % i,
+                                         farmer.districts.all()[0])
+            farmer.operates_at(market, agent)
+            farmer.grows_crop(crops[i])
+            receipt = utils.create_crop_receipt(
+                crop=crops[i], unit=crops[i].units.all()[0], farmer=farmer,
+                agent=agent, market=market)
+            utils.create_transaction(receipt)
+
+    def count_queries(self, url, limit, **params):
+        # the queries are reset when the request starts
+        use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        try:
+            response = self.client.get(url, dict(params, limit=limit))
+            queries = len(connection.queries)
+        finally:
+            connection.use_debug_cursor = use_debug_cursor
+        self.assertEqual(response.status_code, 200, url)
+        self.assertEqual(len(json.loads(response.content)["objects"]),
+                         limit, url)
+        return queries
+
+    def test_list_endpoints(self):
+        for resource_name in sorted(api_resources._registry):
+            url = reverse('fncs:api_dispatch_list',
+                          kwargs={'resource_name': resource_name,
+                                  'api_name': 'v1'})
+            for params in self.sparse_params:
+                counts = [self.count_queries(url, limit, **params)
+                          for limit in self.page_sizes]
+                self.assertEqual(counts[0], counts[-1],
+                                 "%s %r made %s queries" % (
+                                     resource_name, params,
+                                     " and ".join(map(str, counts))))
+
+
+class SparseFieldsTestCase(ResourceTestCase):
+
+    def setUp(self):
+        super(SparseFieldsTestCase, self).setUp()
+        self.farmer = utils.create_farmer(msisdn="27761234567")
+        self.farmer.grows_crop(utils.create_crop("potatoes"))
+        self.url = reverse('fncs:api_dispatch_list',
+                           kwargs={'resource_name': 'farmer',
+                                   'api_name': 'v1'})
+
+    def get_farmers(self, **params):
+        response = self.api_client.get(self.url, data=params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)["objects"]
+
+    def test_fields(self):
+        with self.assertNumQueries(2):
+            farmers = self.get_farmers(
+                actor__user__username="27761234567", fields="id,crops")
+        self.assertEqual(farmers, [{
+            "id": self.farmer.pk,
+            "crops": [{
+                "id": self.farmer.crops.get().pk,
+                "name": "potatoes",
+                "description": "",
+                "resource_uri": "",
+            }],
+        }])
+
+    def test_nested_fields(self):
+        with self.assertNumQueries(1):
+            farmers = self.get_farmers(
+                fields="actor__user__username,actor__name")
+        self.assertEqual(farmers, [{
+            "actor": {
+                "name": "name surname",
+                "user": {"username": "27761234567"},
+            },
+        }])
+
+    def test_depth(self):
+        farmer = self.get_farmers(depth=0)[0]
+        self.assertEqual(farmer["actor"], self.farmer.actor.pk)
+        self.assertEqual(farmer["crops"], [self.farmer.crops.get().pk])
+        self.assertEqual(farmer["wards"], [self.farmer.wards.get().pk])
+        self.assertEqual(farmer["id"], self.farmer.pk)
+
+        farmer = self.get_farmers(depth=1)[0]
+        self.assertEqual(farmer["actor"]["name"], "name surname")
+        self.assertEqual(farmer["actor"]["user"], self.farmer.actor.user.pk)
+        self.assertEqual(farmer["crops"][0]["name"], "potatoes")
+
+        self.assertEqual(self.get_farmers(depth=1, fields="actor"), [{
+            "actor": {
+                "id": self.farmer.actor.pk,
+                "name": "name surname",
+                "gender": "",
+                "resource_uri": "",
+                "user": self.farmer.actor.user.pk,
+            },
+        }])
+
+    def test_detail(self):
+        url = reverse('fncs:api_dispatch_detail',
+                      kwargs={'resource_name': 'farmer', 'api_name': 'v1',
+                              'pk': self.farmer.pk})
+        response = self.api_client.get(url, data={"fields": "id,gender"})
+        self.assertEqual(json.loads(response.content),
+                         {"id": self.farmer.pk, "gender": "U"})
+
+    def test_user_fields(self):
+        url = reverse('fncs:api_dispatch_list',
+                      kwargs={'resource_name': 'user', 'api_name': 'v1'})
+        response = self.api_client.get(url, data={"fields": "username"})
+        self.assertEqual(json.loads(response.content)["objects"],
+                         [{"username": "27761234567"}])
+
+    def test_invalid(self):
+        for params in [{"fields": "id,unknown"}, {"fields": "id__name"},
+                       {"fields": "actor__unknown"}, {"depth": "deep"}]:
+            response = self.api_client.get(self.url, data=params)
+            self.assertEqual(response.status_code, 400, params)
+
+
+class KeysetPaginationTestCase(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        farmer = utils.create_farmer()
+        agent = utils.create_agent()
+        market = utils.create_market("market", farmer.districts.all()[0])
+        crop = utils.create_crop("potatoes")
+        receipt = utils.create_crop_receipt(
+            crop=crop, unit=crop.units.all()[0], farmer=farmer, agent=agent,
+            market=market)
+        for i in range(7):
+            utils.create_transaction(receipt)
+        # the ids break the ties between transactions created together
+        Transaction.objects.filter(pk__in=Transaction.objects.order_by(
+            'pk').values_list('pk', flat=True)[2:5]).update(
+            created_at=datetime(2014, 1, 1))
+        self.url = reverse('fncs:api_dispatch_list',
+                           kwargs={'resource_name': 'transaction',
+                                   'api_name': 'v1'})
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_pages(self):
+        ids = []
+        page = self.get(self.url, limit=3)
+        self.assertNotIn("total_count", page["meta"])
+        while page["meta"]["next"]:
+            ids.extend(obj["id"] for obj in page["objects"])
+            page = self.get(self.url + page["meta"]["next"])
+        ids.extend(obj["id"] for obj in page["objects"])
+        self.assertEqual(page["meta"]["next_cursor"], None)
+        self.assertEqual(ids, list(Transaction.objects.order_by(
+            '-created_at', '-id').values_list('id', flat=True)))
+
+    def test_cursor(self):
+        meta = self.get(self.url, limit=2)["meta"]
+        page = self.get(self.url, limit=2, cursor=meta["next_cursor"])
+        self.assertEqual(page["meta"]["limit"], 2)
+        self.assertEqual(len(page["objects"]), 2)
+
+    def test_page_queries(self):
+        page = self.get(self.url, limit=2)
+        with self.assertNumQueries(1):
+            self.get(self.url + page["meta"]["next"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'nonsense'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_offset(self):
+        page = self.get(self.url, limit=2, offset=6)
+        self.assertEqual(page["meta"]["total_count"], 7)
+        self.assertEqual(len(page["objects"]), 1)
+
+    def test_default_ordering_keys(self):
+        Market.objects.create(name="another market",
+                              district=Market.objects.get().district)
+        url = reverse('fncs:api_dispatch_list',
+                      kwargs={'resource_name': 'market', 'api_name': 'v1'})
+        page = self.get(url, limit=1)
+        self.assertEqual(page["objects"][0]["name"], "another market")
+        page = self.get(url + page["meta"]["next"])
+        self.assertEqual(page["objects"][0]["name"], "market")
+        self.assertEqual(page["meta"]["next"], None)
+
+    def test_all_crops(self):
+        # the USSD menus list every crop with limit=0
+        bulk_create(Crop, [Crop(name="crop %04d" % (i % 1000))
+                           for i in range(1001)])
+        url = reverse('fncs:api_dispatch_list',
+                      kwargs={'resource_name': 'crop', 'api_name': 'v1'})
+        page = self.get(url, limit=0)
+        self.assertEqual(page["meta"]["total_count"], 1002)
+        self.assertEqual(page["meta"]["next"], None)
+        names = [obj["name"] for obj in page["objects"]]
+        self.assertEqual(names, sorted(names))
+        self.assertEqual(names[-1], "potatoes")
+
+        # pages continue in the same order, across crops with equal names
+        paged = []
+        page = self.get(url, limit=400)
+        while True:
+            paged.extend(obj["id"] for obj in page["objects"])
+            if not page["meta"]["next"]:
+                break
+            page = self.get(url + page["meta"]["next"])
+        self.assertEqual(paged, list(Crop.objects.order_by(
+            'name', 'id').values_list('id', flat=True)))
+
+    def test_default_limit(self):
+        self.assertEqual(self.get(self.url)["meta"]["limit"], 100)
+
+    def test_stream(self):
+        api_resources._registry['transaction'].stream_chunk_size = 3
+        try:
+            streamed = self.get(self.url, stream=1, depth=0)
+        finally:
+            del api_resources._registry['transaction'].stream_chunk_size
+        self.assertNotIn("meta", streamed)
+        self.assertEqual(streamed["objects"],
+                         self.get(self.url, limit=0, depth=0)["objects"])
+
+    def test_stream_only_json(self):
+        response = self.client.get(
+            self.url, {'stream': 1, 'format': 'jsonp', 'callback': 'f'})
+        self.assertEqual(response.status_code, 400)
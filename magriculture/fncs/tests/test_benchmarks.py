@@ -0,0 +1,414 @@
+"""
+Benchmarks for the query paths that scale with the size of the dataset.
+
+These are skipped unless ``MAGRICULTURE_BENCHMARKS`` is set in the
+environment since they generate large amounts of data::
+
+    MAGRICULTURE_BENCHMARKS=1 python manage.py test \\
+        magriculture.fncs.tests.test_benchmarks \\
+        --settings=magriculture.testsettings
+"""
+# Python
+import os
+import json
+import sys
+import time
+import random
+import resource
+from StringIO import StringIO
+from datetime import datetime, timedelta
+
+# Django
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.urlresolvers import reverse
+from django.db.models import F
+from django.test import TestCase
+from django.test.client import Client
+from django.utils.unittest import skipUnless
+
+# Third Party
+import requests
+
+# Project
+from magriculture import sms
+from magriculture.fncs import tasks
+from magriculture.fncs.actions import ExportFarmersAsCSV
+from magriculture.fncs.tests import utils
+from magriculture.fncs.tests.fake_vumigo import FakeVumiGo
+from magriculture.fncs.models.actors import (Actor, Farmer, FarmerGroup,
+                                             Identity, GroupMembership)
+from magriculture.fncs.locations import (NGramLocationBackend,
+                                         TrigramLocationBackend)
+from magriculture.fncs.models.geo import Market, Ward
+from magriculture.fncs.models.props import (CropReceipt, Transaction,
+                                            GroupMessage, Message)
+from magriculture.fncs.utils import bulk_create
+
+BENCHMARKS_ENABLED = bool(os.environ.get('MAGRICULTURE_BENCHMARKS'))
+
+
+def bulk_create_farmers(count, district, crop, agent):
+    """
+    Create `count` farmers growing `crop` in `district` for `agent`
+    without going through the signals.
+    """
+    first_msisdn = 27760000000
+    bulk_create(User, [User(username=str(first_msisdn + i))
+                       for i in range(count)])
+    user_pks = User.objects.filter(
+        username__gte=str(first_msisdn),
+        username__lt=str(first_msisdn + count)).values_list('pk', flat=True)
+    bulk_create(Actor, [Actor(user_id=pk, name="farmer") for pk in user_pks])
+    actors = Actor.objects.filter(user__in=user_pks).values_list(
+        'pk', 'user__username')
+    bulk_create(Identity, [Identity(actor_id=pk, msisdn=msisdn)
+                           for pk, msisdn in actors])
+    bulk_create(Farmer, [Farmer(actor_id=pk) for pk, _ in actors])
+    farmer_pks = Farmer.objects.filter(
+        actor__user__in=user_pks).values_list('pk', flat=True)
+    bulk_create(Farmer.districts.through, [
+        Farmer.districts.through(farmer_id=pk, district_id=district.pk)
+        for pk in farmer_pks])
+    bulk_create(Farmer.crops.through, [
+        Farmer.crops.through(farmer_id=pk, crop_id=crop.pk)
+        for pk in farmer_pks])
+    bulk_create(agent.farmers.through, [
+        agent.farmers.through(farmer_id=pk, agent_id=agent.pk)
+        for pk in farmer_pks])
+    GroupMembership.rebuild()
+
+
+class Timer(object):
+
+    def __init__(self, label):
+        self.label = label
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.time() - self.start
+        sys.stderr.write("\n%s: %.3fs\n" % (self.label, self.elapsed))
+
+
+@skipUnless(BENCHMARKS_ENABLED, "set MAGRICULTURE_BENCHMARKS to run")
+class HighestMarketsBenchmark(TestCase):
+    markets = 1000
+    transactions = 100000
+
+    def setUp(self):
+        farmer = utils.create_farmer()
+        agent = utils.create_agent()
+        district = farmer.districts.all()[0]
+        self.crop = utils.create_crop("potatoes")
+        unit = utils.create_crop_unit("boxes")
+
+        bulk_create(Market, [Market(name="market %d" % i, district=district)
+                             for i in range(self.markets)])
+        market_pks = list(Market.objects.values_list('pk', flat=True))
+
+        now = datetime.now()
+        bulk_create(CropReceipt, [
+            CropReceipt(crop=self.crop, unit=unit, farmer=farmer,
+                        agent=agent, market_id=random.choice(market_pks),
+                        amount=1, created_at=now)
+            for i in range(self.transactions)])
+        bulk_create(Transaction, [
+            Transaction(crop_receipt_id=receipt_pk, amount=1,
+                        price=random.randint(10, 500), total=0,
+                        created_at=now - timedelta(minutes=i))
+            for i, receipt_pk in enumerate(
+                CropReceipt.objects.values_list('pk', flat=True))])
+
+    def legacy_highest_markets_for(self, crop, window_size=5):
+        markets = Market.objects.all()
+        avg_prices = {}
+        for market in markets:
+            prices = Transaction.objects.filter(
+                crop_receipt__market=market,
+                crop_receipt__crop=crop).order_by('-created_at')
+            prices = prices.values_list('price', flat=True)[:window_size]
+            avg_prices[market.pk] = sum(prices) / float(window_size)
+        return sorted(markets, key=lambda market: avg_prices[market.pk],
+                      reverse=True)
+
+    def test_highest_markets_for(self):
+        with Timer("highest_markets_for (per-market queries)"):
+            legacy = self.legacy_highest_markets_for(self.crop)
+        with Timer("highest_markets_for (single query)"):
+            ranked = Market.highest_markets_for(self.crop)
+        self.assertEqual(len(ranked), self.markets)
+        self.assertEqual(set(ranked), set(legacy))
+
+
+@skipUnless(BENCHMARKS_ENABLED, "set MAGRICULTURE_BENCHMARKS to run")
+class VumiGoSenderBenchmark(TestCase):
+    messages = 500
+    latency = 0.01
+
+    def setUp(self):
+        self.fake_vumigo = FakeVumiGo(latency=self.latency)
+        self.fake_vumigo.start()
+        self.sender = sms.VumiGoSender(self.fake_vumigo.url, 'account',
+                                       'conversation', 'token')
+
+    def tearDown(self):
+        self.sender.close()
+        self.fake_vumigo.stop()
+
+    def legacy_send_sms(self, to_addr, content):
+        requests.put(self.sender._api_url(),
+                     auth=(self.sender.account_id,
+                           self.sender.conversation_token),
+                     headers={"Content-Type":
+                              "application/json; charset=utf-8"},
+                     data=json.dumps({"content": content,
+                                      "to_addr": to_addr}))
+
+    def test_send_bulk(self):
+        messages = [('27761234567', 'message %d' % (i,))
+                    for i in range(self.messages)]
+        with Timer("send_sms (connection per message)"):
+            for to_addr, content in messages:
+                self.legacy_send_sms(to_addr, content)
+        with Timer("send_bulk (pooled connections)"):
+            results = self.sender.send_bulk(messages)
+        self.assertFalse([result for result in results
+                          if isinstance(result, sms.SmsSendingError)])
+        self.assertEqual(len(self.fake_vumigo.requests), 2 * self.messages)
+
+
+@skipUnless(BENCHMARKS_ENABLED, "set MAGRICULTURE_BENCHMARKS to run")
+class GroupMessageBenchmark(TestCase):
+    farmers = 5000
+
+    def setUp(self):
+        self.default_sender = sms.default_sender
+        sms.default_sender = sms.LoggingSender(level=0)
+        self.agent = utils.create_agent()
+        crop = utils.create_crop("potatoes")
+        district = utils.create_district(
+            "district", utils.create_province("province"))
+        bulk_create_farmers(self.farmers, district, crop, self.agent)
+        self.group = FarmerGroup.objects.create(
+            name="potato farmers", actor=self.agent.actor, crop=crop)
+        self.group.district.add(district)
+
+    def tearDown(self):
+        sms.default_sender = self.default_sender
+
+    def legacy_send_message_to_farmergroups(self, actor, farmergroups,
+                                            message):
+        groupmessage = GroupMessage.objects.create(sender=actor,
+                                                   content=message)
+        groupmessage.farmergroups.add(farmergroups)
+        for farmer in farmergroups.members():
+            actor.send_message_to_farmer(farmer, message, groupmessage)
+        return groupmessage
+
+    def test_send_message_to_farmergroups(self):
+        actor = self.agent.actor
+        with Timer("send_message_to_farmergroups (per farmer)"):
+            self.legacy_send_message_to_farmergroups(actor, self.group,
+                                                     'hello')
+        with Timer("send_message_to_farmergroups (chunked)"):
+            groupmessage = actor.send_message_to_farmergroups(self.group,
+                                                              'hello')
+        self.assertEqual(Message.objects.filter(
+            group=groupmessage, status=Message.SENT).count(), self.farmers)
+
+
+@skipUnless(BENCHMARKS_ENABLED, "set MAGRICULTURE_BENCHMARKS to run")
+class LocationSearchBenchmark(TestCase):
+    wards = 50000
+    queries = ["ward 12345", "wrad 4242", "ward 49999 in kafue", "kafue"]
+
+    def setUp(self):
+        district = utils.create_district(
+            "Kafue", utils.create_province("province"))
+        bulk_create(Ward, [Ward(name="Ward %d" % i, district=district)
+                           for i in range(self.wards)])
+
+    def test_search(self):
+        ngram = NGramLocationBackend()
+        trigram = TrigramLocationBackend()
+        with Timer("NGramLocationBackend (building the index)"):
+            ngram.get_index()
+        with Timer("NGramLocationBackend (%d searches)" % len(self.queries)):
+            expected = [ngram.search(query) for query in self.queries]
+        with Timer("TrigramLocationBackend (%d searches)" % (
+                len(self.queries),)):
+            results = [trigram.search(query) for query in self.queries]
+        self.assertEqual([result[0] for result in results],
+                         [result[0] for result in expected])
+
+
+def max_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@skipUnless(BENCHMARKS_ENABLED, "set MAGRICULTURE_BENCHMARKS to run")
+class TransactionExportBenchmark(TestCase):
+    transactions = 100000
+    field_names = ['id', 'crop_receipt__farmer__actor__name',
+                   'crop_receipt__farmer__gender', 'created_at',
+                   'crop_receipt__crop', 'crop_receipt__unit', 'amount',
+                   'total', 'crop_receipt__market',
+                   'crop_receipt__agent__actor__name',
+                   'crop_receipt__agent__actor__gender']
+
+    def setUp(self):
+        self.user = utils.create_generic_user()
+        self.user.email = "test@example.com"
+        self.user.save()
+        receipts = [utils.create_crop_receipt(amount=1000) for i in range(20)]
+        now = datetime.now()
+        bulk_create(Transaction, [
+            Transaction(crop_receipt=random.choice(receipts), amount=1,
+                        price=10, total=10, created_at=now)
+            for i in range(self.transactions)])
+
+    def legacy_export_transactions(self, queryset):
+        io = StringIO()
+        writer = tasks.csv.writer(io)
+        for obj in queryset:
+            data = []
+            for field_name in self.field_names:
+                field_obj = obj
+                for name in field_name.split("__"):
+                    field_obj = getattr(field_obj, name)
+                data.append(field_obj)
+            writer.writerow([unicode(entry).encode('utf-8')
+                             for entry in data])
+        return io
+
+    def test_export_transactions(self):
+        # the peak memory use only grows, so measure the streaming export
+        # first
+        rss = max_rss()
+        with Timer("export_transactions (chunked, to a temporary file)"):
+            tasks.export_transactions(self.field_names, self.field_names,
+                                      {}, self.user)
+        sys.stderr.write("peak memory growth: %d kB\n" % (max_rss() - rss,))
+        rss = max_rss()
+        with Timer("export_transactions (queryset, in memory)"):
+            self.legacy_export_transactions(Transaction.objects.all())
+        sys.stderr.write("peak memory growth: %d kB\n" % (max_rss() - rss,))
+        self.assertEqual(len(mail.outbox), 1)
+
+
+@skipUnless(BENCHMARKS_ENABLED, "set MAGRICULTURE_BENCHMARKS to run")
+class FarmerExportBenchmark(TestCase):
+    farmers = 5000
+
+    def setUp(self):
+        agent = utils.create_agent()
+        crop = utils.create_crop("potatoes")
+        district = utils.create_district(
+            "district", utils.create_province("province"))
+        bulk_create_farmers(self.farmers, district, crop, agent)
+        market = utils.create_market("market", district)
+        unit = utils.create_crop_unit("boxes")
+        farmer_pks = list(Farmer.objects.values_list('pk', flat=True))
+        bulk_create(Farmer.markets.through, [
+            Farmer.markets.through(farmer_id=pk, market_id=market.pk)
+            for pk in farmer_pks])
+        now = datetime.now()
+        bulk_create(CropReceipt, [
+            CropReceipt(crop=crop, unit=unit, farmer_id=pk, agent=agent,
+                        market=market, amount=1, created_at=now)
+            for pk in farmer_pks for i in range(3)])
+
+    def legacy_csv_rows(self, queryset):
+        for farmer in queryset:
+            msisdns = farmer.actor.get_msisdns()
+            markets = list(farmer.markets.all())
+            receipts = [(receipt.crop.pk, receipt.crop.name)
+                        for receipt in farmer.cropreceipt_set.all()]
+            yield [farmer.id, farmer.actor.id, farmer.actor.name,
+                   msisdns[:1], len(msisdns), markets[:1], len(markets),
+                   receipts[:1]]
+
+    def test_csv_rows(self):
+        with Timer("ExportFarmersAsCSV (queries per farmer)"):
+            legacy = list(self.legacy_csv_rows(Farmer.objects.all()))
+        with Timer("ExportFarmersAsCSV (queries per chunk)"):
+            rows = list(ExportFarmersAsCSV()._csv_rows(Farmer.objects.all()))
+        self.assertEqual(len(rows), len(legacy) + 1)
+
+
+@skipUnless(BENCHMARKS_ENABLED, "set MAGRICULTURE_BENCHMARKS to run")
+class StaleInventoryBenchmark(TestCase):
+    receipts = 200000
+    # the per receipt loop is only timed for a sample of the receipts
+    legacy_receipts = 2000
+
+    def setUp(self):
+        self.default_sender = sms.default_sender
+        sms.default_sender = sms.LoggingSender(level=0)
+        farmers = [utils.create_farmer(msisdn=str(27761000000 + i))
+                   for i in range(10)]
+        agent = utils.create_agent()
+        crop = utils.create_crop("potatoes")
+        unit = utils.create_crop_unit("boxes")
+        market = utils.create_market("market", farmers[0].districts.all()[0])
+        created_at = datetime.now() - timedelta(days=10)
+        bulk_create(CropReceipt, [
+            CropReceipt(crop=crop, unit=unit, farmer=random.choice(farmers),
+                        agent=agent, market=market, amount=10,
+                        sold_amount=random.choice([0, 5, 10]),
+                        created_at=created_at)
+            for i in range(self.receipts)])
+
+    def tearDown(self):
+        sms.default_sender = self.default_sender
+
+    def test_query_crop_receipt_for_old_crops(self):
+        sample = CropReceipt.objects.filter(
+            pk__in=list(CropReceipt.objects.values_list(
+                'pk', flat=True)[:self.legacy_receipts]))
+        with Timer("query_crop_receipt_for_old_crops (per receipt, %d "
+                   "receipts)" % (self.legacy_receipts,)):
+            for crop_receipt in sample:
+                tasks.check_inventory_left(crop_receipt)
+        with Timer("query_crop_receipt_for_old_crops (chunked, %d "
+                   "receipts)" % (self.receipts,)):
+            tasks.query_crop_receipt_for_old_crops(1)
+        self.assertFalse(CropReceipt.objects.filter(
+            reconciled=False, amount__gt=F('sold_amount')).exists())
+
+
+@skipUnless(BENCHMARKS_ENABLED, "set MAGRICULTURE_BENCHMARKS to run")
+class SparseFieldsBenchmark(TestCase):
+    farmers = 2000
+    page_size = 500
+
+    def setUp(self):
+        agent = utils.create_agent()
+        crop = utils.create_crop("potatoes")
+        district = utils.create_district(
+            "district", utils.create_province("province"))
+        bulk_create_farmers(self.farmers, district, crop, agent)
+        self.url = reverse('fncs:api_dispatch_list',
+                           kwargs={'resource_name': 'farmer',
+                                   'api_name': 'v1'})
+
+    def get_farmers(self, label, **params):
+        client = Client()
+        with Timer("farmer list of %d (%s)" % (self.page_size, label)):
+            response = client.get(self.url,
+                                  dict(params, limit=self.page_size))
+        sys.stderr.write("payload: %d bytes\n" % (len(response.content),))
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)["objects"]
+
+    def test_farmer_list(self):
+        full = self.get_farmers("full")
+        ids = self.get_farmers("depth=0", depth=0)
+        sparse = self.get_farmers("fields=id,crops", fields="id,crops")
+        self.assertEqual([farmer["id"] for farmer in full],
+                         [farmer["id"] for farmer in ids])
+        self.assertEqual([farmer["crops"] for farmer in full],
+                         [farmer["crops"] for farmer in sparse])
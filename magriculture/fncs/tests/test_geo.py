@@ -1,7 +1,9 @@
 from django.test import TestCase
 from django.contrib.auth.models import User
 from magriculture.fncs.tests import utils
-from magriculture.fncs.models import Transaction
+from magriculture.fncs.models import Transaction, Market
+from magriculture.fncs.models.geo import District
+from magriculture.fncs.forms import FarmerGroupCreateFilterForm
 
 class MarketTestCase(TestCase):
     def setUp(self):
@@ -22,3 +24,79 @@ class MarketTestCase(TestCase):
         receipt = agent.take_in_crop(market, farmer, amount, unit, crop)
 
         self.assertEquals(list(market.crops()), [crop])
+
+    def test_highest_markets_for(self):
+        farmer = utils.create_farmer()
+        district = farmer.districts.all()[0]
+        agent = utils.create_agent()
+        crop = utils.create_crop("potatoes")
+        unit = utils.create_crop_unit("boxes")
+        cheap = utils.create_market("cheap", district)
+        expensive = utils.create_market("expensive", district)
+        empty = utils.create_market("empty", district)
+
+        for market, prices in [(cheap, [10, 20, 90]), (expensive, [50, 60])]:
+            for price in prices:
+                receipt = agent.take_in_crop(market, farmer, 1, unit, crop)
+                agent.register_sale(receipt, 1, price)
+
+        with self.assertNumQueries(1):
+            markets = Market.highest_markets_for(crop, window_size=2)
+        # only the two most recent prices count and the sum is divided by
+        # the window size: cheap averages 55.0, expensive 55.0, empty 0.0
+        self.assertEqual(markets, [cheap, expensive, empty])
+        self.assertEqual([m.average_price for m in markets],
+                         [55.0, 55.0, 0.0])
+
+        markets = Market.highest_markets_for(crop, window_size=3)
+        self.assertEqual(markets, [cheap, expensive, empty])
+        self.assertAlmostEqual(markets[1].average_price, 110 / 3.0)
+
+
+class DistrictTestCase(TestCase):
+
+    def setUp(self):
+        self.agent = utils.create_agent()
+        self.crop = utils.create_crop("potatoes")
+        self.province = utils.create_province("province")
+
+    def create_farmers(self, district_name, count):
+        district = utils.create_district(district_name, self.province)
+        for i in range(count):
+            farmer = utils.create_farmer(
+                msisdn="%s%s" % (district_name, i),
+                district_name=district_name)
+            farmer.crops.add(self.crop)
+            self.agent.farmers.add(farmer)
+        return district
+
+    def get_labels(self):
+        field = FarmerGroupCreateFilterForm().fields["district"]
+        field.queryset = District.objects.with_farmer_counts(self.agent,
+                                                             self.crop)
+        field.label_from_instance = lambda obj: "%s (%s)" % (
+            obj.name, obj.farmer_count)
+        return [label for _, label in field.choices]
+
+    def test_with_farmer_counts(self):
+        one = self.create_farmers("one", 1)
+        three = self.create_farmers("three", 3)
+        other_crop = utils.create_farmer(msisdn="other", district_name="other")
+        self.agent.farmers.add(other_crop)
+
+        districts = District.objects.with_farmer_counts(self.agent, self.crop)
+        self.assertEqual(
+            [(district, district.farmer_count) for district in districts],
+            [(three, 3), (one, 1)])
+        self.assertEqual(three.get_farmer_count(self.agent, self.crop), 3)
+
+    def test_farmer_count_labels_constant_queries(self):
+        self.create_farmers("one", 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_labels(), ["one (1)"])
+
+        for name in ["two", "three", "four"]:
+            self.create_farmers(name, 2)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_labels(), [
+                "two (2)", "three (2)", "one (1)", "four (2)"])
@@ -0,0 +1,135 @@
+"""Tests for magriculture.fncs.identities."""
+# Django
+from django.core.cache import get_cache
+from django.test import TestCase
+
+# Project
+from magriculture.fncs.auth.backends import IdentityBackend
+from magriculture.fncs.errors import ActorException
+from magriculture.fncs.identities import identity_cache, IdentityCache
+from magriculture.fncs.models.actors import Actor, Identity
+from magriculture.fncs.tests import utils
+
+
+class IdentityCacheTestCase(TestCase):
+
+    def setUp(self):
+        # the test settings disable the identity cache
+        self.default_cache = identity_cache.cache
+        identity_cache.cache = get_cache(
+            'django.core.cache.backends.locmem.LocMemCache',
+            LOCATION='test-identities')
+        identity_cache.cache.clear()
+        self.farmer = utils.create_farmer(msisdn='27761234567')
+        self.identity = self.farmer.actor.get_identity('27761234567')
+        self.identity.set_pin('1234')
+        self.identity.save()
+
+    def tearDown(self):
+        identity_cache.cache.clear()
+        identity_cache.cache = self.default_cache
+
+    def test_lookup(self):
+        cache = IdentityCache(
+            'django.core.cache.backends.locmem.LocMemCache')
+        cache.cache.clear()
+        identity = cache.lookup('27761234567')
+        self.assertEqual(identity.identity_id, self.identity.pk)
+        self.assertEqual(identity.actor_id, self.farmer.actor.pk)
+        self.assertEqual(identity.user_id, self.farmer.actor.user_id)
+        self.assertTrue(identity.check_pin('1234'))
+        self.assertFalse(identity.check_pin('4321'))
+        self.assertFalse(identity.expired)
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.lookup('27761234567'), identity)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_lookup_missing(self):
+        self.assertEqual(identity_cache.lookup('27760000000'), None)
+        # misses aren't cached
+        with self.assertNumQueries(1):
+            self.assertEqual(identity_cache.lookup('27760000000'), None)
+        identity = self.farmer.actor.add_identity('27760000000')
+        self.assertEqual(identity_cache.lookup('27760000000').identity_id,
+                         identity.pk)
+
+    def test_invalidated_on_save(self):
+        identity_cache.lookup('27761234567')
+        self.identity.set_pin('4321')
+        self.identity.expire()
+        identity = identity_cache.lookup('27761234567')
+        self.assertTrue(identity.check_pin('4321'))
+        self.assertTrue(identity.expired)
+
+    def test_invalidated_on_delete(self):
+        identity_cache.lookup('27761234567')
+        self.identity.delete()
+        self.assertEqual(identity_cache.lookup('27761234567'), None)
+        self.assertRaises(Identity.DoesNotExist, Actor.find, '27761234567')
+
+    def test_lookup_normalised(self):
+        identity = self.farmer.actor.add_identity('+260961234567')
+        self.assertEqual(identity_cache.lookup('+260961234567').identity_id,
+                         identity.pk)
+        # the MSISDNs share a key but are looked up exactly
+        with self.assertNumQueries(1):
+            self.assertEqual(identity_cache.lookup('0961234567'), None)
+            self.assertEqual(
+                identity_cache.lookup('+260961234567').identity_id,
+                identity.pk)
+        identity.msisdn = '0961234567'
+        identity.save()
+        self.assertEqual(identity_cache.lookup('0961234567').identity_id,
+                         identity.pk)
+        self.assertEqual(identity_cache.lookup('+260961234567'), None)
+
+    def test_key(self):
+        version = identity_cache.version('096 123 4567')
+        self.assertEqual(version, identity_cache.version('+260961234567'))
+        key = identity_cache._key('096 123 4567', version)
+        self.assertEqual(key, identity_cache._key('+260961234567', version))
+        self.assertTrue(key.startswith('fncs:identity:%s:' % (version,)))
+        self.assertEqual(len(key.split(':')[-1]), 32)
+        self.assertFalse(
+            ' ' in identity_cache._key('some user name', version))
+        self.assertFalse(
+            ' ' in identity_cache._version_key('some user name'))
+
+    def test_stale_set_ignored(self):
+        # a lookup that loaded the identity before it was saved and
+        # caches it after
+        version = identity_cache.version('27761234567')
+        stale = identity_cache._load('27761234567')
+        self.identity.set_pin('4321')
+        self.identity.save()
+        identity_cache.cache.set(
+            identity_cache._key('27761234567', version),
+            {u'27761234567': tuple(stale)})
+        self.assertTrue(
+            identity_cache.lookup('27761234567').check_pin('4321'))
+
+    def test_invalidated_on_msisdn_change(self):
+        identity_cache.lookup('27761234567')
+        self.identity.msisdn = '27760000000'
+        self.identity.save()
+        self.assertEqual(identity_cache.lookup('27761234567'), None)
+        self.assertEqual(identity_cache.lookup('27760000000').identity_id,
+                         self.identity.pk)
+
+    def test_find(self):
+        self.assertEqual(Actor.find('27761234567'), self.farmer.actor)
+        with self.assertNumQueries(1):
+            self.assertEqual(Actor.find_with_pin('27761234567', '1234'),
+                             self.farmer.actor)
+        self.assertRaises(ActorException, Actor.find_with_pin,
+                          '27761234567', '4321')
+
+    def test_authenticate(self):
+        backend = IdentityBackend()
+        self.assertEqual(backend.authenticate('27761234567', '1234'),
+                         self.farmer.actor.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(backend.authenticate('27761234567', '1234'),
+                             self.farmer.actor.user)
+        self.assertEqual(backend.authenticate('27761234567', '4321'), None)
+        self.assertEqual(backend.authenticate('27760000000', '1234'), None)
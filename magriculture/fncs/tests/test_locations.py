@@ -0,0 +1,159 @@
+"""Tests for magriculture.fncs.locations."""
+# Python
+import os
+import shutil
+import tempfile
+
+# Django
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import TestCase
+from django.utils.unittest import skipUnless
+
+# Third Party
+from ngram import NGram
+
+# Project
+from magriculture.fncs.models.geo import District
+from magriculture.fncs.tests import utils
+from magriculture.fncs.locations import (NGramLocationBackend,
+                                         TrigramLocationBackend, load_backend,
+                                         trigram_similarity)
+
+
+class NGramLocationBackendTestCase(TestCase):
+
+    def setUp(self):
+        self.province = utils.create_province("province")
+        self.district = utils.create_district("Kafue", self.province)
+        self.ward = utils.create_ward("Chanyanya", self.district)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "locations.pickle")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_search(self):
+        index = NGramLocationBackend()
+        self.assertEqual(index.search("kafu", limit=1), [
+            ('district', self.district.pk, 'Kafue')])
+        with self.assertNumQueries(0):
+            self.assertEqual(index.search("ward in kafue", limit=1), [
+                ('ward', self.ward.pk, 'Ward in Kafue')])
+
+    def test_invalidated_on_save(self):
+        index = NGramLocationBackend()
+        self.assertEqual(index.search("lusaka"), [])
+        district = utils.create_district("Lusaka", self.province)
+        self.assertEqual(index.search("lusaka"), [
+            ('district', district.pk, 'Lusaka')])
+        district.delete()
+        self.assertEqual(index.search("lusaka"), [])
+
+    def test_persisted_to_disk(self):
+        NGramLocationBackend(self.path).search("kafue")
+        self.assertTrue(os.path.exists(self.path))
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                NGramLocationBackend(self.path).search("kafu", limit=1),
+                [('district', self.district.pk, 'Kafue')])
+
+        # the index on disk is outdated once a location changes
+        district = utils.create_district("Lusaka", self.province)
+        self.assertEqual(NGramLocationBackend(self.path).search("lusaka"), [
+            ('district', district.pk, 'Lusaka')])
+
+    def test_expired(self):
+        index = NGramLocationBackend(self.path, timeout=60)
+        self.assertEqual(index.search("lusaka"), [])
+        # updates don't send the signals that invalidate the index
+        District.objects.filter(pk=self.district.pk).update(name="Lusaka")
+        with self.assertNumQueries(0):
+            self.assertEqual(index.search("lusaka"), [])
+            self.assertEqual(
+                NGramLocationBackend(self.path).search("lusaka"), [])
+        # both the index in memory and the one on disk expire
+        index.timeout = 0
+        self.assertEqual(index.search("lusaka"), [
+            ('district', self.district.pk, 'Lusaka')])
+
+
+class TrigramLocationBackendTestCase(TestCase):
+
+    def setUp(self):
+        self.province = utils.create_province("province")
+        self.district = utils.create_district("Kafue", self.province)
+        self.ward = utils.create_ward("Chanyanya", self.district)
+
+    def test_search(self):
+        backend = TrigramLocationBackend()
+        self.assertEqual(backend.search("kafue", limit=1), [
+            ('district', self.district.pk, 'Kafue')])
+        self.assertEqual(backend.search("Ward in Kafue", limit=1), [
+            ('ward', self.ward.pk, 'Ward in Kafue')])
+        self.assertEqual(backend.search("zzz"), [])
+
+    def test_search_sees_changes(self):
+        backend = TrigramLocationBackend()
+        district = utils.create_district("Lusaka", self.province)
+        self.assertEqual(backend.search("lusaka", limit=1), [
+            ('district', district.pk, 'Lusaka')])
+
+    def test_trigram_similarity(self):
+        for string, query in [("kafue", "kafu"), ("spam", "spa"),
+                              ("ham", "bam"), ("aaaa", "aa"), ("ham", "xyz"),
+                              (u"chany\xe1nya", u"chany\xe1")]:
+            self.assertAlmostEqual(trigram_similarity(string, query),
+                                   NGram.compare(string, query))
+        self.assertEqual(trigram_similarity(None, "ham"), 0.0)
+
+
+class LocationBackendRankingTestCase(TestCase):
+    """
+    The backends should rank the locations alike.
+    """
+    names = ["Kafue", "Kafue Gorge", "Kabwe", "Kabwata", "Chongwe",
+             "Chanyanya", "Chikankata", "Lusaka", "Lusaka West", "Luangwa",
+             "Mumbwa", "Mwembeshi", "Nangoma", "Shibuyunji", "Kaoma"]
+    queries = ["kafue", "kafu", "KABWE", "lusaka w", "chong", "mwembe",
+               "shibuyunji", "nango", "ka", "luangwa district"]
+
+    def setUp(self):
+        province = utils.create_province("province")
+        for name in self.names:
+            district = utils.create_district(name, province)
+            utils.create_ward(name, district)
+
+    def test_same_best_match(self):
+        ngram = NGramLocationBackend()
+        trigram = TrigramLocationBackend()
+        for query in self.queries:
+            self.assertEqual(ngram.search(query, limit=1),
+                             trigram.search(query, limit=1), query)
+
+    @skipUnless(connection.vendor == 'sqlite',
+                "pg_trgm scores words rather than whole names")
+    def test_same_ranking(self):
+        ngram = NGramLocationBackend()
+        trigram = TrigramLocationBackend()
+        for query in self.queries:
+            expected = ngram.ranked(query, limit=20)
+            ranked = trigram.ranked(query, limit=20)
+            self.assertEqual([location for location, _ in expected],
+                             [location for location, _ in ranked], query)
+            for (_, expected_score), (_, score) in zip(expected, ranked):
+                self.assertAlmostEqual(expected_score, score)
+
+
+class LoadBackendTestCase(TestCase):
+
+    def test_load_backend(self):
+        self.assertTrue(isinstance(
+            load_backend('magriculture.fncs.locations.TrigramLocationBackend'),
+            TrigramLocationBackend))
+
+    def test_load_missing_backend(self):
+        self.assertRaises(ImproperlyConfigured, load_backend,
+                          'magriculture.fncs.locations.MissingBackend')
+        self.assertRaises(ImproperlyConfigured, load_backend,
+                          'magriculture.missing.Backend')
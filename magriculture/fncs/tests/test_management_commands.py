@@ -6,6 +6,7 @@ from django.test import TestCase
 # Project
 from magriculture.fncs.tests import utils
 from magriculture.fncs.models.actors import Farmer
+from magriculture.fncs.models.props import PriceSummary, CropReceipt
 
 
 class TestCreateMarketDistrictCommand(TestCase):
@@ -51,3 +52,47 @@ class TestCreateMarketDistrictCommand(TestCase):
 
         # If sorted not added below it fails even though both lists are equal (visually), not sure why.
         self.assertEqual(sorted(farmer_2_districts), sorted([self.district_2.name]))
+
+
+class TestRebuildPriceSummariesCommand(TestCase):
+    def test_rebuild_price_summaries(self):
+        farmer = utils.create_farmer()
+        agent = utils.create_agent()
+        market = utils.create_market("market", farmer.districts.all()[0])
+        crop = utils.create_crop("potatoes")
+        unit = utils.create_crop_unit("boxes")
+        for price in [10, 20, 30]:
+            receipt = agent.take_in_crop(market, farmer, 1, unit, crop)
+            agent.register_sale(receipt, 1, price)
+        PriceSummary.objects.all().delete()
+
+        call_command('fncs_rebuild_price_summaries')
+
+        summary = PriceSummary.summary_for(
+            PriceSummary.TRANSACTION, market, crop, unit)
+        self.assertEqual(summary.price_list(), [30.0, 20.0, 10.0])
+        self.assertEqual(summary.mean, 20.0)
+
+
+class TestReconcileSoldAmountsCommand(TestCase):
+    def setUp(self):
+        farmer = utils.create_farmer()
+        agent = utils.create_agent()
+        market = utils.create_market("market", farmer.districts.all()[0])
+        crop = utils.create_crop("potatoes")
+        unit = utils.create_crop_unit("boxes")
+        self.receipt = agent.take_in_crop(market, farmer, 10, unit, crop)
+        agent.register_sale(self.receipt, 3, 10)
+        CropReceipt.objects.filter(pk=self.receipt.pk).update(sold_amount=0)
+
+    def get_receipt(self):
+        return CropReceipt.objects.get(pk=self.receipt.pk)
+
+    def test_verify_sold_amounts(self):
+        call_command('fncs_reconcile_sold_amounts', verify=True)
+        self.assertEqual(self.get_receipt().sold_amount, 0)
+
+    def test_reconcile_sold_amounts(self):
+        call_command('fncs_reconcile_sold_amounts')
+        self.assertEqual(self.get_receipt().sold_amount, 3)
+        self.assertEqual(CropReceipt.mismatched_sold_amounts(), [])
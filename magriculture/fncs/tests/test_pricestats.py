@@ -0,0 +1,94 @@
+"""Tests for magriculture.fncs.pricestats."""
+# Python
+from datetime import datetime
+
+# Django
+from django.template import Context, Template
+from django.test import TestCase
+
+# Project
+from magriculture.fncs.models.props import PriceSummary
+from magriculture.fncs.pricestats import calculate, price_stats
+from magriculture.fncs.tests import utils
+
+
+class CalculateTestCase(TestCase):
+
+    def test_stats(self):
+        stats, = calculate([[10.0, 20.0, 30.0, 40.0]])
+        self.assertEqual(stats.prices, [10.0, 20.0, 30.0, 40.0])
+        self.assertEqual(stats.mean, 25.0)
+        self.assertEqual(stats.last_price, 10.0)
+        self.assertEqual((stats.minimum, stats.maximum), (10.0, 40.0))
+        self.assertEqual(stats.deviations, [40.0, 80.0, 120.0, 160.0])
+        self.assertEqual(stats.moving_averages, [20.0, 30.0, None, None])
+        self.assertAlmostEqual(stats.volatility, 0.1039349)
+
+    def test_series_of_different_lengths(self):
+        short, empty, single = calculate([[4.0, 2.0], [], [5.0]], window=2)
+        self.assertEqual(short.mean, 3.0)
+        self.assertEqual(short.moving_averages, [3.0, None])
+        self.assertEqual(short.volatility, 0.0)
+        self.assertEqual(empty.prices, [])
+        self.assertEqual(empty.last_price, None)
+        self.assertEqual(single.deviations, [100.0])
+        self.assertEqual(single.moving_averages, [None])
+        self.assertEqual(single.volatility, None)
+
+    def test_nothing(self):
+        self.assertEqual(calculate([]), [])
+        self.assertEqual(calculate([[]])[0].prices, [])
+
+
+class PriceStatsTestCase(TestCase):
+
+    def setUp(self):
+        self.market = utils.create_market("market", utils.create_district(
+            "district", utils.create_province("province")))
+        self.crop = utils.create_crop("potatoes", units=["boxes", "bags"])
+        self.boxes, self.bags = self.crop.units.order_by('name').reverse()
+        for unit, prices in [(self.boxes, [10.0, 20.0]), (self.bags, [5.0])]:
+            summary = PriceSummary(
+                source=PriceSummary.TRANSACTION, market=self.market,
+                crop=self.crop, unit=unit)
+            summary.set_prices(prices, datetime.now())
+            summary.save()
+
+    def key(self, unit, source=PriceSummary.TRANSACTION):
+        return (source, self.market.pk, self.crop.pk, unit.pk)
+
+    def test_price_stats(self):
+        keys = [self.key(self.boxes), self.key(self.bags),
+                self.key(self.boxes, PriceSummary.OFFER)]
+        with self.assertNumQueries(1):
+            stats = price_stats(keys)
+        self.assertEqual(stats[keys[0]].mean, 15.0)
+        self.assertEqual(stats[keys[1]].prices, [5.0])
+        self.assertEqual(stats[keys[2]].prices, [])
+        self.assertEqual(price_stats([]), {})
+
+    def test_tags(self):
+        template = Template(
+            "{% load fncs_tags %}"
+            "{% average_crop_price market crop unit %} "
+            "{% price_sparkline market crop unit %}")
+        context = {'market': self.market, 'crop': self.crop,
+                   'unit': self.boxes}
+        stats = price_stats([self.key(self.boxes)])
+        with self.assertNumQueries(0):
+            rendered = template.render(Context(dict(
+                context, price_stats=stats)))
+        self.assertTrue(rendered.startswith("15.00 "))
+        self.assertIn("chd=t:66.6666666667,133.333333333&", rendered)
+        self.assertIn("chxl=0:|10 ZMK|", rendered)
+        # without the view's stats every tag reads its own
+        with self.assertNumQueries(2):
+            self.assertEqual(template.render(Context(context)), rendered)
+
+    def test_empty_tags(self):
+        template = Template(
+            "{% load fncs_tags %}"
+            "{% opening_price_sparkline market crop unit %}")
+        rendered = template.render(Context({
+            'market': self.market, 'crop': self.crop, 'unit': self.boxes}))
+        self.assertIn("No opening prices yet", rendered)
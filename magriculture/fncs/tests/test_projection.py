@@ -0,0 +1,68 @@
+"""Tests for magriculture.fncs.projection."""
+# Python
+import csv
+
+# Django
+from django.contrib import admin
+from django.test import TestCase
+
+# Project
+from magriculture.fncs.actions import ExportAsCSVWithFK
+from magriculture.fncs.errors import ProjectionException
+from magriculture.fncs.models.actors import GroupMembership
+from magriculture.fncs.models.props import Transaction
+from magriculture.fncs.projection import Projection
+from magriculture.fncs.tests import utils
+
+
+class ProjectionTestCase(TestCase):
+    field_names = ['id', 'crop_receipt__farmer__actor__name',
+                   'crop_receipt__crop', 'crop_receipt__market', 'amount']
+
+    def setUp(self):
+        self.receipt = utils.create_crop_receipt(amount=150)
+        self.transactions = [utils.create_transaction(self.receipt)
+                             for i in range(5)]
+
+    def expected_row(self, transaction):
+        return [str(transaction.pk),
+                self.receipt.farmer.actor.name.encode('utf-8'),
+                self.receipt.crop.name.encode('utf-8'),
+                self.receipt.market.name.encode('utf-8'),
+                str(float(transaction.amount))]
+
+    def test_invalid_paths(self):
+        for field_name in ['missing', 'crop_receipt__missing',
+                           'amount__name', 'crop_receipt__farmer__crops']:
+            self.assertRaises(ProjectionException, Projection, Transaction,
+                              ['id', field_name])
+
+    def test_rows(self):
+        projection = Projection(Transaction, self.field_names, batch_size=2)
+        queryset = Transaction.objects.order_by('-pk')
+        # per batch of 2 one query each for the crops and markets
+        with self.assertNumQueries(7):
+            rows = list(projection.rows(queryset))
+        self.assertEqual(rows, [self.expected_row(transaction) for transaction
+                                in reversed(self.transactions)])
+
+    def test_null_relation(self):
+        membership = GroupMembership.objects.create(
+            farmer=self.receipt.farmer, crop=self.receipt.crop,
+            district=self.receipt.market.district, agent=None)
+        projection = Projection(GroupMembership, ['id', 'agent'])
+        self.assertEqual(
+            list(projection.rows(GroupMembership.objects.filter(
+                pk=membership.pk))),
+            [[str(membership.pk), 'None']])
+
+    def test_export_action(self):
+        export = ExportAsCSVWithFK([(field_name, field_name.upper())
+                                    for field_name in self.field_names])
+        response = export(admin.ModelAdmin(Transaction, admin.site), None,
+                          Transaction.objects.order_by('pk'))
+        rows = list(csv.reader(response.content.splitlines()))
+        self.assertEqual(rows[0], [field_name.upper()
+                                   for field_name in self.field_names])
+        self.assertEqual(rows[1:], [self.expected_row(transaction)
+                                    for transaction in self.transactions])
@@ -1,7 +1,10 @@
+from datetime import datetime, timedelta
+
 from django.test import TestCase
 from django.contrib.auth.models import User
 from magriculture.fncs.tests import utils
 from magriculture.fncs.models import Transaction
+from magriculture.fncs.models.props import PriceSummary
 
 class TransactionTestCase(TestCase):
     def setUp(self):
@@ -26,3 +29,71 @@ class TransactionTestCase(TestCase):
 
         price_history = Transaction.price_history_for(market, crop, unit)
         self.assertEquals(list(price_history), [20.0] * 100)
+
+
+class PriceSummaryTestCase(TestCase):
+
+    def setUp(self):
+        self.farmer = utils.create_farmer()
+        self.market = utils.create_market("market",
+                                          self.farmer.districts.all()[0])
+        self.agent = utils.create_agent()
+        self.crop = utils.create_crop("potatoes")
+        self.unit = utils.create_crop_unit("boxes")
+
+    def sell(self, price, **kwargs):
+        receipt = self.agent.take_in_crop(self.market, self.farmer, 1,
+                                          self.unit, self.crop)
+        if kwargs:
+            return Transaction.objects.create(
+                crop_receipt=receipt, amount=1, price=price, **kwargs)
+        return self.agent.register_sale(receipt, 1, price)
+
+    def get_summary(self, source=PriceSummary.TRANSACTION):
+        return PriceSummary.summary_for(source, self.market, self.crop,
+                                        self.unit)
+
+    def test_summary_updated_on_sale(self):
+        self.assertEqual(self.get_summary(), None)
+        for price in range(1, 13):
+            self.sell(price)
+        summary = self.get_summary()
+        self.assertEqual(summary.price_list(),
+                         [12.0, 11.0, 10.0, 9.0, 8.0, 7.0, 6.0, 5.0, 4.0, 3.0])
+        self.assertEqual(summary.mean, 7.5)
+        self.assertEqual(summary.last_price, 12.0)
+
+    def test_summary_refreshed_for_older_sale(self):
+        self.sell(10)
+        self.sell(20)
+        self.sell(5, created_at=datetime.now() - timedelta(days=1))
+        self.assertEqual(self.get_summary().price_list(), [20.0, 10.0, 5.0])
+
+    def test_summary_created_from_history(self):
+        self.sell(10)
+        PriceSummary.objects.all().delete()
+        self.sell(20)
+        self.assertEqual(self.get_summary().price_list(), [20.0, 10.0])
+
+    def test_summary_updated_on_delete(self):
+        first = self.sell(10)
+        second = self.sell(20)
+        second.delete()
+        self.assertEqual(self.get_summary().price_list(), [10.0])
+        first.delete()
+        self.assertEqual(self.get_summary(), None)
+
+    def test_offer_summary(self):
+        monitor = utils.create_market_monitor()
+        monitor.register_offer(self.market, self.crop, self.unit, 10, 20)
+        monitor.register_offer(self.market, self.crop, self.unit, 20, 30)
+        summary = self.get_summary(PriceSummary.OFFER)
+        self.assertEqual(summary.price_list(), [25.0, 15.0])
+        self.assertEqual(summary.mean, 20.0)
+
+    def test_rebuild(self):
+        self.sell(10)
+        self.sell(20)
+        PriceSummary.objects.all().delete()
+        self.assertEqual(PriceSummary.rebuild(), 1)
+        self.assertEqual(self.get_summary().price_list(), [20.0, 10.0])
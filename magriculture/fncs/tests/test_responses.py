@@ -0,0 +1,114 @@
+"""Tests for magriculture.fncs.responses."""
+# Python
+import json
+
+# Django
+from django.core.cache import get_cache
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.client import Client
+
+# Project
+from magriculture.fncs.models.props import Crop
+from magriculture.fncs.responses import response_cache, ResponseCache
+from magriculture.fncs.tests import utils
+
+
+class ResponseCacheTestCase(TestCase):
+
+    def setUp(self):
+        # the test settings disable the response cache
+        self.default_cache = response_cache.cache
+        response_cache.cache = get_cache(
+            'django.core.cache.backends.locmem.LocMemCache',
+            LOCATION='test-responses')
+        response_cache.cache.clear()
+        self.client = Client()
+        self.crop = utils.create_crop("potatoes")
+        self.market = utils.create_market("market", utils.create_district(
+            "district", utils.create_province("province")))
+
+    def tearDown(self):
+        response_cache.cache.clear()
+        response_cache.cache = self.default_cache
+
+    def url(self, resource_name):
+        return reverse('fncs:api_dispatch_list',
+                       kwargs={'resource_name': resource_name,
+                               'api_name': 'v1'})
+
+    def get(self, resource_name, **params):
+        response = self.client.get(self.url(resource_name), params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def names(self, response):
+        return [obj["name"] for obj in json.loads(response.content)["objects"]]
+
+    def test_hit(self):
+        response = self.get('crop')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            cached = self.get('crop')
+        self.assertEqual(cached['X-Cache'], 'HIT')
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['Content-Type'], response['Content-Type'])
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_stats(self):
+        response_cache.hits = response_cache.misses = 0
+        self.assertEqual(response_cache.stats()['hit_rate'], 0.0)
+        for i in range(4):
+            self.get('crop')
+        self.assertEqual(response_cache.stats(), {
+            'hits': 3, 'misses': 1, 'hit_rate': 0.75})
+
+    def test_version(self):
+        cache = ResponseCache('django.core.cache.backends.locmem.LocMemCache',
+                              timeout=60)
+        version = cache.version(Crop)
+        self.assertEqual(cache.version(Crop), version)
+        cache.invalidate(Crop)
+        self.assertNotEqual(cache.version(Crop), version)
+
+    def test_not_modified(self):
+        etag = self.get('crop')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url('crop'),
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, '')
+        self.assertEqual(response['ETag'], etag)
+
+    def test_invalidated_on_save(self):
+        self.assertEqual(self.names(self.get('crop')), ["potatoes"])
+        etag = self.get('crop')['ETag']
+        utils.create_crop("apples")
+        response = self.client.get(self.url('crop'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(self.names(response), ["apples", "potatoes"])
+        self.crop.delete()
+        self.assertEqual(self.names(self.get('crop')), ["apples"])
+
+    def test_invalidated_by_model(self):
+        self.get('crop')
+        self.get('market')
+        Crop.objects.create(name="apples")
+        self.assertEqual(self.get('crop')['X-Cache'], 'MISS')
+        self.assertEqual(self.get('market')['X-Cache'], 'HIT')
+        self.market.name = "another market"
+        self.market.save()
+        self.assertEqual(self.names(self.get('market')), ["another market"])
+
+    def test_by_request(self):
+        self.get('crop')
+        self.assertEqual(self.get('crop', depth=0)['X-Cache'], 'MISS')
+        self.assertEqual(self.get('crop', depth=0)['X-Cache'], 'HIT')
+        self.assertEqual(self.get('cropunit')['X-Cache'], 'MISS')
+
+    def test_errors_not_cached(self):
+        for i in range(2):
+            response = self.client.get(self.url('crop'), {'depth': 'x'})
+            self.assertEqual(response.status_code, 400)
+            self.assertFalse(response.has_header('X-Cache'))
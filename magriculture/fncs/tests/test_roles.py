@@ -0,0 +1,124 @@
+"""Tests for magriculture.fncs.roles."""
+# Django
+from django.contrib.auth.models import AnonymousUser, User
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+# Project
+from magriculture.fncs.decorators import SpecificRightsRequired
+from magriculture.fncs.errors import ActorException
+from magriculture.fncs.models.actors import Agent, Farmer
+from magriculture.fncs.roles import ActorRoles, RolesMiddleware, get_roles
+from magriculture.fncs.tests import utils
+
+
+class ActorRolesTestCase(TestCase):
+
+    def setUp(self):
+        self.agent = utils.create_agent()
+        self.actor = self.agent.actor
+        self.farmer = Farmer.objects.create(actor=self.actor)
+
+    def test_load(self):
+        with self.assertNumQueries(1):
+            roles = ActorRoles.load(self.actor)
+        self.assertEqual(roles.role_ids, {
+            'agent': [self.agent.pk],
+            'farmer': [self.farmer.pk],
+        })
+        with self.assertNumQueries(0):
+            self.assertTrue(roles.is_agent())
+            self.assertFalse(roles.is_extensionofficer())
+            self.assertEqual(roles.get('agent'), self.agent)
+            self.assertEqual(roles.get('agent').actor, self.actor)
+            self.assertEqual(roles.get('marketmonitor'), None)
+            self.assertEqual(roles.get('fba'), None)
+        with self.assertNumQueries(1):
+            self.assertEqual(roles.get('farmer'), self.farmer)
+            self.assertEqual(roles.get('farmer'), self.farmer)
+
+    def test_bare_role_queries(self):
+        agent = ActorRoles.load(self.actor).get('agent')
+        market = utils.create_market('market', self.farmer.districts.create(
+            name='district', province=utils.create_province('province')))
+        agent.markets.add(market)
+        self.assertEqual(list(self.agent.markets.all()), [market])
+
+    def test_more_than_one(self):
+        Agent.objects.create(actor=self.actor)
+        roles = ActorRoles.load(self.actor)
+        self.assertTrue(roles.is_agent())
+        self.assertRaises(ActorException, roles.get, 'agent')
+
+    def test_actor_methods(self):
+        ActorRoles.load(self.actor)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.actor.as_agent(), self.agent)
+            self.assertTrue(self.actor.is_agent())
+            self.assertFalse(self.actor.is_extensionofficer())
+            self.assertEqual(self.actor.as_extensionofficer(), None)
+            self.assertEqual(self.actor.as_marketmonitor(), None)
+            self.assertEqual(self.actor.as_fba(), None)
+
+    def test_as_agent_without_agent(self):
+        actor = utils.create_generic_user().get_profile()
+        ActorRoles.load(actor)
+        self.assertRaises(ActorException, actor.as_agent)
+
+    def test_for_user(self):
+        user = User.objects.get(pk=self.actor.user_id)
+        with self.assertNumQueries(2):
+            roles = ActorRoles.for_user(user)
+            self.assertEqual(roles.actor, self.actor)
+            self.assertEqual(user.get_profile(), self.actor)
+            self.assertTrue(user.get_profile().is_agent())
+            self.assertTrue(user.actor.is_agent())
+
+    def test_for_anonymous_user(self):
+        with self.assertNumQueries(0):
+            roles = ActorRoles.for_user(AnonymousUser())
+        self.assertEqual(roles.actor, None)
+        self.assertFalse(roles.is_agent())
+
+
+class RolesMiddlewareTestCase(TestCase):
+
+    def setUp(self):
+        self.agent = utils.create_agent()
+        self.factory = RequestFactory()
+
+    def get(self):
+        request = self.factory.get('/')
+        request.user = User.objects.get(pk=self.agent.actor.user_id)
+        return request
+
+    def test_lazy(self):
+        request = self.get()
+        with self.assertNumQueries(0):
+            RolesMiddleware().process_request(request)
+        with self.assertNumQueries(2):
+            self.assertTrue(request.roles.is_agent())
+            self.assertEqual(request.roles.actor.as_agent(), self.agent)
+
+    def test_decorator(self):
+        @SpecificRightsRequired(agent=True)
+        def view(request):
+            return HttpResponse(request.roles.actor.as_agent().pk)
+
+        request = self.get()
+        RolesMiddleware().process_request(request)
+        with self.assertNumQueries(2):
+            response = view(request)
+        self.assertEqual(response.content, str(self.agent.pk))
+
+    def test_decorator_without_middleware(self):
+        @SpecificRightsRequired(ext_officer=True)
+        def view(request):
+            return HttpResponse('ok')
+
+        request = self.get()
+        request.user = User.objects.get(
+            pk=utils.create_extension_officer().actor.user_id)
+        self.assertEqual(view(request).content, 'ok')
+        self.assertTrue(get_roles(request).is_extensionofficer())
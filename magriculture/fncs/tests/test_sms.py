@@ -0,0 +1,74 @@
+"""Tests for magriculture.sms."""
+# Django
+from django.test import TestCase
+
+# Project
+from magriculture import sms
+from magriculture.fncs.tests.fake_vumigo import FakeVumiGo
+
+
+class VumiGoSenderTestCase(TestCase):
+
+    def setUp(self):
+        self.fake_vumigo = FakeVumiGo()
+        self.fake_vumigo.start()
+        self.sender = sms.VumiGoSender(self.fake_vumigo.url, 'account',
+                                       'conversation', 'token', pool_size=4)
+
+    def tearDown(self):
+        self.sender.close()
+        self.fake_vumigo.stop()
+
+    def test_send_sms(self):
+        reply = self.sender.send_sms('27761234567', 'hello')
+        self.assertEqual(reply['to_addr'], '27761234567')
+        self.assertEqual(self.fake_vumigo.requests, [
+            ('/api/v1/go/http_api/conversation/messages.json',
+             {'to_addr': '27761234567', 'content': 'hello'}),
+        ])
+
+    def test_send_sms_reuses_connection(self):
+        for i in range(5):
+            self.sender.send_sms('27761234567', 'hello %d' % (i,))
+        self.assertEqual(len(self.fake_vumigo.requests), 5)
+        self.assertEqual(self.fake_vumigo.connections, 1)
+
+    def test_send_sms_failure(self):
+        self.fake_vumigo.set_failures(1)
+        self.assertRaises(sms.SmsSendingError, self.sender.send_sms,
+                          '27761234567', 'hello')
+
+    def test_send_sms_connection_error(self):
+        # nothing listens on the port once the fake is closed
+        closed = FakeVumiGo()
+        closed.server.server_close()
+        sender = sms.VumiGoSender(closed.url, 'account', 'conversation',
+                                  'token')
+        self.assertRaises(sms.SmsSendingError, sender.send_sms,
+                          '27761234567', 'hello')
+
+    def test_send_bulk(self):
+        messages = [('2776123456%d' % (i,), 'hello %d' % (i,))
+                    for i in range(10)]
+        results = self.sender.send_bulk(messages)
+        self.assertEqual([(result['to_addr'], result['content'])
+                          for result in results], messages)
+        self.assertEqual(len(self.fake_vumigo.requests), 10)
+        self.assertTrue(self.fake_vumigo.connections <= 4)
+
+    def test_send_bulk_failures(self):
+        self.fake_vumigo.set_failures(3)
+        results = self.sender.send_bulk(
+            [('27761234567', 'hello %d' % (i,)) for i in range(10)])
+        failed = [result for result in results
+                  if isinstance(result, sms.SmsSendingError)]
+        self.assertEqual(len(failed), 3)
+
+
+class LoggingSenderTestCase(TestCase):
+
+    def test_send_bulk(self):
+        sender = sms.LoggingSender()
+        self.assertEqual(sender.send_bulk([('27761234567', 'hello'),
+                                           ('27761234568', 'hello')]),
+                         [None, None])
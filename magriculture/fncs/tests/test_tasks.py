@@ -5,17 +5,22 @@ from zipfile import ZipFile
 import csv
 
 # Django
+from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 from django.test import TestCase
 from django.test.utils import override_settings
 from django.core import mail
 
 # Project
+from magriculture import sms
 from magriculture.fncs import tasks
+from magriculture.fncs.tests.fake_vumigo import FakeVumiGo
 from magriculture.fncs.tests import utils
+from magriculture.fncs.models.jobs import Job
 from magriculture.fncs.models.props import Message
 from magriculture.fncs.models.props import CropReceipt
 from magriculture.fncs.tasks import export_transactions
+from magriculture.fncs.utils import pk_ranges, filter_by_spec
 
 
 # Settings override to allows for exceptions to be caught and change the test runner
@@ -99,6 +104,218 @@ class TestTasksFunction(TestCase):
         self.assertEqual(message[0].sender,
                          days_4.agent.actor)
 
+    def test_reconcile_crop_receipts(self):
+        created_at = datetime.today() - timedelta(days=4)
+        receipts = [utils.create_crop_receipt(created_at=created_at,
+                                              amount=10)
+                    for i in range(6)]
+        sold_out, partly_sold = receipts[:2]
+        sold_out.sell(10)
+        partly_sold.sell(4)
+        job = Job.objects.create(pk='job')
+        for first, last in [(receipts[0], receipts[2]),
+                            (receipts[3], receipts[5])]:
+            job.jobchunk_set.create(first_pk=first.pk, last_pk=last.pk)
+        # the reads, the update, the insert and the delivery of the
+        # messages don't depend on the number of receipts
+        days_ago = datetime.today() - timedelta(days=3)
+        with self.assertNumQueries(11):
+            tasks.reconcile_crop_receipts('job', receipts[0].pk,
+                                          receipts[2].pk, days_ago)
+        self.assertEqual(tasks.job_progress('job'), (1, 2))
+        with self.assertNumQueries(11):
+            tasks.reconcile_crop_receipts('job', receipts[3].pk,
+                                          receipts[5].pk, days_ago)
+
+        reconciled = dict(CropReceipt.objects.values_list('pk', 'reconciled'))
+        self.assertFalse(reconciled[sold_out.pk])
+        self.assertEqual(
+            set(pk for pk, value in reconciled.items() if value),
+            set(r.pk for r in receipts[1:]))
+        message = Message.objects.get(
+            content="Sorry but 6.0 %s of %s have not been sold" % (
+                partly_sold.unit.name, partly_sold.crop.name))
+        self.assertEqual(message.recipient, partly_sold.farmer.actor)
+        self.assertEqual(message.sender, partly_sold.agent.actor)
+        self.assertEqual(message.status, Message.SENT)
+        self.assertEqual(Message.objects.filter(status=Message.SENT).count(),
+                         5)
+
+        # chunks that are done are skipped
+        with self.assertNumQueries(1):
+            tasks.reconcile_crop_receipts('job', receipts[0].pk,
+                                          receipts[2].pk, days_ago)
+        # already reconciled receipts are skipped
+        with self.assertNumQueries(3):
+            tasks.reconcile_crop_receipts('another job', receipts[0].pk,
+                                          receipts[5].pk, days_ago)
+        self.assertEqual(Message.objects.count(), 5)
+
+    def test_reconcile_crop_receipts_in_parallel(self):
+        receipt = utils.create_crop_receipt(
+            created_at=datetime.today() - timedelta(days=4), amount=10)
+        queued = []
+
+        def bulk_create(model, objs):
+            # a chunk running alongside stores the same message meanwhile
+            message = objs[0]
+            parallel = Message.objects.create(
+                sender_id=message.sender_id,
+                recipient_id=message.recipient_id, content=message.content,
+                to_addr=message.to_addr, status=Message.PENDING)
+            queued.append(parallel.pk)
+            return default_bulk_create(model, objs)
+
+        def deliver(message_ids):
+            queued.extend(message_ids)
+
+        default_bulk_create = tasks.bulk_create
+        default_deliver = Message.__dict__['deliver']
+        tasks.bulk_create = bulk_create
+        Message.deliver = staticmethod(deliver)
+        try:
+            tasks.reconcile_crop_receipts(
+                'job', receipt.pk, receipt.pk,
+                datetime.today() - timedelta(days=3))
+        finally:
+            tasks.bulk_create, Message.deliver = (default_bulk_create,
+                                                  default_deliver)
+        self.assertEqual(len(queued), len(set(queued)))
+        self.assertEqual(len(queued), 2)
+
+
+class DeliverMessagesTestCase(TestCase):
+
+    def setUp(self):
+        self.fake_vumigo = FakeVumiGo()
+        self.fake_vumigo.start()
+        self.default_sender = sms.default_sender
+        sms.default_sender = sms.VumiGoSender(
+            self.fake_vumigo.url, 'account', 'conversation', 'token')
+        self.agent = utils.create_agent()
+        self.farmer = utils.create_farmer()
+
+    def tearDown(self):
+        sms.default_sender.close()
+        sms.default_sender = self.default_sender
+        self.fake_vumigo.stop()
+
+    def test_message_delivered(self):
+        message = self.agent.actor.send_message_to_farmer(self.farmer, 'hi')
+        message = Message.objects.get(pk=message.pk)
+        self.assertEqual(message.status, Message.SENT)
+        self.assertEqual(message.attempts, 1)
+        self.assertTrue(message.sent_at)
+        self.assertEqual(self.fake_vumigo.requests, [
+            ('/api/v1/go/http_api/conversation/messages.json',
+             {'to_addr': message.to_addr, 'content': 'hi'}),
+        ])
+
+    def test_message_without_msisdn(self):
+        self.farmer.actor.identity_set.all().delete()
+        message = self.agent.actor.send_message_to_farmer(self.farmer, 'hi')
+        self.assertEqual(message.status, Message.NO_ADDRESS)
+        self.assertEqual(self.fake_vumigo.requests, [])
+
+    def test_message_retried(self):
+        self.fake_vumigo.set_failures(2)
+        message = self.agent.actor.send_message_to_farmer(self.farmer, 'hi')
+        message = Message.objects.get(pk=message.pk)
+        self.assertEqual(message.status, Message.SENT)
+        self.assertEqual(message.attempts, 3)
+        self.assertEqual(len(self.fake_vumigo.requests), 3)
+
+    def test_message_failed(self):
+        self.fake_vumigo.set_failures(100)
+        message = self.agent.actor.send_message_to_farmer(self.farmer, 'hi')
+        message = Message.objects.get(pk=message.pk)
+        self.assertEqual(message.status, Message.FAILED)
+        self.assertEqual(message.attempts, settings.SMS_MAX_RETRIES + 1)
+        self.assertEqual(message.sent_at, None)
+
+    def test_batched_delivery(self):
+        farmers = [utils.create_farmer(msisdn=str(27761234570 + i))
+                   for i in range(3)]
+        message_ids = [
+            self.agent.actor.queue_message(farmer.actor, 'hi', None).pk
+            for farmer in farmers]
+        self.assertEqual(self.fake_vumigo.requests, [])
+        with self.settings(SMS_BATCH_SIZE=2):
+            Message.deliver(message_ids)
+        self.assertEqual(
+            sorted(payload['to_addr']
+                   for _, payload in self.fake_vumigo.requests),
+            ['27761234570', '27761234571', '27761234572'])
+        self.assertEqual(Message.objects.filter(
+            status=Message.SENT).count(), 3)
+
+    def test_message_delivered_once(self):
+        message = self.agent.actor.queue_message(self.farmer.actor, 'hi',
+                                                 None)
+        # queued again, e.g. by deliver_pending_messages
+        Message.deliver([message.pk, message.pk])
+        tasks.deliver_messages([message.pk])
+        self.assertEqual(len(self.fake_vumigo.requests), 1)
+        message = Message.objects.get(pk=message.pk)
+        self.assertEqual(message.status, Message.SENT)
+        self.assertEqual(message.attempts, 1)
+
+    def test_deliver_pending_messages(self):
+        message = self.agent.actor.queue_message(self.farmer.actor, 'hi',
+                                                 None)
+        tasks.deliver_pending_messages(minutes=5)
+        self.assertEqual(self.fake_vumigo.requests, [])
+        Message.objects.filter(pk=message.pk).update(
+            created_at=datetime.now() - timedelta(minutes=10))
+        tasks.deliver_pending_messages(minutes=5)
+        self.assertEqual(Message.objects.get(pk=message.pk).status,
+                         Message.SENT)
+
+    def test_deliver_lost_messages(self):
+        message = self.agent.actor.queue_message(self.farmer.actor, 'hi',
+                                                 None)
+        Message.objects.filter(pk=message.pk).update(
+            status=Message.SENDING, claimed_at=datetime.now())
+        tasks.deliver_pending_messages(minutes=5)
+        self.assertEqual(self.fake_vumigo.requests, [])
+        Message.objects.filter(pk=message.pk).update(
+            claimed_at=datetime.now() - timedelta(
+                seconds=settings.SMS_SENDING_TIMEOUT + 1))
+        tasks.deliver_pending_messages(minutes=5)
+        self.assertEqual(Message.objects.get(pk=message.pk).status,
+                         Message.SENT)
+
+    def test_deliver_retried_messages(self):
+        message = self.agent.actor.queue_message(self.farmer.actor, 'hi',
+                                                 None)
+        # the last attempt raised instead of scheduling a retry
+        Message.objects.filter(pk=message.pk).update(
+            attempts=2, claimed_at=datetime.now() - timedelta(
+                seconds=settings.SMS_RETRY_DELAY * 3))
+        tasks.deliver_pending_messages(minutes=5)
+        self.assertEqual(self.fake_vumigo.requests, [])
+        Message.objects.filter(pk=message.pk).update(
+            claimed_at=datetime.now() - timedelta(
+                seconds=settings.SMS_RETRY_DELAY * 5))
+        tasks.deliver_pending_messages(minutes=5)
+        message = Message.objects.get(pk=message.pk)
+        self.assertEqual(message.status, Message.SENT)
+        self.assertEqual(message.attempts, 3)
+
+    def test_claim_released_on_error(self):
+        message = self.agent.actor.queue_message(self.farmer.actor, 'hi',
+                                                 None)
+
+        def send_bulk(messages):
+            raise ValueError("boom")
+
+        sms.default_sender.send_bulk = send_bulk
+        self.assertRaises(ValueError, tasks.deliver_messages, [message.pk])
+        message = Message.objects.get(pk=message.pk)
+        self.assertEqual(message.status, Message.PENDING)
+        self.assertEqual(message.attempts, 1)
+
+
 class TransactionExportTestCase(TestCase):
 
     def setUp(self):
@@ -130,8 +347,8 @@ class TransactionExportTestCase(TestCase):
                     'crop_receipt__agent__actor__gender']
         labels = ['TransactionID', 'Farmer Name', 'Gender', 'Transaction Date', 'Crop', 'Unit', 'No of Units',
                     'Total Price Achieved', 'Market', 'Agent', 'Agent Gender']
-        queryset = [transaction, transaction2]
-        export_transactions(field_names, labels, queryset, self.user)
+        filter_spec = {'pk_ranges': [[transaction.pk, transaction2.pk]]}
+        export_transactions(field_names, labels, filter_spec, self.user)
         [email] = mail.outbox
         self.assertEqual(
             email.recipients(), [self.user.email])
@@ -144,3 +361,113 @@ class TransactionExportTestCase(TestCase):
         self.assertEqual(
             set(transaction_ids),
             set(['1','2']))
+
+    def export_rows(self, filter_spec, chunk_size=None):
+        field_names = ['id', 'crop_receipt__farmer__actor__name',
+                       'crop_receipt__crop', 'crop_receipt__market',
+                       'crop_receipt__agent__actor__name']
+        labels = ['TransactionID', 'Farmer Name', 'Crop', 'Market', 'Agent']
+        export_transactions(field_names, labels, filter_spec, self.user,
+                            chunk_size=chunk_size)
+        [email] = mail.outbox
+        fp = self.get_zipfile_attachment(
+            email, 'transactions-export.zip', 'transactions-export.csv')
+        return list(csv.DictReader(fp))
+
+    def test_export_in_chunks(self):
+        receipt = utils.create_crop_receipt(amount=150)
+        transactions = [utils.create_transaction(receipt) for i in range(5)]
+        rows = self.export_rows({}, chunk_size=2)
+        self.assertEqual([row['TransactionID'] for row in rows],
+                         [str(transaction.pk) for transaction in transactions])
+        self.assertEqual(set(row['Crop'] for row in rows),
+                         set([receipt.crop.name]))
+        self.assertEqual(set(row['Market'] for row in rows),
+                         set([receipt.market.name]))
+        self.assertEqual(set(row['Agent'] for row in rows),
+                         set([receipt.agent.actor.name]))
+
+    def test_export_queries_per_chunk(self):
+        receipt = utils.create_crop_receipt(amount=150)
+        for i in range(10):
+            utils.create_transaction(receipt)
+        # one query to drop old jobs, a query per chunk of 5 and one more
+        # to partition the transactions, two to store the job and chunks
+        # and per chunk one query for the transactions, one each for the
+        # crops and markets and two to check and mark the chunk as done
+        with self.assertNumQueries(16):
+            rows = self.export_rows({}, chunk_size=5)
+        self.assertEqual(len(rows), 10)
+
+    def test_export_filter_spec(self):
+        receipt = utils.create_crop_receipt(amount=150)
+        transactions = [utils.create_transaction(receipt) for i in range(3)]
+        rows = self.export_rows({'pk_ranges': [[transactions[1].pk,
+                                                transactions[1].pk]]})
+        self.assertEqual([row['TransactionID'] for row in rows],
+                         [str(transactions[1].pk)])
+
+
+class FanOutTestCase(TestCase):
+
+    def test_partition(self):
+        self.assertEqual(tasks.partition(CropReceipt.objects.all(), 2), [])
+        receipts = [utils.create_crop_receipt(amount=10) for i in range(5)]
+        first, last = receipts[0].pk, receipts[-1].pk
+        self.assertEqual(tasks.partition(CropReceipt.objects.all(), 2), [
+            [first, first + 1], [first + 2, first + 3], [last, last]])
+        self.assertEqual(tasks.partition(CropReceipt.objects.filter(
+            pk__in=[first, last]), 10), [[first, last]])
+        # sparse selections don't make empty chunks
+        with self.assertNumQueries(4):
+            self.assertEqual(tasks.partition(CropReceipt.objects.filter(
+                pk__in=[first, first + 2, last]), 1), [
+                [first, first], [first + 2, first + 2], [last, last]])
+
+    def test_job_progress(self):
+        self.assertEqual(tasks.job_progress('unknown'), None)
+        created_at = datetime.today() - timedelta(days=4)
+        for i in range(5):
+            utils.create_crop_receipt(created_at=created_at, amount=10)
+        with self.settings(RECONCILE_CHUNK_SIZE=2):
+            job_id = tasks.query_crop_receipt_for_old_crops(3)
+        self.assertEqual(tasks.job_progress(job_id), (3, 3))
+        self.assertFalse(CropReceipt.objects.filter(
+            reconciled=False).exists())
+
+    def test_export_nothing(self):
+        user = utils.create_generic_user()
+        user.email = "test@example.com"
+        user.save()
+        job_id = export_transactions(['id'], ['TransactionID'], {}, user)
+        self.assertEqual(tasks.job_progress(job_id), (0, 0))
+        [email] = mail.outbox
+        [(_, content, _)] = email.attachments
+        zipfile = ZipFile(StringIO(content), 'r')
+        self.assertEqual(zipfile.read('transactions-export.csv'),
+                         'TransactionID\r\n')
+
+
+class FilterSpecTestCase(TestCase):
+
+    def test_pk_ranges(self):
+        self.assertEqual(pk_ranges([]), [])
+        self.assertEqual(pk_ranges([7, 1, 2, 3, 5, 8]),
+                         [[1, 3], [5, 5], [7, 8]])
+
+    def test_filter_by_spec(self):
+        receipts = [utils.create_crop_receipt(amount=i) for i in range(1, 6)]
+        pks = [receipt.pk for receipt in receipts]
+        queryset = CropReceipt.objects.order_by('pk')
+        self.assertEqual(list(filter_by_spec(queryset, {})), receipts)
+        self.assertEqual(list(filter_by_spec(queryset, {'pk_ranges': []})),
+                         [])
+        self.assertEqual(
+            list(filter_by_spec(queryset, {
+                'pk_ranges': pk_ranges([pks[0], pks[1], pks[3]])})),
+            [receipts[0], receipts[1], receipts[3]])
+        self.assertEqual(
+            list(filter_by_spec(queryset, {
+                'filters': {u'amount__gte': 3},
+                'pk_ranges': pk_ranges(pks[:4])})),
+            receipts[2:4])
@@ -764,9 +764,19 @@ class PricesTestCase(FNCSTestCase):
         self.assertContains(response, 'Average price 10.00 ZMK')
         self.assertContains(response, 'apples sold in boxes')
 
-    @skip("not implemented yet")
     def test_crop_unit(self):
-        pass
+        receipt = self.take_in(10, 'boxes', 'apples')
+        utils.sell(receipt, 4, 10)
+        utils.sell(receipt, 6, 20)
+        response = self.client.get(reverse('fncs:crop_unit', kwargs={
+            'market_pk': self.market.pk,
+            'crop_pk': receipt.crop.pk,
+            'unit_pk': receipt.unit.pk,
+        }))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response,
+                            'Average price 15.00 ZMK, last sold at 20.00 ZMK')
+        self.assertContains(response, 'at ZMK 10.00 each')
 
     @skip("not implemented yet")
     def test_market_offers(self):
@@ -63,6 +63,7 @@ urlpatterns = patterns('',
     url(r'^agents/(?P<agent_pk>\d+)/$', views.agent, name='agent'),
     url(r'^todo/.*', views.todo, name='todo'),
     url(r'^api/v1/highest_markets', api.get_highest_markets, name='api_get_highest_markets'),
+    url(r'^api/v1/price_summary', api.get_price_summary, name='api_get_price_summary'),
 )
 
 # ==========================================================
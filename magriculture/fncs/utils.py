@@ -1,4 +1,6 @@
 from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
 from optparse import make_option
 import sys
 import xlrd
@@ -7,6 +9,55 @@ def effective_page_range_for(page, paginator, delta=3):
     return [p for p in range(page.number - delta, page.number + delta + 1)
                 if (p > 0 and p <= paginator.num_pages)]
 
+def bulk_create(model, objects):
+    """
+    Insert the objects with `bulk_create`, split into as many statements
+    as needed to stay below SQLite's limit of 999 variables per statement.
+
+    Like `bulk_create` in Django 1.4 the primary keys are not set on the
+    objects.
+    """
+    if connection.vendor == 'sqlite':
+        batch_size = max(1, 999 // len(model._meta.fields))
+    else:
+        batch_size = 1000
+    for i in range(0, len(objects), batch_size):
+        model.objects.bulk_create(objects[i:i + batch_size])
+
+def pk_ranges(pks):
+    """
+    Collapse primary keys into a list of inclusive ``[first, last]``
+    ranges of consecutive keys, to describe a selection compactly.
+    """
+    ranges = []
+    for pk in sorted(pks):
+        if ranges and pk == ranges[-1][1] + 1:
+            ranges[-1][1] = pk
+        else:
+            ranges.append([pk, pk])
+    return ranges
+
+def filter_by_spec(queryset, filter_spec):
+    """
+    Filter the queryset by a picklable filter spec, a dict with the
+    optional keys:
+
+    * ``filters``: keyword arguments for `queryset.filter()`
+    * ``pk_ranges``: ranges of primary keys as returned by `pk_ranges`
+    """
+    filters = filter_spec.get('filters') or {}
+    queryset = queryset.filter(
+        **dict((str(key), value) for key, value in filters.items()))
+    ranges = filter_spec.get('pk_ranges')
+    if ranges is not None:
+        if not ranges:
+            return queryset.none()
+        q = Q()
+        for first, last in ranges:
+            q |= Q(pk__gte=first, pk__lte=last)
+        queryset = queryset.filter(q)
+    return queryset
+
 def read_excel_sheet(filename):
     book = xlrd.open_workbook(filename, encoding_override="cp1252")
     # only using first sheet
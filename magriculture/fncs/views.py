@@ -13,11 +13,12 @@ import urllib
 from magriculture.fncs.models.actors import Farmer, FarmerGroup, Agent
 from magriculture.fncs.models.props import (Transaction, Crop, GroupMessage,
                                             CropUnit, Offer, CropReceipt,
-                                            DirectSale)
+                                            DirectSale, PriceSummary)
 from magriculture.fncs.models.geo import Market, Ward, District
 from magriculture.fncs import forms
 from magriculture.fncs import utils
 from magriculture.fncs.decorators import SpecificRightsRequired
+from magriculture.fncs.pricestats import price_stats
 
 
 @login_required
@@ -29,7 +30,7 @@ def home(request):
 @login_required
 @SpecificRightsRequired(agent=True)
 def farmers(request):
-    actor = request.user.get_profile()
+    actor = request.roles.actor
     agent = actor.as_agent()
     farmers = agent.farmers.all()
     q = request.GET.get('q', '')
@@ -47,7 +48,7 @@ def farmers(request):
 @login_required
 @SpecificRightsRequired(agent=True)
 def farmer_new(request):
-    actor = request.user.get_profile()
+    actor = request.roles.actor
     agent = actor.as_agent()
     if request.POST:
         form = forms.FarmerForm(request.POST)
@@ -216,7 +217,7 @@ def farmer(request, farmer_pk):
 @SpecificRightsRequired(agent=True)
 def farmer_sales(request, farmer_pk):
     farmer = get_object_or_404(Farmer, pk=farmer_pk)
-    agent = request.user.get_profile().as_agent()
+    agent = request.roles.actor.as_agent()
     paginator = Paginator(agent.sales_for(farmer), 5)
     page = paginator.page(request.GET.get('p', 1))
     return render_to_response('farmers/sales.html', {
@@ -241,7 +242,7 @@ def farmer_sale(request, farmer_pk, sale_pk):
 @login_required
 @SpecificRightsRequired(agent=True)
 def farmer_new_sale(request, farmer_pk):
-    actor = request.user.get_profile()
+    actor = request.roles.actor
     agent = actor.as_agent()
 
     farmer = get_object_or_404(Farmer, pk=farmer_pk)
@@ -260,7 +261,7 @@ def farmer_new_sale_detail(request, farmer_pk):
     crop_receipt = get_object_or_404(CropReceipt,
                                      pk=request.GET.get('crop_receipt'))
     farmer = get_object_or_404(Farmer, pk=farmer_pk)
-    actor = request.user.get_profile()
+    actor = request.roles.actor
     agent = actor.as_agent()
 
     redirect_to_farmer = HttpResponseRedirect(reverse('fncs:farmer', kwargs={
@@ -294,7 +295,7 @@ def farmer_new_sale_detail(request, farmer_pk):
 @login_required
 @SpecificRightsRequired(agent=True)
 def farmer_messages(request, farmer_pk):
-    actor = request.user.get_profile()
+    actor = request.roles.actor
     farmer = get_object_or_404(Farmer, pk=farmer_pk)
     paginator = Paginator(farmer.actor.receivedmessages_set
                           .filter(sender=actor), 5)
@@ -309,7 +310,7 @@ def farmer_messages(request, farmer_pk):
 @login_required
 @SpecificRightsRequired(agent=True)
 def farmer_new_message(request, farmer_pk):
-    actor = request.user.get_profile()
+    actor = request.roles.actor
     agent = actor.as_agent()
     farmer = get_object_or_404(Farmer, pk=farmer_pk)
     redirect_to_farmer = HttpResponseRedirect(reverse('fncs:farmer', kwargs={
@@ -338,7 +339,7 @@ def farmer_new_message(request, farmer_pk):
 @login_required
 @SpecificRightsRequired(agent=True)
 def farmer_notes(request, farmer_pk):
-    actor = request.user.get_profile()
+    actor = request.roles.actor
     agent = actor.as_agent()
     farmer = get_object_or_404(Farmer, pk=farmer_pk)
     paginator = Paginator(agent.notes_for(farmer), 5)
@@ -353,7 +354,7 @@ def farmer_notes(request, farmer_pk):
 @login_required
 @SpecificRightsRequired(agent=True)
 def farmer_new_note(request, farmer_pk):
-    actor = request.user.get_profile()
+    actor = request.roles.actor
     agent = actor.as_agent()
     farmer = get_object_or_404(Farmer, pk=farmer_pk)
     redirect_to_farmer_notes = HttpResponseRedirect(
@@ -388,7 +389,7 @@ def farmer_profile(request, farmer_pk):
 @login_required
 @SpecificRightsRequired(agent=True)
 def group_messages(request):
-    actor = request.user.get_profile()
+    actor = request.roles.actor
     paginator = Paginator(GroupMessage.objects.filter(sender=actor), 5)
     page = paginator.page(request.GET.get('p', 1))
     # import pdb; pdb.set_trace()
@@ -401,7 +402,7 @@ def group_messages(request):
 @login_required
 @SpecificRightsRequired(agent=True, ext_officer=True)
 def group_message_new(request):
-    actor = request.user.get_profile()
+    actor = request.roles.actor
     agent = actor.as_agent() if actor.is_agent() else None
 
     choose_district = None  # Used to determine if render district field
@@ -433,19 +434,14 @@ def group_message_new(request):
                         messages.error(request, 'Invalid crop, please select your crop.')
                         return HttpResponseRedirect(reverse('fncs:group_message_new'))
 
-                    # Dynamically setting the district Choice field
+                    # Dynamically setting the District Choice field,
+                    # annotated with the total count of farmers in
+                    # each District
                     form.fields["district"].queryset = (District.
                                                     objects.
-                                                    filter(farmer_district__agent_farmer=agent).
-                                                    filter(farmer_district__crops=data["crop"]).
-                                                    all().
-                                                    distinct())
-
-                    # Setting the total count of farmers in the District
+                                                    with_farmer_counts(agent, data["crop"]))
                     form.fields["district"].label_from_instance = (lambda obj: "%s (%s)" %
-                                                                   (obj.name,
-                                                                    obj.get_farmer_count(agent,
-                                                                                         data["crop"])))
+                                                                   (obj.name, obj.farmer_count))
 
                 # If form.is_valid() first time round, hide the crop widget
                 form.fields['crop'].widget = HiddenInput()
@@ -476,7 +472,7 @@ def group_message_new(request):
 @login_required
 @SpecificRightsRequired(agent=True, ext_officer=True)
 def group_message_write(request):
-    actor = request.user.get_profile()
+    actor = request.roles.actor
 
     crop = request.GET.getlist('crop')
     district = request.GET.getlist('district')
@@ -531,7 +527,7 @@ def sales(request):
 @login_required
 @SpecificRightsRequired(agent=True)
 def sales_crops(request):
-    agent = request.user.get_profile().as_agent()
+    agent = request.roles.actor.as_agent()
     paginator = Paginator(agent.transactions(), 5)
     page = paginator.page(request.GET.get('p', 1))
     return render_to_response('sales_crops.html', {
@@ -664,11 +660,14 @@ def crop(request, market_pk, crop_pk):
     crop = get_object_or_404(Crop, pk=crop_pk)
     paginator = Paginator(crop.units.all(), 5)
     page = paginator.page(request.GET.get('p', 1))
+    stats = price_stats([(PriceSummary.TRANSACTION, market.pk, crop.pk, unit.pk)
+                         for unit in page.object_list])
     return render_to_response('crops/show.html', {
         'crop': crop,
         'market': market,
         'paginator': paginator,
-        'page': page
+        'page': page,
+        'price_stats': stats,
     }, context_instance=RequestContext(request))
 
 
@@ -680,14 +679,19 @@ def crop_unit(request, market_pk, crop_pk, unit_pk):
     unit = get_object_or_404(CropUnit, pk=unit_pk)
     transactions = Transaction.objects.filter(
         crop_receipt__unit=unit, crop_receipt__crop=crop,
-        crop_receipt__market=market)
+        crop_receipt__market=market).select_related(
+        'crop_receipt__farmer__actor', 'crop_receipt__unit',
+        'crop_receipt__crop')
     paginator = Paginator(transactions, 5)
     page = paginator.page(request.GET.get('p', 1))
+    summary = PriceSummary.summary_for(PriceSummary.TRANSACTION, market, crop,
+                                       unit)
 
     return render_to_response('crops/unit.html', {
         'crop': crop,
         'unit': unit,
         'market': market,
+        'summary': summary,
         'paginator': paginator,
         'page': page
     }, context_instance=RequestContext(request))
@@ -757,11 +761,14 @@ def offer(request, market_pk, crop_pk):
     units = list(set([offer.unit for offer in offers]))
     paginator = Paginator(units, 5)
     page = paginator.page(request.GET.get('p', 1))
+    stats = price_stats([(PriceSummary.OFFER, market.pk, crop.pk, unit.pk)
+                         for unit in page.object_list])
     return render_to_response('offers/show.html', {
         'crop': crop,
         'market': market,
         'paginator': paginator,
-        'page': page
+        'page': page,
+        'price_stats': stats,
     }, context_instance=RequestContext(request))
 
 
@@ -799,7 +806,7 @@ def market_new_offer(request, *args, **kwargs):
 @login_required
 @SpecificRightsRequired(agent=True)
 def market_register_offer(request, market_pk):
-    actor = request.user.get_profile()
+    actor = request.roles.actor
     marketmonitor = actor.as_marketmonitor()
     market = get_object_or_404(Market, pk=market_pk)
     if request.method == "POST":
@@ -832,7 +839,7 @@ def market_register_offer(request, market_pk):
 @login_required
 @SpecificRightsRequired(agent=True)
 def inventory(request):
-    actor = request.user.get_profile()
+    actor = request.roles.actor
     agent = actor.as_agent()
     paginator = Paginator(agent.cropreceipts_available(), 5)
     page = paginator.page(request.GET.get('p', 1))
@@ -846,7 +853,7 @@ def inventory(request):
 @login_required
 @SpecificRightsRequired(agent=True)
 def inventory_sale(request):
-    actor = request.user.get_profile()
+    actor = request.roles.actor
     agent = actor.as_agent()
     farmer_pk = request.GET.get('farmer')
     if farmer_pk:
@@ -867,7 +874,7 @@ def inventory_sale(request):
 @login_required
 @SpecificRightsRequired(agent=True)
 def inventory_sale_details(request):
-    actor = request.user.get_profile()
+    actor = request.roles.actor
     agent = actor.as_agent()
     farmer = get_object_or_404(Farmer, pk=request.REQUEST.get('farmer'))
     crop_receipts = agent.cropreceipts_available_for(farmer)
@@ -905,7 +912,7 @@ def inventory_sale_details(request):
 @login_required
 @SpecificRightsRequired(agent=True)
 def inventory_intake(request):
-    actor = request.user.get_profile()
+    actor = request.roles.actor
     agent = actor.as_agent()
     form = forms.CropReceiptStep1Form(initial={
         'agent': agent,
@@ -919,7 +926,7 @@ def inventory_intake(request):
 @login_required
 @SpecificRightsRequired(agent=True)
 def inventory_intake_details(request):
-    actor = request.user.get_profile()
+    actor = request.roles.actor
     agent = actor.as_agent()
     market = get_object_or_404(Market, pk=request.REQUEST.get('market'))
     crop = get_object_or_404(Crop, pk=request.REQUEST.get('crop'))
@@ -965,7 +972,7 @@ def inventory_intake_details(request):
 @login_required
 @SpecificRightsRequired(agent=True)
 def inventory_direct_sale(request, receipt_pk):
-    actor = request.user.get_profile()
+    actor = request.roles.actor
     agent = actor.as_agent()
     crop_receipt = get_object_or_404(CropReceipt, pk=receipt_pk)
     if request.method == "POST":
@@ -28,6 +28,16 @@ DATABASES = {
     }
 }
 
+# The gunicorn & Celery workers share the identity, response and location
+# index caches through memcached, a cache in every process would serve
+# stale PINs and responses from the workers that didn't see the change.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': '127.0.0.1:11211',
+    }
+}
+
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
 # although not all choices may be available on all operating systems.
@@ -104,6 +114,7 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'magriculture.fncs.roles.RolesMiddleware',
 )
 
 ROOT_URLCONF = 'magriculture.urls'
@@ -183,7 +194,47 @@ SMS_CONFIG = {
     "logger": "magriculture.sms",
 }
 
-API_LIMIT_PER_PAGE = 0
+# Outbound SMSes are delivered by the Celery workers in batches of this size
+SMS_BATCH_SIZE = 50
+# How often a failed SMS is retried, the delay doubles for every retry
+SMS_MAX_RETRIES = 5
+SMS_RETRY_DELAY = 60  # seconds
+# SMSes still being sent after this long are assumed to have been lost with
+# their worker and are delivered again
+SMS_SENDING_TIMEOUT = 10 * 60  # seconds
+# Group messages are stored and queued for this many farmers at a time
+GROUP_MESSAGE_CHUNK_SIZE = 500
+# Exports and periodic jobs are split into Celery subtasks that each cover
+# this many objects, see magriculture.fncs.tasks.fan_out
+EXPORT_CHUNK_SIZE = 2000
+RECONCILE_CHUNK_SIZE = 1000
+# Where the export subtasks write their part of the export, this needs to
+# be shared by all Celery workers. Defaults to the temporary directory.
+EXPORT_DIR = None
+
+# How to search for wards & districts by name, use
+# 'magriculture.fncs.locations.TrigramLocationBackend' to search with
+# PostgreSQL's pg_trgm instead of an index in every worker.
+FNCS_LOCATION_SEARCH_BACKEND = 'magriculture.fncs.locations.NGramLocationBackend'
+# The Django cache backend or alias to cache identities by msisdn in, this
+# needs to be shared by all the workers, see magriculture.fncs.identities
+FNCS_IDENTITY_CACHE = 'default'
+FNCS_IDENTITY_CACHE_TIMEOUT = 5 * 60
+# The Django cache backend or alias to cache the API responses for crops,
+# units and locations in, this needs to be shared by all the workers too,
+# see magriculture.fncs.responses
+FNCS_RESPONSE_CACHE = 'default'
+FNCS_RESPONSE_CACHE_TIMEOUT = 5 * 60
+# Where the NGramLocationBackend keeps its index between restarts,
+# see magriculture.fncs.locations
+FNCS_LOCATION_INDEX_PATH = None
+# How many seconds the NGramLocationBackend uses an index for before
+# rebuilding it, in case a change to the locations wasn't broadcast
+FNCS_LOCATION_INDEX_TIMEOUT = 60 * 60
+
+# The default page size of the API lists, clients can ask for up to
+# 1000 objects a page or stream all of them, see magriculture.fncs.api
+API_LIMIT_PER_PAGE = 100
 
 
 # Celery configuration
@@ -201,10 +252,14 @@ CELERYBEAT_SCHEDULER = 'djcelery.schedulers.DatabaseScheduler'
 
 CELERYBEAT_SCHEDULE = {
     'query_crop_receipt_for_old_crops-every-60-minutes': {
-        'task': 'magriculture.fncs.query_crop_receipt_for_old_crops',
+        'task': 'magriculture.fncs.tasks.query_crop_receipt_for_old_crops',
         'schedule': timedelta(minutes=60),
         'args': (DAYS_PRODUCE_IS_FRESH,),
     },
+    'deliver_pending_messages-every-10-minutes': {
+        'task': 'magriculture.fncs.tasks.deliver_pending_messages',
+        'schedule': timedelta(minutes=10),
+    },
 }
 
 DEFAULT_FROM_EMAIL = "no-reply@limalinks.co.zm"
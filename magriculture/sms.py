@@ -2,8 +2,10 @@
 
 import json
 import logging
+from multiprocessing.pool import ThreadPool
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from django.conf import settings
 
@@ -30,27 +32,75 @@ class SmsSender(object):
         """
         raise NotImplementedError
 
+    def _send_result(self, message):
+        to_addr, content = message
+        try:
+            return self.send_sms(to_addr, content)
+        except SmsSendingError, e:
+            return e
+
+    def send_bulk(self, messages):
+        """Send SMSes for an iterable of (to_addr, content) pairs.
+
+        Returns a list with a result for each message, in the same order.
+        The result is the value returned by `send_sms` or the
+        SmsSendingError raised for that message.
+
+        Sub-classes may override this to send concurrently.
+        """
+        return [self._send_result(message) for message in messages]
+
 
 class VumiGoSender(SmsSender):
     def __init__(self, api_url, account_id, conversation_id,
-                 conversation_token):
+                 conversation_token, pool_size=10, connect_timeout=5,
+                 read_timeout=30):
         self.api_url = api_url
         self.account_id = account_id
         self.conversation_id = conversation_id
         self.conversation_token = conversation_token
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        # Keep connections to Vumi Go alive between messages, the pool is
+        # sized for send_bulk's threads.
+        self.session = requests.Session()
+        self.session.auth = (self.account_id, self.conversation_token)
+        self.session.headers.update({
+            "Content-Type": "application/json; charset=utf-8",
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
     def _api_url(self):
         return "%s/%s/messages.json" % (self.api_url, self.conversation_id)
 
+    def close(self):
+        """Close the pooled connections."""
+        self.session.close()
+
+    def send_bulk(self, messages):
+        messages = list(messages)
+        if len(messages) < 2:
+            return super(VumiGoSender, self).send_bulk(messages)
+        pool = ThreadPool(min(self.pool_size, len(messages)))
+        try:
+            return pool.map(self._send_result, messages)
+        finally:
+            pool.close()
+            pool.join()
+
     def send_sms(self, to_addr, content):
-        auth = (self.account_id, self.conversation_token)
-        headers = {"Content-Type": "application/json; charset=utf-8"}
         payload = {
             "content": content,
             "to_addr": to_addr,
         }
-        response = requests.put(self._api_url(), auth=auth, headers=headers,
-                                data=json.dumps(payload))
+        try:
+            response = self.session.put(self._api_url(),
+                                        data=json.dumps(payload),
+                                        timeout=self.timeout)
+        except requests.RequestException, e:
+            raise SmsSendingError("Failed to send SMS: %s" % (e,))
 
         if response.status_code != requests.codes.ok:
             raise SmsSendingError("Failed to send SMS, response code: %d,"
@@ -82,6 +132,7 @@ def create_sender(sms_config):
     if sms_config is None:
         raise SmsSetupError("SMS sending not configured."
                             " Set SMS_SETTINGS in settings.py")
+    sms_config = dict(sms_config)
     sender_type = sms_config.pop('sender_type', None)
     if sender_type is None:
         raise SmsSetupError("SMS_SETTINGS contains no sender_type")
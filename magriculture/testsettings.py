@@ -44,4 +44,19 @@ if os.environ.get('MAGRICULTURE_FAST_TESTS'):
         }
     }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 NOSE_ARGS = ['-eworkers', '-m^test']
+
+# Deliver queued SMSes inline instead of through the broker
+CELERY_ALWAYS_EAGER = True
+
+# Identities are cached across tests that roll back the database, the
+# identity cache tests install a cache of their own
+FNCS_IDENTITY_CACHE = 'django.core.cache.backends.dummy.DummyCache'
+# Likewise for the API responses
+FNCS_RESPONSE_CACHE = 'django.core.cache.backends.dummy.DummyCache'